@@ -0,0 +1,97 @@
+'''
+Compare the speed of the face detectors on the images and videos of test_res.
+
+python bench_detector.py --detectors mtcnn,dlib --media ./test_res
+python bench_detector.py --detectors mtcnn --dump ./test_res/boxes.txt
+python bench_detector.py --detectors file --boxes ./test_res/boxes.txt
+'''
+import argparse
+import os
+import os.path as osp
+import time
+import cv2
+from detector import get_detector, save_detections, frame_key
+
+IMAGE_EXT = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXT = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def load_media(root, max_frames):
+    """
+    Returns:
+        keys: image names and video frame ids
+        frames: bgr images
+    """
+    keys, frames = [], []
+    for name in sorted(os.listdir(root)):
+        path = osp.join(root, name)
+        ext = osp.splitext(name)[1].lower()
+        if ext in IMAGE_EXT:
+            img = cv2.imread(path)
+            if img is not None:
+                keys.append(frame_key(path))
+                frames.append(img)
+        elif ext in VIDEO_EXT:
+            cap = cv2.VideoCapture(path)
+            index = 0
+            while cap.isOpened() and index < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                keys.append(frame_key(path, index))
+                frames.append(frame)
+                index += 1
+            cap.release()
+    return keys, frames
+
+
+def bench(detector, keys, frames, batch_size, repeat):
+    # warm up, first call also builds the mtcnn pyramid plans
+    detector.detect(frames[:batch_size], keys[:batch_size])
+    tic = time.time()
+    for _ in range(repeat):
+        results = []
+        for i in range(0, len(frames), batch_size):
+            results.extend(detector.detect(frames[i:i+batch_size], keys[i:i+batch_size]))
+    cost = (time.time() - tic) / repeat
+    return cost, results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark face detectors.')
+    parser.add_argument('--detectors', type=str, default='mtcnn,dlib', help='mtcnn, dlib, file')
+    parser.add_argument('--media', type=str, default='./test_res', help='images and videos to detect on')
+    parser.add_argument('--max_frames', type=int, default=100, help='frames read from each video')
+    parser.add_argument('--bs', type=int, default=8, help='frames per detect call')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--use_gpu', type=int, default=0)
+    parser.add_argument('--max_side', type=int, default=0, help='mtcnn: downscale frames to this longest side')
+    parser.add_argument('--boxes', type=str, default='', help='file detector input')
+    parser.add_argument('--dump', type=str, default='', help='save detections of the first detector')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    keys, frames = load_media(args.media, args.max_frames)
+    assert len(frames) > 0, 'no image or video in %s' % args.media
+    print('%d frames from %s' % (len(frames), args.media))
+
+    print('%-8s %10s %10s %8s' % ('detector', 'ms/frame', 'frames/s', 'faces'))
+    for i, name in enumerate(args.detectors.split(',')):
+        name = name.strip()
+        if name == 'mtcnn':
+            import mxnet as mx
+            ctx = mx.gpu(0) if args.use_gpu else mx.cpu()
+            detector = get_detector(name, ctx=ctx, max_side=args.max_side or None)
+        elif name == 'file':
+            detector = get_detector(name, path=args.boxes)
+        else:
+            detector = get_detector(name)
+        cost, results = bench(detector, keys, frames, args.bs, args.repeat)
+        faces = sum(len(boxes) for boxes, _ in results)
+        print('%-8s %10.2f %10.1f %8d' % (name, cost*1000/len(frames), len(frames)/cost, faces))
+        if args.dump and i == 0:
+            save_detections(args.dump, keys, results)
+            print('save detections to %s' % args.dump)
@@ -0,0 +1,119 @@
+'''
+Accuracy vs speed of the input size / stem stride of the pose net.
+
+Each config is size:stem_stride[:folder], folder holding the best_pose
+export train.py wrote for it (--input_size size --stem_stride stride).
+Without a folder only the cost of a randomly initialized net is measured.
+
+python bench_input.py --net v3 --version small --configs 112:1,96:1,80:1,64:1,112:2
+python bench_input.py --configs 112:1:./weight/v3_small_alpha1,80:1:./weight/v3_small_80
+'''
+import argparse
+import json
+import os.path as osp
+import time
+import numpy as np
+import mxnet as mx
+from model_zoo.mobilenetv3 import get_mobilenet_v3
+from model_zoo.mobilenetv2 import get_mobilenet_v2
+from model_zoo.mobilefacenet import get_mobile_facenet
+
+
+def build_net(args, stem_stride, folder, ctx):
+    if folder:
+        net = mx.gluon.SymbolBlock.imports(osp.join(folder, 'best_pose-symbol.json'), ['data'],
+                                           osp.join(folder, 'best_pose-0000.params'), ctx=ctx)
+    else:
+        if args.net == 'v3':
+            net = get_mobilenet_v3(args.version, multiplier=args.width_mult, use_fc=args.use_fc, stem_stride=stem_stride)
+        elif args.net == 'v2':
+            assert stem_stride == 1, 'stem_stride is only configurable for v3'
+            net = get_mobilenet_v2(multiplier=args.width_mult, use_fc=args.use_fc)
+        else:
+            assert stem_stride == 1, 'stem_stride is only configurable for v3'
+            net = get_mobile_facenet(use_fc=args.use_fc)
+        net.initialize(init=mx.init.Xavier(), ctx=ctx)
+    net.hybridize(static_alloc=True, static_shape=True)
+    return net
+
+
+def count_macs(sym, shape):
+    """multiply-accumulates of the convolutions and dense layers for one sample"""
+    internals = sym.get_internals()
+    arg_shapes, out_shapes, _ = internals.infer_shape(data=shape)
+    args = dict(zip(internals.list_arguments(), arg_shapes))
+    outs = dict(zip(internals.list_outputs(), out_shapes))
+    nodes = json.loads(sym.tojson())['nodes']
+    macs = 0
+    for node in nodes:
+        if node['op'] not in ('Convolution', 'FullyConnected'):
+            continue
+        weight = args[nodes[node['inputs'][1][0]]['name']]
+        out = outs[node['name'] + '_output']
+        macs += int(np.prod(out[1:])) * int(np.prod(weight[1:]))
+    return macs
+
+
+def mae(net, dataset, bs, ctx):
+    loader = mx.gluon.data.DataLoader(dataset, batch_size=bs, num_workers=4, last_batch='keep')
+    idx_tensor = mx.nd.arange(66, ctx=ctx)
+    err, total = 0, 0
+    for data, _, cont_label in loader:
+        outputs = net(data.as_in_context(ctx))
+        if isinstance(outputs, (list, tuple)):
+            pyr = outputs[1]
+        else:  # decode the bins
+            prob = mx.nd.softmax(outputs.reshape((0, 3, 66)), axis=2)
+            pyr = mx.nd.sum(prob * idx_tensor, axis=2) * 3 - 99
+        err += mx.nd.abs(pyr - cont_label.as_in_context(ctx)).sum().asscalar()
+        total += len(data)
+    return err / total / 3
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='MAE vs latency per input size and stem stride.')
+    parser.add_argument('--configs', type=str, default='112:1,96:1,80:1,64:1,112:2', help='size:stem_stride[:folder],...')
+    parser.add_argument('--net', type=str, default='v3')
+    parser.add_argument('--version', type=str, default='small')
+    parser.add_argument('--width_mult', type=float, default=1)
+    parser.add_argument('--use_fc', type=int, default=1)
+    parser.add_argument('--bs', type=int, default=1, help='latency batch size')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--use_gpu', type=int, default=0)
+    parser.add_argument('--data_dir', type=str, default='/home/lfx/Data/AFLW2000')
+    parser.add_argument('--anno_txt', type=str, default='./data/AFLW2000_pose.txt')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    ctx = mx.gpu(0) if args.use_gpu else mx.cpu()
+    has_data = osp.exists(args.data_dir) and osp.exists(args.anno_txt)
+
+    print('| size | stem stride | MMACs | ms (bs %d) | MAE |' % args.bs)
+    print('| :---: | :---: | :---: | :---: | :---: |')
+    for config in args.configs.split(','):
+        config = config.strip().split(':')
+        size, stride = int(config[0]), int(config[1])
+        folder = config[2] if len(config) > 2 else ''
+        assert args.net != 'facenet' or size == 112, 'the 7x7 GDC of MobileFaceNet needs size 112'
+        net = build_net(args, stride, folder, ctx)
+        x = mx.nd.random.uniform(-1, 1, (args.bs, 3, size, size), ctx=ctx)
+        net(x)
+        mx.nd.waitall()
+        tic = time.time()
+        for _ in range(args.repeat):
+            net(x)
+            mx.nd.waitall()
+        cost = (time.time() - tic) / args.repeat * 1000
+
+        sym = net(mx.sym.var('data'))
+        sym = mx.sym.Group(sym) if isinstance(sym, (list, tuple)) else sym
+        macs = count_macs(sym, (1, 3, size, size))
+
+        err = '-'
+        if folder and has_data:
+            from dataset import Dataset
+            err = '%.3f' % mae(net, Dataset(args.data_dir, args.anno_txt, input_size=size, k=0.3), 64, ctx)
+        print('| %d | %d | %.1f | %.2f | %s |' % (size, stride, macs / 1e6, cost, err))
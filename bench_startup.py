@@ -0,0 +1,83 @@
+'''
+Startup time of the entry points, every run in a fresh python process.
+
+Each command is python arguments run from the repo root, the time is the
+wall time of the whole process (interpreter start, imports, argparse).
+With --importtime 1 the slowest imports of every command are listed from
+python -X importtime.
+
+python bench_startup.py --repeat 10
+python bench_startup.py --commands "test.py --help|-c import test" --importtime 1
+'''
+import argparse
+import os
+import os.path as osp
+import shlex
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = osp.dirname(osp.abspath(__file__))
+COMMANDS = ['-c pass',
+            '-c import mxnet',
+            '-c import cv2',
+            '-c import test',
+            'test.py --help',
+            'mxnet2caffe/inference.py --help']
+
+
+def run(command, importtime=False):
+    """wall seconds of `python command`, its return code and stderr (the -X importtime report)"""
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    if command.startswith('-c '):
+        cmd += ['-c', command[3:]]
+    else:
+        cmd += shlex.split(command)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    tic = time.time()
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return time.time() - tic, proc.returncode, proc.stderr.decode()
+
+
+def slowest_imports(report, top):
+    """[(cumulative ms, module)] of the top level imports"""
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented, their time is in the parent's cumulative
+        if name.startswith(' ') and not name.startswith('  '):
+            imports.append((int(cumulative) / 1000., name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Startup time of the entry points')
+    parser.add_argument('--commands', type=str, default='|'.join(COMMANDS), help='python arguments separated by |')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, help='list the slowest imports of every command')
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    commands = [c.strip() for c in args.commands.split('|') if c.strip()]
+    # the first runs fill the page cache
+    for command in commands:
+        _, code, err = run(command)
+        if code != 0:
+            print('python %s failed:\n%s' % (command, err[-500:]))
+    print('| command | median ms | min ms |')
+    print('| :--- | :---: | :---: |')
+    for command in commands:
+        costs = [run(command)[0] * 1000 for _ in range(args.repeat)]
+        print('| python %s | %.0f | %.0f |' % (command, np.median(costs), min(costs)))
+    if args.importtime:
+        for command in commands:
+            print('\npython %s' % command)
+            for ms, name in slowest_imports(run(command, True)[2], args.top):
+                print('  %8.1f ms  %s' % (ms, name))
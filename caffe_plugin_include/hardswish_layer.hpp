@@ -0,0 +1,42 @@
+#ifndef CAFFE_HARDSWISH_LAYER_HPP_
+#define CAFFE_HARDSWISH_LAYER_HPP_
+
+#include <vector>
+
+#include "caffe/blob.hpp"
+#include "caffe/layer.hpp"
+#include "caffe/proto/caffe.pb.h"
+
+#include "caffe/layers/neuron_layer.hpp"
+
+namespace caffe {
+
+/**
+ * @brief HardSwish used in MobileNetV3 @f$ y = x \min(6, \max(0, x + 3)) / 6 @f$.
+ *        Replaces the Power/ReLU6/Power(/Eltwise) chain mxnet exports,
+ *        so the activation is a single pass over the blob.
+ *        Run in-place only for inference: Backward reads the bottom data.
+ */
+template <typename Dtype>
+class HardSwishLayer : public NeuronLayer<Dtype> {
+ public:
+  explicit HardSwishLayer(const LayerParameter& param)
+      : NeuronLayer<Dtype>(param) {}
+
+  virtual inline const char* type() const { return "HardSwish"; }
+
+ protected:
+  virtual void Forward_cpu(const vector<Blob<Dtype>*>& bottom,
+      const vector<Blob<Dtype>*>& top);
+  virtual void Forward_gpu(const vector<Blob<Dtype>*>& bottom,
+      const vector<Blob<Dtype>*>& top);
+
+  virtual void Backward_cpu(const vector<Blob<Dtype>*>& top,
+      const vector<bool>& propagate_down, const vector<Blob<Dtype>*>& bottom);
+  virtual void Backward_gpu(const vector<Blob<Dtype>*>& top,
+      const vector<bool>& propagate_down, const vector<Blob<Dtype>*>& bottom);
+};
+
+}  // namespace caffe
+
+#endif  // CAFFE_HARDSWISH_LAYER_HPP_
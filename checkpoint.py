@@ -0,0 +1,275 @@
+'''
+Resumable training state: a deterministic seekable batch sampler and
+checkpoints of params, trainer states and the loop position.
+
+A checkpoint <prefix>-<num_update>.* is three files:
+    .params  net.save_parameters
+    .states  trainer.save_states, the optimizer with its lr scheduler and num_update
+    .meta    pickled dict of the loop position, metrics and the RNG states
+
+CheckpointWriter writes checkpoints and best_pose exports from a background
+thread: the params are copied to host when saving is requested, the files
+are written to a temporary name and renamed, and old checkpoints beyond the
+last N and best K are removed.
+'''
+import glob
+import os
+import os.path as osp
+import pickle
+import random
+import threading
+import queue
+import numpy as np
+import mxnet as mx
+
+
+class ResumableSampler(object):
+    """
+        shuffled batches of a 'rollover' epoch, from the seed and the epoch only
+
+    All epochs are one stream of permutations of range(length), permutation e
+    seeded by seed + e. Epoch e is the batches of the stream between the
+    samples e*length and (e+1)*length, rounded down to whole batches, so the
+    last incomplete batch of an epoch rolls over to the next one. seeded() also
+    gives every batch the seed [seed, epoch, batch] for its augmentation.
+
+    Parameters:
+    ----------
+        length: samples in the dataset
+        batch_size: int
+        seed: int
+        shuffle: bool, the permutations are range(length) when False
+    """
+    def __init__(self, length, batch_size, seed=0, shuffle=True):
+        self.length = length
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.start = 0
+        self._perm = (None, None)
+
+    def set_epoch(self, epoch, start=0):
+        """the next iteration yields batch start, start+1, ... of epoch"""
+        self.epoch = epoch
+        self.start = start
+
+    def _permutation(self, epoch):
+        if self._perm[0] != epoch:
+            perm = np.random.RandomState(self.seed + epoch).permutation(self.length) \
+                   if self.shuffle else np.arange(self.length)
+            self._perm = (epoch, perm)
+        return self._perm[1]
+
+    def _stream(self, begin, end):
+        """samples [begin, end) of the stream of permutations"""
+        out = []
+        while begin < end:
+            epoch, offset = divmod(begin, self.length)
+            take = min(end - begin, self.length - offset)
+            out.append(self._permutation(epoch)[offset:offset+take])
+            begin += take
+        return np.concatenate(out)
+
+    def _first(self, epoch):
+        """stream position of the first batch of epoch"""
+        return epoch * self.length // self.batch_size * self.batch_size
+
+    def __len__(self):
+        return (self._first(self.epoch + 1) - self._first(self.epoch)) // self.batch_size
+
+    def seeded(self):
+        """(indices, augmentation seed) of the batches __iter__ yields"""
+        first, start = self._first(self.epoch), self.start
+        self.start = 0
+        for batch in range(start, len(self)):
+            begin = first + batch * self.batch_size
+            yield self._stream(begin, begin + self.batch_size).tolist(), [self.seed, self.epoch, batch]
+
+    def __iter__(self):
+        for indices, _ in self.seeded():
+            yield indices
+
+
+def rng_states():
+    return {'numpy': np.random.get_state(), 'python': random.getstate()}
+
+
+def set_rng_states(states, mx_seed):
+    """numpy and python RNG states, mxnet has no getter so it is reseeded with mx_seed,
+    the seed train.step reseeds with after every update"""
+    np.random.set_state(states['numpy'])
+    random.setstate(states['python'])
+    mx.random.seed(mx_seed)
+
+
+def load_checkpoint(prefix, net, trainer, ctx):
+    """load params and trainer states of <prefix> into net and trainer, returns the meta dict"""
+    net.load_parameters(prefix + '.params', ctx=ctx)
+    trainer.load_states(prefix + '.states')
+    with open(prefix + '.meta', 'rb') as f:
+        return pickle.load(f)
+
+
+def latest_checkpoint(folder, name='checkpoint'):
+    """prefix of the checkpoint with the most updates in folder, None without any"""
+    metas = glob.glob(osp.join(folder, '%s-*.meta' % name))
+    if not metas:
+        return None
+    return max(metas, key=lambda m: int(m[:-len('.meta')].rsplit('-', 1)[1]))[:-len('.meta')]
+
+
+def remove_checkpoints(folder, name='checkpoint'):
+    """delete the checkpoints of a previous run in folder, returns how many there were"""
+    metas = glob.glob(osp.join(folder, '%s-*.meta' % name))
+    for path in glob.glob(osp.join(folder, '%s-*' % name)):
+        os.remove(path)
+    return len(metas)
+
+
+def _atomic_write(path, write):
+    """write(tmp_path) then rename to path, readers never see a partial file"""
+    tmp = path + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _save_bytes(data):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return write
+
+
+def params_snapshot(net):
+    """host copies of the params as net.save_parameters names them"""
+    return dict((key, param._reduce()) for key, param in net._collect_params_with_prefix().items())
+
+
+def trainer_snapshot(trainer):
+    """the bytes trainer.save_states writes"""
+    if not trainer._kv_initialized:
+        trainer._init_kvstore()
+    if trainer._params_to_init:
+        trainer._init_params()
+    if trainer._update_on_kvstore:
+        tmp = '.trainer_states.%d' % os.getpid()
+        trainer.save_states(tmp)
+        with open(tmp, 'rb') as f:
+            data = f.read()
+        os.remove(tmp)
+        return data
+    return trainer._updaters[0].get_states(dump_optimizer=True)
+
+
+def export_snapshot(block):
+    """symbol json and params of what block.export writes, block has run forward hybridized"""
+    if not block._cached_graph:
+        raise RuntimeError('hybridize and run forward before exporting')
+    sym = block._cached_graph[1]
+    arg_names, aux_names = set(sym.list_arguments()), set(sym.list_auxiliary_states())
+    params = {}
+    for name, param in block.collect_params().items():
+        if name in arg_names:
+            params['arg:%s' % name] = param._reduce()
+        elif name in aux_names:
+            params['aux:%s' % name] = param._reduce()
+    return sym.tojson(), params
+
+
+class CheckpointWriter(object):
+    """
+        background writer of checkpoints and exports
+
+    Parameters:
+    ----------
+        folder: where checkpoint-<num_update>.* are kept
+        keep_last: int, the newest checkpoints to keep
+        keep_best: int, the checkpoints with the lowest score to keep
+        max_pending: int, snapshots waiting for the disk before save blocks
+    """
+    def __init__(self, folder, keep_last=3, keep_best=1, max_pending=2, name='checkpoint'):
+        self.folder = folder
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.name = name
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        # checkpoints of a previous run, oldest first
+        self._written = []
+        for meta in glob.glob(osp.join(folder, '%s-*.meta' % name)):
+            with open(meta, 'rb') as f:
+                score = pickle.load(f).get('score')
+            prefix = meta[:-len('.meta')]
+            self._written.append((int(prefix.rsplit('-', 1)[1]), prefix, score))
+        self._written.sort()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                self._error = e
+
+    def _put(self, job):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(job)
+
+    def save(self, num_update, net, trainer, meta, score=None):
+        """
+            checkpoint <folder>/<name>-<num_update>, score (lower is better) ranks it for keep_best
+
+        meta is pickled in the writer thread, it must not be changed afterwards.
+        """
+        prefix = osp.join(self.folder, '%s-%08d' % (self.name, num_update))
+        params = params_snapshot(net)
+        states = trainer_snapshot(trainer)
+        meta = dict(meta, score=score)
+
+        def job():
+            _atomic_write(prefix + '.params', lambda path: mx.nd.save(path, params))
+            _atomic_write(prefix + '.states', _save_bytes(states))
+            # the .meta makes the checkpoint visible to latest_checkpoint
+            _atomic_write(prefix + '.meta', _save_bytes(pickle.dumps(meta)))
+            self._written.append((num_update, prefix, score))
+            self._remove_old()
+        self._put(job)
+
+    def export(self, path, block, epoch=0):
+        """what block.export(path, epoch) writes"""
+        sym_json, params = export_snapshot(block)
+
+        def job():
+            _atomic_write('%s-symbol.json' % path, _save_bytes(sym_json.encode()))
+            _atomic_write('%s-%04d.params' % (path, epoch), lambda p: mx.nd.save(p, params))
+        self._put(job)
+
+    def _remove_old(self):
+        keep = set(prefix for _, prefix, _ in self._written[-self.keep_last:]) if self.keep_last > 0 else set()
+        scored = sorted((score, prefix) for _, prefix, score in self._written if score is not None)
+        keep.update(prefix for _, prefix in scored[:self.keep_best])
+        for item in [w for w in self._written if w[1] not in keep]:
+            for ext in ('.meta', '.params', '.states'):
+                if osp.exists(item[1] + ext):
+                    os.remove(item[1] + ext)
+            self._written.remove(item)
+
+    def wait(self):
+        """block until everything requested so far is on disk"""
+        done = threading.Event()
+        self._put(done.set)
+        done.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
@@ -8,6 +8,9 @@
 import scipy.io as sio
 import os
 import argparse
+import json
+import struct
+import multiprocessing
 import cv2
 import numpy as np
 
@@ -31,12 +34,99 @@ def get_bbox(size, mat):
     y_max = max(y[(y>=0)&(y<=h)])
     return [x_min, y_min, x_max, y_max]
 
+def jpeg_size(path):
+    """(width, height) from the SOF marker of a jpeg, without decoding it"""
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            while marker[1] == 0xff:  # fill bytes
+                marker = marker[1:] + f.read(1)
+            if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+                continue
+            length = struct.unpack('>H', f.read(2))[0]
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                h, w = struct.unpack('>xHH', f.read(5))
+                return w, h
+            f.seek(length - 2, 1)
+
+def image_size(path):
+    size = jpeg_size(path)
+    if size is None:
+        h, w = cv2.imread(path).shape[:2]
+        size = (w, h)
+    return size
+
+def parse_anno(job):
+    """
+        annotation line of one image
+
+    Parameters:
+    ----------
+        job: (subset folder, subset name, .mat file name)
+    Returns:
+    -------
+        image name, tab separated line or None for poses beyond 99 degree, (width, height)
+    """
+    _set, ds, _file = job
+    jpg = os.path.join(ds, _file[:-4]+'.jpg')
+    mat = sio.loadmat(os.path.join(_set, _file), variable_names=['Pose_Para', 'pt2d'])
+    pyr = get_pyr_from_mat(mat)
+    if abs(max(pyr)*180/np.pi)>99:
+        return jpg, None, None
+    size = image_size(os.path.join(_set, _file[:-4]+'.jpg'))
+    bbox = get_bbox(size, mat)
+    jpg_anno = [jpg] + [str(i) for i in pyr] + [str(int(round(i))) for i in bbox]
+    return jpg, '\t'.join(jpg_anno), list(size)
+
+def to_records(entries):
+    """
+        structured array of the annotation lines, what dataset.Dataset memory maps
+
+    Parameters:
+    ----------
+        entries: list of (line, (width, height))
+    Returns:
+    -------
+        name (bytes), pyr (degree), bins (of 3 degree in [-99, 99]), bbox, size (width, height)
+    """
+    names = [line.split('\t', 1)[0].encode() for line, _ in entries]
+    dtype = [('name', 'S%d'%max([len(n) for n in names] + [1])), ('pyr', '<f4', 3), ('bins', '<i2', 3),
+             ('bbox', '<i4', 4), ('size', '<i4', 2)]
+    records = np.zeros(len(entries), dtype=dtype)
+    for i, (line, size) in enumerate(entries):
+        line = line.split('\t')
+        pyr = np.array([float(v)*180/np.pi for v in line[1:4]], dtype=np.float32)
+        records[i] = (names[i], pyr, np.digitize(np.clip(pyr, -99, 99), range(-99,100,3))-1,
+                      [int(v) for v in line[4:8]], size)
+    return records
+
+def file_state(_set, _file):
+    """mtime and size of the .mat and its image, the manifest key of an entry"""
+    state = []
+    for name in (_file, _file[:-4]+'.jpg'):
+        st = os.stat(os.path.join(_set, name))
+        state.extend([st.st_mtime_ns, st.st_size])
+    return state
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
 def get_args():
     parser = argparse.ArgumentParser(description='Train head pose by mobilenetv3.')
     # dataset
     parser.add_argument('--data_root', type=str, default='/home/lfx/Data')
     parser.add_argument('--dataset', type=str, default='300W_LP, AFLW2000')
     parser.add_argument('--save_path', type=str, default='./data')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='parse processes')
+    parser.add_argument('--incremental', type=int, default=1, help='only parse files changed since the last run')
+    parser.add_argument('--binary', type=int, default=1, help='also write <dataset>_pose1.npy for dataset.Dataset')
     args = parser.parse_args()
     return args
 
@@ -45,6 +135,7 @@ if __name__ == "__main__":
     data_root = args.data_root
     save_path = args.save_path
     dataset = args.dataset.strip().split(',')
+    pool = multiprocessing.Pool(args.workers)
     for data in dataset:
         data = data.strip()
         print('Parse dataset: %s'%data)
@@ -54,30 +145,36 @@ if __name__ == "__main__":
             dataset_list=['']
         else:
             raise NotImplementedError
-        f = open(os.path.join(save_path, '%s_pose1.txt'%data), 'w')
-        f.write('image_name, pitch, yaw, roll(euler), xmin, ymin, xmax, ymax \n')
+        # image name -> [mat mtime, mat size, jpg mtime, jpg size, line, (width, height)]
+        manifest_path = os.path.join(save_path, '%s_pose1.manifest.json'%data)
+        old_manifest = load_manifest(manifest_path) if args.incremental else {}
+        manifest, jobs = {}, []
         for ds in dataset_list:
             _set = os.path.join(data_root, data, ds)
             print(_set)
-            files_list = os.listdir(_set)
-            for _file in files_list:
+            for _file in sorted(os.listdir(_set)):
                 if _file[-3:]!='mat':
                     continue
                 jpg = os.path.join(ds, _file[:-4]+'.jpg')
-                mat = sio.loadmat(os.path.join(_set, _file))
-                pyr = get_pyr_from_mat(mat)
-                size = cv2.imread(os.path.join(_set, _file[:-4]+'.jpg')).shape[:2]
-                bbox = get_bbox(size, mat)
-                jpg_anno=[]
-                jpg_anno.append(jpg)
-                if abs(max(pyr)*180/np.pi)>99:
-                    continue
-                for i in pyr:
-                    jpg_anno.append(str(i))
-                for i in bbox:
-                    jpg_anno.append(str(int(round(i))))
-                f.write('\t'.join(jpg_anno)+'\n')
-        f.close()
-
-
+                state = file_state(_set, _file)
+                if jpg in old_manifest and old_manifest[jpg][:4]==state and len(old_manifest[jpg])==6:
+                    manifest[jpg] = old_manifest[jpg]
+                else:
+                    manifest[jpg] = state
+                    jobs.append((_set, ds, _file))
+        print('%d files, %d to parse'%(len(manifest), len(jobs)))
+        for jpg, line, size in pool.imap_unordered(parse_anno, jobs, chunksize=64):
+            manifest[jpg] = manifest[jpg][:4] + [line, size]
 
+        with open(os.path.join(save_path, '%s_pose1.txt'%data), 'w') as f:
+            f.write('image_name, pitch, yaw, roll(euler), xmin, ymin, xmax, ymax \n')
+            for jpg, entry in manifest.items():
+                if entry[4] is not None:
+                    f.write(entry[4]+'\n')
+        if args.binary:
+            entries = [entry[4:] for entry in manifest.values() if entry[4] is not None]
+            np.save(os.path.join(save_path, '%s_pose1.npy'%data), to_records(entries))
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+    pool.close()
+    pool.join()
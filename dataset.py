@@ -6,6 +6,7 @@
 @LastEditors: Please set LastEditors
 '''
 import os
+import multiprocessing
 import numpy as np
 import cv2
 import mxnet as mx
@@ -13,30 +14,58 @@ from mxnet.gluon.data.vision import transforms
 
 class Dataset(mx.gluon.data.Dataset):
     # Head pose from 300W-LP or AFLW2000 dataset 
-    def __init__(self, data_dir, file_path, transform=False):
+    def __init__(self, data_dir, file_path, transform=False, input_size=112, k=None):
         """ Args:
                 data_dir: 300W_LP or AFLW2000 dir
-                file_path: 300W_LP_pose.txt or AFLW2000_pose.txt
+                file_path: 300W_LP_pose.txt or AFLW2000_pose.txt, or the .npy of gen_pose.py --binary 1
                 transform: None
-                k: expand ratio
+                input_size: side of the square net input
+                k: expand ratio of the bbox, random in [0.2, 0.4) if None
         """
         self.data_dir = data_dir
+        self.file_path = file_path
+        self.k = k
+        self.input_size = input_size
         self.transform = transform
-        self.lines = self._load_file(file_path)
+        self.records = None
+        if file_path.endswith('.npy'):
+            self.records = np.load(file_path, mmap_mode='r')
+        else:
+            self.lines = self._load_file(file_path)
 
-    def __getitem__(self, index):
+    def _get_anno(self, index):
+        """image name, pyr in degree, bbox, bin labels or None"""
+        if self.records is not None:
+            record = self.records[index]
+            return record['name'].decode(), np.array(record['pyr'], dtype=np.float32), \
+                   [int(i) for i in record['bbox']], np.array(record['bins'], dtype=np.float32)
         line = self.lines[index].split()
-        img_name = line[0]
         # radian to degree
         pyr=np.array([float(i)*180/np.pi for i in line[1:4]], dtype=np.float32)
-        bbox=[int(i) for i in line[4:8]]
+        return line[0], pyr, [int(i) for i in line[4:8]], None
+
+    def __getitem__(self, index):
+        img, bin_label, cont_label = self.get_sample(index)
+        img = self.normalize(img.astype('float32'))
+        return mx.nd.array(img), mx.nd.array(bin_label), mx.nd.array(cont_label)
+
+    def get_sample(self, index):
+        """
+            numpy sample, what the shared memory loader workers write
+
+        Returns:
+        -------
+            img: uint8 3 x input_size x input_size RGB, see normalize
+            bin_label, cont_label: float32 (3, )
+        """
+        img_name, pyr, bbox, bin_label = self._get_anno(index)
         img = cv2.imread(os.path.join(self.data_dir, img_name))
         if img is None:
             print(os.path.join(self.data_dir, img_name))
 
         h, w = img.shape[:2]
         # crop face
-        k = np.random.random_sample() * 0.2 + 0.2  #(0.2-0.4)
+        k = np.random.random_sample() * 0.2 + 0.2 if self.k is None else self.k  #(0.2-0.4)
         bb_w, bb_h = bbox[2]-bbox[0], bbox[3]-bbox[1]
         x_min =np.clip(bbox[0]-0.6*k*abs(bb_w), 0, w)
         y_min =np.clip(bbox[1]-0.6*k*abs(bb_h), 0, h)
@@ -45,7 +74,9 @@ class Dataset(mx.gluon.data.Dataset):
         img = img[int(y_min):int(y_max), int(x_min):int(x_max), :]
 
         if self.transform:
-            img, pyr = self._transform(img, pyr)
+            img, pyr, flip = self._transform(img, pyr)
+            if flip:
+                bin_label = None
         
         # roi_w, roi_h = x_max - x_min, y_max - y_min
         # roi = max(roi_w, roi_h)
@@ -58,30 +89,72 @@ class Dataset(mx.gluon.data.Dataset):
         new[ex_h:(ex_h+h),ex_w:(ex_w+w),:]=img
         
         pyr = np.clip(pyr, -99, 99)
-        bin_label = np.digitize(pyr, range(-99,100,3))-1 
-        bin_label = mx.nd.array(bin_label, dtype='float32')
-        cont_label = mx.nd.array(pyr, dtype='float32')
-        return self._preprocess(new), bin_label, cont_label
+        if bin_label is None:
+            bin_label = np.digitize(pyr, range(-99,100,3))-1 
+        return self._preprocess(new), np.asarray(bin_label, dtype=np.float32), pyr.astype(np.float32)
 
 
     def __len__(self):
-        return len(self.lines)
+        return len(self.records) if self.records is not None else len(self.lines)
     
     def _transform(self, img, pyr):
         # flip
         rnd = np.random.random_sample()
-        if rnd < 0.5:
+        flip = rnd < 0.5
+        if flip:
             pyr[1] *= -1
             pyr[2] *= -1
             img = cv2.flip(img, 1)
-        return img, pyr
+        return img, pyr, flip
     
     def _preprocess(self, img):
-        img = cv2.resize(img, (112, 112))
+        img = cv2.resize(img, (self.input_size, self.input_size))
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = (img.transpose((2,0,1)).astype('float32')-127.5) *  0.0078125
-        return mx.nd.array(img)
+        return img.transpose((2,0,1))
+
+    @staticmethod
+    def normalize(img):
+        """float32 numpy or NDArray image in [0, 255] -> net input"""
+        return (img-127.5) *  0.0078125
     
+    def cache(self, path='', num_workers=0):
+        """
+            every sample preprocessed, for a dataset with a fixed k and no transform
+
+        Parameters:
+        ----------
+            path: .npz to keep them in, reused while len, input_size, k, data_dir and
+                the path, mtime and size of the annotation file match
+            num_workers: processes preprocessing the images
+        Returns:
+        -------
+            images: uint8 N x 3 x input_size x input_size, see normalize
+            bin_labels, cont_labels: float32 N x 3
+        """
+        assert self.k is not None and not self.transform, 'random samples can not be cached'
+        anno = os.stat(self.file_path)
+        key = np.array(repr((len(self), self.input_size, self.k, os.path.abspath(self.data_dir),
+                             os.path.abspath(self.file_path), anno.st_mtime, anno.st_size)))
+        if path and os.path.exists(path):
+            cached = np.load(path)
+            if cached['key'].dtype == key.dtype and np.array_equal(cached['key'], key):
+                return cached['images'], cached['bin_labels'], cached['cont_labels']
+        if num_workers > 0:
+            pool = multiprocessing.Pool(num_workers)
+            samples = pool.map(self.get_sample, range(len(self)), chunksize=64)
+            pool.close()
+            pool.join()
+        else:
+            samples = [self.get_sample(i) for i in range(len(self))]
+        images, bin_labels, cont_labels = [np.stack(i) for i in zip(*samples)]
+        if path:
+            # per process, runs sharing the cache may build it at the same time
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.savez(f, key=key, images=images, bin_labels=bin_labels, cont_labels=cont_labels)
+            os.replace(tmp, path)
+        return images, bin_labels, cont_labels
+
     def _load_file(self, file_path):
         with open(file_path) as f:
             lines = f.readlines()
@@ -0,0 +1,143 @@
+'''
+Face detectors behind one interface.
+
+Every backend implements detect(frames) -> [(boxes, scores), ...] with one
+entry per frame, boxes a float32 n x 4 array (x1, y1, x2, y2) in frame
+pixels and scores a float32 array of n.
+'''
+import os
+import numpy as np
+
+
+def _empty():
+    return np.zeros((0, 4), dtype=np.float32), np.zeros((0, ), dtype=np.float32)
+
+
+class Detector(object):
+    """Base class of the face detectors"""
+    def detect(self, frames, keys=None):
+        """
+        Args:
+            frames: list of bgr images
+            keys: optional list of frame ids (see frame_key),
+                only used by backends that look detections up
+        Returns:
+            list of (boxes n x 4, scores n) per frame
+        """
+        raise NotImplementedError
+
+    def detect_one(self, frame, key=None):
+        return self.detect([frame], None if key is None else [key])[0]
+
+
+class MTCNNDetector(Detector):
+    """MTCNN cascade, RNet/ONet batched over all frames"""
+    def __init__(self, model_folder='./mtcnn/model/', ctx=None, num_worker=4,
+                 max_side=None, rois=None, refine=True, **kwargs):
+        import mxnet as mx
+        from mtcnn.mtcnn import MTCNN
+        ctx = mx.cpu() if ctx is None else ctx
+        self.mtcnn = MTCNN(model_folder, ctx=ctx, num_worker=num_worker, **kwargs)
+        self.max_side = max_side
+        self.rois = rois
+        self.refine = refine
+
+    def detect_face(self, frame):
+        """MTCNN result (bboxes, points) or None, honours max_side and rois"""
+        if self.max_side or self.rois:
+            return self.mtcnn.detect_face_scaled(frame, max_side=self.max_side,
+                                                 rois=self.rois, refine=self.refine)
+        return self.mtcnn.detect_face(frame)
+
+    def detect(self, frames, keys=None):
+        if self.max_side or self.rois:
+            rets = [self.detect_face(f) for f in frames]
+        else:
+            rets = self.mtcnn.detect_faces(frames)
+        results = []
+        for ret in rets:
+            if ret is None:
+                results.append(_empty())
+            else:
+                bboxes = ret[0]
+                results.append((bboxes[:, :4].astype(np.float32), bboxes[:, 4].astype(np.float32)))
+        return results
+
+
+class DlibDetector(Detector):
+    """dlib HOG frontal face detector"""
+    def __init__(self, upsample=0):
+        import dlib
+        self.detector = dlib.get_frontal_face_detector()
+        self.upsample = upsample
+
+    def detect(self, frames, keys=None):
+        results = []
+        for frame in frames:
+            dets, scores, _ = self.detector.run(frame, self.upsample)
+            if len(dets) == 0:
+                results.append(_empty())
+                continue
+            boxes = np.array([(d.left(), d.top(), d.right(), d.bottom()) for d in dets], dtype=np.float32)
+            results.append((boxes, np.array(scores, dtype=np.float32)))
+        return results
+
+
+class FileDetector(Detector):
+    """Precomputed detections, one box per line: key x1 y1 x2 y2 score
+
+    key is frame_key: the image name or <video name>:<frame index>, frames without
+    keys are numbered in the order they are passed to detect.
+    """
+    def __init__(self, path):
+        self.boxes = {}
+        self.count = 0
+        with open(path) as f:
+            for line in f:
+                line = line.split()
+                if len(line) != 6:
+                    continue
+                self.boxes.setdefault(line[0], []).append([float(i) for i in line[1:]])
+
+    def detect(self, frames, keys=None):
+        if keys is None:
+            keys = range(self.count, self.count + len(frames))
+        self.count += len(frames)
+        results = []
+        for key in keys:
+            dets = self.boxes.get(str(key))
+            if not dets:
+                results.append(_empty())
+                continue
+            dets = np.array(dets, dtype=np.float32)
+            results.append((dets[:, :4], dets[:, 4]))
+        return results
+
+
+def save_detections(path, keys, results):
+    """write detections in the FileDetector format"""
+    with open(path, 'w') as f:
+        for key, (boxes, scores) in zip(keys, results):
+            for box, score in zip(boxes, scores):
+                f.write('%s %.1f %.1f %.1f %.1f %.4f\n' % (key, box[0], box[1], box[2], box[3], score))
+
+
+def get_detector(name, **kwargs):
+    """
+    Args:
+        name: mtcnn, dlib or file
+        kwargs: backend arguments, `path` for file
+    """
+    if name == 'mtcnn':
+        return MTCNNDetector(**kwargs)
+    elif name == 'dlib':
+        return DlibDetector(**kwargs)
+    elif name == 'file':
+        return FileDetector(**kwargs)
+    raise NotImplementedError(name)
+
+
+def frame_key(path, index=None):
+    """key of an image (basename) or of a video frame (basename:index)"""
+    name = os.path.basename(path)
+    return name if index is None else '%s:%d' % (name, index)
@@ -0,0 +1,123 @@
+'''
+Training curves as an append-only JSONL file.
+
+Every record is one line {"kind": "step" | "epoch", "time": ..., ...}: train.py
+writes a step record every --log_interval batches (loss, speed, lr) and an
+epoch record after validation (train/val loss and MAE, lr, cost). Records are
+buffered and appended in blocks, epoch records are on disk when record returns.
+A resumed run appends to the same file, so steps of an interrupted epoch can
+appear twice; load keeps the last record of every (kind, epoch, batch).
+
+python metrics.py ./weight/test/metrics.jsonl                # table of the epochs
+python metrics.py ./weight/test/metrics.jsonl --plot 1       # metrics_loss.png, metrics_mae.png
+'''
+import argparse
+import json
+import os
+import os.path as osp
+import time
+
+
+class MetricsRecorder(object):
+    """
+        buffered writer of metric records
+
+    Parameters:
+    ----------
+        path: .jsonl file, appended to
+        buffer_size: int, step records kept before they are written
+        flush_interval: float, seconds after which buffered records are written anyway
+    """
+    def __init__(self, path, buffer_size=100, flush_interval=30):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.time()
+        folder = osp.dirname(path)
+        if folder and not osp.exists(folder):
+            os.makedirs(folder)
+
+    def record(self, kind, flush=False, **values):
+        """
+            add a record, values are numbers, numpy scalars/arrays or lists of them
+
+        flush: write everything buffered now, always done for 'epoch' records
+        """
+        values = dict(values, kind=kind, time=round(time.time(), 3))
+        self._buffer.append(json.dumps(values, default=lambda v: v.tolist()))
+        if flush or kind == 'epoch' or len(self._buffer) >= self.buffer_size or \
+           time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+
+def read_records(path, offset=0):
+    """records of the complete lines after byte offset, and the offset after them"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    data = data[:data.rfind(b'\n') + 1]
+    records = [json.loads(line) for line in data.decode().splitlines() if line.strip()]
+    return records, offset + len(data)
+
+
+def load(path, kind='epoch'):
+    """records of kind ordered by (epoch, batch), the last one of a resumed duplicate"""
+    records = {}
+    for record in read_records(path)[0]:
+        if record['kind'] == kind:
+            records[(record.get('epoch'), record.get('batch'))] = record
+    return [records[key] for key in sorted(records)]
+
+
+def plot(path, out_prefix):
+    """<out_prefix>_loss.png and <out_prefix>_mae.png of the epoch records"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    epochs = load(path)
+    x = [r['epoch'] for r in epochs]
+    for name, keys in (('loss', ('train_loss', 'val_loss')), ('mae', ('train_mae', 'val_mae'))):
+        plt.figure()
+        for key in keys:
+            columns = list(zip(*[r[key] for r in epochs]))
+            for label, column in zip(('pitch', 'yaw', 'roll', 'mean'), columns):
+                plt.plot(x, column, label='%s-%s' % (key.split('_')[0], label))
+        plt.xlabel('epoch')
+        plt.ylabel(name)
+        plt.legend()
+        plt.grid()
+        plt.savefig('%s_%s.png' % (out_prefix, name))
+        plt.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Show the training curves of a metrics.jsonl')
+    parser.add_argument('path', type=str, help='metrics.jsonl of train.py')
+    parser.add_argument('--plot', type=int, default=0, help='also save png figures, needs matplotlib')
+    parser.add_argument('--out', type=str, default='', help='figure prefix, default next to the file')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('| epoch | train MAE | val MAE (pitch, yaw, roll, mean) | lr | sec |')
+    print('| :---: | :---: | :---: | :---: | :---: |')
+    for r in load(args.path):
+        print('| %d | %.3f | %s | %g | %d |' % (r['epoch'], r['train_mae'][3], ', '.join('%.3f' % v for v in r['val_mae']),
+                                               r['lr'], r['cost']))
+    if args.plot:
+        out = args.out or osp.splitext(args.path)[0]
+        plot(args.path, out)
+        print('saved %s_loss.png, %s_mae.png' % (out, out))
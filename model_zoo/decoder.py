@@ -0,0 +1,62 @@
+import mxnet as mx
+from mxnet.gluon.nn import HybridBlock
+
+__all__ = ["AngleDecoder",
+           "DecodedPose",
+           "decoded_block",
+           "export_decoded",
+           "decode_symbol"
+           ]
+
+
+class AngleDecoder(HybridBlock):
+    """
+        fc_bin (N x 198) -> pitch, yaw, roll in degree (N x 3),
+        the softmax expectation over the 66 bins of 3 degree used in train.cal_loss
+    """
+    def __init__(self, num_bins=66, bin_width=3, offset=-99, **kwargs):
+        super(AngleDecoder, self).__init__(**kwargs)
+        self.num_bins = num_bins
+        self.bin_width = bin_width
+        self.offset = offset
+
+    def hybrid_forward(self, F, x):
+        prob = F.softmax(F.reshape(x, (0, 3, self.num_bins)), axis=2)
+        centers = F.arange(self.num_bins) * self.bin_width + self.offset
+        return F.dot(prob, centers, name='pyr')
+
+
+class DecodedPose(HybridBlock):
+    """
+        pose net whose only output is the N x 3 angles: fc_pyr of use_fc nets
+        (the head train.py validates), the decoded fc_bin otherwise
+    """
+    def __init__(self, net, **kwargs):
+        super(DecodedPose, self).__init__(prefix='', **kwargs)
+        self.net = net
+        with self.name_scope():
+            self.decode = AngleDecoder(prefix='decode_')
+
+    def hybrid_forward(self, F, x):
+        out = self.net(x)
+        if isinstance(out, (list, tuple)):
+            return out[1]
+        return self.decode(out)
+
+
+def decoded_block(net, input_size=112, ctx=None):
+    """`net` with the in-graph decoding head, hybridized and run once so it can be exported"""
+    decoded = DecodedPose(net)
+    decoded.hybridize()
+    decoded(mx.nd.zeros((1, 3, input_size, input_size), ctx=ctx))
+    return decoded
+
+
+def export_decoded(net, path, input_size=112, ctx=None, epoch=0):
+    """export `net` with the in-graph decoding head as `path`-symbol.json/params"""
+    decoded_block(net, input_size, ctx).export(path, epoch=epoch)
+
+
+def decode_symbol(sym):
+    """decoded N x 3 output of a pose symbol, from fc_bin"""
+    return AngleDecoder(prefix='decode_')(sym)
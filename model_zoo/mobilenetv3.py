@@ -9,6 +9,7 @@
 """MobileNetV3, implemented in Gluon."""
 
 import numpy as np
+from mxnet import nd
 from mxnet.gluon import nn
 from mxnet.gluon.nn import BatchNorm
 from mxnet.gluon.block import HybridBlock
@@ -127,10 +128,90 @@ class _Unit(HybridBlock):
         return out
 
 
+class _RepUnit(HybridBlock):
+    """Depthwise _Unit trained with parallel 1x1 and identity branches (RepVGG).
+
+    Every branch has its own BatchNorm and the outputs are summed before the
+    activation. switch_to_deploy merges the branches into the kxk conv and
+    its BatchNorm, after which the block computes and exports exactly like a
+    _Unit with the same prefix.
+    """
+    def __init__(self, num_out, kernel_size=3, strides=1, pad=1, num_groups=1,
+                 use_act=True, act_type="relu", prefix='', norm_layer=BatchNorm, **kwargs):
+        super(_RepUnit, self).__init__(**kwargs)
+        assert num_groups == num_out, 'only depthwise convs are reparameterized'
+        self.use_act = use_act
+        self.deploy = False
+        self.kernel_size = kernel_size
+        self.conv = nn.Conv2D(channels=num_out, \
+                              kernel_size=kernel_size, strides=strides, \
+                              padding=pad, groups=num_groups, use_bias=False, \
+                              prefix='%s-conv2d_'%prefix)
+        self.bn = norm_layer(prefix='%s-batchnorm_'%prefix)
+        self.conv_1x1 = nn.Conv2D(channels=num_out, kernel_size=1, strides=strides, \
+                                  groups=num_groups, use_bias=False, \
+                                  prefix='%s-rep1x1-conv2d_'%prefix)
+        self.bn_1x1 = norm_layer(prefix='%s-rep1x1-batchnorm_'%prefix)
+        self.use_identity = strides == 1
+        if self.use_identity:
+            self.bn_identity = norm_layer(prefix='%s-repid-batchnorm_'%prefix)
+        if use_act is True:
+            self.act = Activation(act_type)
+
+    def hybrid_forward(self, F, x):
+        out = self.bn(self.conv(x))
+        if not self.deploy:
+            out = out + self.bn_1x1(self.conv_1x1(x))
+            if self.use_identity:
+                out = out + self.bn_identity(x)
+        if self.use_act:
+            out = self.act(out)
+        return out
+
+    @staticmethod
+    def _fuse(kernel, bn):
+        """kernel and bias of conv -> bn at inference"""
+        std = np.sqrt(bn.running_var.data().asnumpy() + bn._kwargs['eps'])
+        gamma = bn.gamma.data().asnumpy() if bn._kwargs['fix_gamma'] is False else np.ones_like(std)
+        scale = gamma / std
+        bias = bn.beta.data().asnumpy() - bn.running_mean.data().asnumpy() * scale
+        return kernel * scale.reshape(-1, 1, 1, 1), bias
+
+    def switch_to_deploy(self):
+        if self.deploy:
+            return
+        k, c = self.kernel_size, self.conv.weight.shape[0]
+        kernel, bias = self._fuse(self.conv.weight.data().asnumpy(), self.bn)
+        kernel_1x1 = np.zeros_like(kernel)
+        kernel_1x1[:, :, k//2, k//2] = self.conv_1x1.weight.data().asnumpy()[:, :, 0, 0]
+        kernel_1x1, bias_1x1 = self._fuse(kernel_1x1, self.bn_1x1)
+        kernel, bias = kernel + kernel_1x1, bias + bias_1x1
+        if self.use_identity:
+            kernel_id = np.zeros((c, 1, k, k), dtype=kernel.dtype)
+            kernel_id[:, 0, k//2, k//2] = 1
+            kernel_id, bias_id = self._fuse(kernel_id, self.bn_identity)
+            kernel, bias = kernel + kernel_id, bias + bias_id
+        # the kxk BatchNorm now only adds the merged bias
+        eps = self.bn._kwargs['eps']
+        self.conv.weight.set_data(nd.array(kernel))
+        self.bn.gamma.set_data(nd.ones(c))
+        self.bn.beta.set_data(nd.array(bias))
+        self.bn.running_mean.set_data(nd.zeros(c))
+        self.bn.running_var.set_data(nd.full(c, 1 - eps))
+        self.deploy = True
+
+
+def reparameterize(net):
+    """merge the branches of every _RepUnit of `net`, hybridize again to rebuild the graph"""
+    net.apply(lambda block: block.switch_to_deploy() if isinstance(block, _RepUnit) else None)
+    net.hybridize()
+    return net
+
+
 class _ResUnit(HybridBlock):
     def __init__(self, num_in, num_mid, num_out, \
                  kernel_size, act_type="relu", \
-                 use_se=False, strides=1, prefix='', norm_layer=BatchNorm, **kwargs):
+                 use_se=False, strides=1, prefix='', norm_layer=BatchNorm, rep=False, **kwargs):
         super(_ResUnit, self).__init__(**kwargs)
         self.use_se = use_se
         self.first_conv = (num_out != num_mid)
@@ -139,7 +220,8 @@ class _ResUnit(HybridBlock):
             self.expand = _Unit(num_mid, kernel_size=1, \
                                 strides=1, pad=0, act_type=act_type, \
                                 prefix='%s-exp'%prefix, norm_layer=norm_layer)
-        self.conv1 = _Unit(num_mid, kernel_size=kernel_size, strides=strides,
+        unit = _RepUnit if rep else _Unit
+        self.conv1 = unit(num_mid, kernel_size=kernel_size, strides=strides,
                            pad=self._get_pad(kernel_size), \
                            act_type=act_type, num_groups=num_mid, \
                            prefix='%s-depthwise'%prefix, norm_layer=norm_layer)
@@ -180,7 +262,7 @@ class _MobileNetV3(HybridBlock):
     def __init__(self, cfg, cls_ch_squeeze, cls_ch_expand, multiplier=1.,
                  classes=1000, norm_kwargs=None, last_gamma=False,
                  final_drop=0., use_global_stats=False, name_prefix='',
-                 norm_layer=BatchNorm, use_fc=True):
+                 norm_layer=BatchNorm, use_fc=True, stem_stride=1, rep=False):
         super(_MobileNetV3, self).__init__(prefix=name_prefix)
         norm_kwargs = norm_kwargs if norm_kwargs is not None else {}
         if use_global_stats:
@@ -190,11 +272,12 @@ class _MobileNetV3(HybridBlock):
         self.last_gamma = last_gamma
         self.norm_kwargs = norm_kwargs
         self.inplanes = 16
+        self.rep = rep
 
         with self.name_scope():
             self.features = nn.HybridSequential(prefix='')
             self.features.add(nn.Conv2D(channels=make_divisible(k*self.inplanes), \
-                                        kernel_size=3, padding=1, strides=1,       # # 224x224: stride: 2
+                                        kernel_size=3, padding=1, strides=stem_stride,       # # 224x224: stride: 2
                                         use_bias=False, prefix='first-3x3-conv-conv2d_'))
             self.features.add(norm_layer(prefix='first-3x3-conv-batchnorm_'))
             self.features.add(HardSwish())
@@ -243,7 +326,7 @@ class _MobileNetV3(HybridBlock):
         out_planes = out_channel
         layer = _ResUnit(self.inplanes, mid_planes, \
                          out_planes, kernel_size, \
-                         act_func, strides=stride, use_se=use_se, prefix=prefix)
+                         act_func, strides=stride, use_se=use_se, prefix=prefix, rep=self.rep)
         self.inplanes = out_planes
         return layer
 
@@ -284,6 +367,12 @@ def get_mobilenet_v3(model_name, multiplier=1., pretrained=False, ctx=cpu(),
     norm_kwargs : dict
         Additional `norm_layer` arguments, for example `num_devices=4`
         for :class:`mxnet.gluon.contrib.nn.SyncBatchNorm`.
+    stem_stride : int, default 1
+        Stride of the first 3x3 conv. 1 keeps the first stage at the input
+        resolution (112x112 faces), 2 halves it like the 224x224 ImageNet model.
+    rep : bool, default False
+        Train the depthwise convs with extra 1x1 and identity branches,
+        call reparameterize(net) before export to merge them.
     """
     if model_name == "large":
         cfg = [
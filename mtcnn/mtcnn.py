@@ -12,7 +12,7 @@ import numpy as np
 import math
 import cv2
 from itertools import repeat
-from .utils import nms, adjust_input, generate_bbox, detect_first_stage_warpper
+from .utils import nms, adjust_input, generate_bbox, detect_first_stage_warpper, ScalePlan
 
 class MTCNN(object):
     """
@@ -28,7 +28,8 @@ class MTCNN(object):
                  factor=0.709,
                  num_worker=1,
                  accurate_landmark=False,
-                 ctx=mx.gpu(0)):
+                 ctx=mx.gpu(0),
+                 max_scale_plans=8):
         """
             Initialize the detector
 
@@ -46,6 +47,8 @@ class MTCNN(object):
                     number of processes we use for first stage
                 accurate_landmark: bool
                     use accurate landmark localization or not
+                max_scale_plans: int number
+                    number of frame resolutions whose image pyramid is cached
 
         """
         self.num_worker = num_worker
@@ -68,6 +71,33 @@ class MTCNN(object):
         self.factor = float(factor)
         self.threshold = threshold
 
+        # (height, width, minsize, factor) -> ScalePlan
+        self.max_scale_plans = max_scale_plans
+        self.scale_plans = {}
+
+    def get_scale_plan(self, height, width):
+        """
+            get the cached image pyramid for this frame resolution
+
+        Parameters:
+        ----------
+            height, width: int number
+                size of the input image
+
+        Returns:
+        -------
+            ScalePlan holding scales, target sizes and buffers
+        """
+        key = (height, width, self.minsize, self.factor)
+        plan = self.scale_plans.get(key)
+        if plan is None:
+            if len(self.scale_plans) >= self.max_scale_plans:
+                # drop the oldest resolution
+                self.scale_plans.pop(next(iter(self.scale_plans)))
+            plan = ScalePlan(height, width, self.minsize, self.factor)
+            self.scale_plans[key] = plan
+        return plan
+
     def convert_to_square(self, bbox):
         """
             convert bbox to square
@@ -295,114 +325,73 @@ class MTCNN(object):
             points: numpy array, n x 10 (x1, x2 ... x5, y1, y2 ..y5)
                 landmarks
         """
+        return self.detect_faces([img], det_type)[0]
 
-        # check input
-        height, width, _ = img.shape
-        if det_type == 0:
-            MIN_DET_SIZE = 12
-
-            if img is None:
-                return None
+    def detect_faces(self, imgs, det_type=0):
+        """
+            detect face over a list of images, RNet/ONet/LNet run once
+            on the candidates of all images
+        Parameters:
+        ----------
+            imgs: list of numpy array, bgr order of shape (n, m, 3)
+                input images
+        Retures:
+        -------
+            list with one entry per image, None if no face is found, else
+            bboxes: numpy array, n x 5 (x1,y2,x2,y2,score)
+                bboxes
+            points: numpy array, n x 10 (x1, x2 ... x5, y1, y2 ..y5)
+                landmarks
+        """
+        results = [None] * len(imgs)
 
+        #############################################
+        # first stage
+        #############################################
+        boxes_list, index_list = [], []
+        for k, img in enumerate(imgs):
             # only works for color image
-            if len(img.shape) != 3:
-                return None
-
-            # detected boxes
-            total_boxes = []
-
-            minl = min(height, width)
-
-            # get all the valid scales
-            scales = []
-            m = MIN_DET_SIZE/self.minsize
-            minl *= m
-            factor_count = 0
-            while minl > MIN_DET_SIZE:
-                scales.append(m*self.factor**factor_count)
-                minl *= self.factor
-                factor_count += 1
-
-            #############################################
-            # first stage
-            #############################################
-            # for scale in scales:
-            #    return_boxes = self.detect_first_stage(img, scale, 0)
-            #    if return_boxes is not None:
-            #        total_boxes.append(return_boxes)
-
-            sliced_index = self.slice_index(len(scales))
-            total_boxes = []
-            for batch in sliced_index:
-                local_boxes = map(detect_first_stage_warpper,
-                                  zip(repeat(img), self.PNets[:len(batch)], [scales[i] for i in batch], repeat(self.threshold[0])))
-                total_boxes.extend(local_boxes)
-
-            # remove the Nones
-            total_boxes = [i for i in total_boxes if i is not None]
-
-            if len(total_boxes) == 0:
-                return None
-
-            total_boxes = np.vstack(total_boxes)
-
-            if total_boxes.size == 0:
-                return None
-
-            # merge the detection from first stage
-            pick = nms(total_boxes[:, 0:5], 0.7, 'Union')
-            total_boxes = total_boxes[pick]
-
-            bbw = total_boxes[:, 2] - total_boxes[:, 0] + 1
-            bbh = total_boxes[:, 3] - total_boxes[:, 1] + 1
-
-            # refine the bboxes
-            total_boxes = np.vstack([total_boxes[:, 0]+total_boxes[:, 5] * bbw,
-                                     total_boxes[:, 1]+total_boxes[:, 6] * bbh,
-                                     total_boxes[:, 2]+total_boxes[:, 7] * bbw,
-                                     total_boxes[:, 3]+total_boxes[:, 8] * bbh,
-                                     total_boxes[:, 4]
-                                     ])
-
-            total_boxes = total_boxes.T
-            total_boxes = self.convert_to_square(total_boxes)
-            total_boxes[:, 0:4] = np.round(total_boxes[:, 0:4])
-        else:
-            total_boxes = np.array(
-                [[0.0, 0.0, img.shape[1], img.shape[0], 0.9]], dtype=np.float32)
+            if img is None or len(img.shape) != 3:
+                continue
+            if det_type == 0:
+                boxes = self.detect_first_stage(img)
+                if boxes is None:
+                    continue
+            else:
+                boxes = np.array(
+                    [[0.0, 0.0, img.shape[1], img.shape[0], 0.9]], dtype=np.float32)
+            boxes_list.append(boxes)
+            index_list.append(np.full(boxes.shape[0], k, dtype=np.int32))
+
+        if len(boxes_list) == 0:
+            return results
+
+        total_boxes = np.vstack(boxes_list)
+        img_index = np.hstack(index_list)
 
         #############################################
         # second stage
         #############################################
-        num_box = total_boxes.shape[0]
-
-        # pad the bbox
-        [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(
-            total_boxes, width, height)
         # (3, 24, 24) is the input shape for RNet
-        input_buf = np.zeros((num_box, 3, 24, 24), dtype=np.float32)
-
-        for i in range(num_box):
-            tmp = np.zeros((tmph[i], tmpw[i], 3), dtype=np.uint8)
-            tmp[dy[i]:edy[i]+1, dx[i]:edx[i]+1,
-                :] = img[y[i]:ey[i]+1, x[i]:ex[i]+1, :]
-            input_buf[i, :, :, :] = adjust_input(cv2.resize(tmp, (24, 24)))
+        input_buf = self.crop_boxes(imgs, img_index, total_boxes, 24, dtype=np.uint8)
 
         output = self.RNet.predict(input_buf)
 
         # filter the total_boxes with threshold
         passed = np.where(output[1][:, 1] > self.threshold[1])
         total_boxes = total_boxes[passed]
+        img_index = img_index[passed]
 
         if total_boxes.size == 0:
-            return None
+            return results
 
         total_boxes[:, 4] = output[1][passed, 1].reshape((-1,))
         reg = output[0][passed]
 
         # nms
-        pick = nms(total_boxes, 0.7, 'Union')
+        pick = self.nms_per_image(total_boxes, img_index, 0.7, 'Union')
         total_boxes = total_boxes[pick]
+        img_index = img_index[pick]
         total_boxes = self.calibrate_box(total_boxes, reg[pick])
         total_boxes = self.convert_to_square(total_boxes)
         total_boxes[:, 0:4] = np.round(total_boxes[:, 0:4])
@@ -410,28 +399,217 @@ class MTCNN(object):
         #############################################
         # third stage
         #############################################
-        num_box = total_boxes.shape[0]
+        total_boxes, points, img_index = self.detect_output_stage(imgs, img_index, total_boxes)
 
-        # pad the bbox
-        [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(
-            total_boxes, width, height)
-        # (3, 48, 48) is the input shape for ONet
-        input_buf = np.zeros((num_box, 3, 48, 48), dtype=np.float32)
+        if total_boxes.size == 0:
+            return results
 
-        for i in range(num_box):
-            tmp = np.zeros((tmph[i], tmpw[i], 3), dtype=np.float32)
-            tmp[dy[i]:edy[i]+1, dx[i]:edx[i]+1,
-                :] = img[y[i]:ey[i]+1, x[i]:ex[i]+1, :]
-            input_buf[i, :, :, :] = adjust_input(cv2.resize(tmp, (48, 48)))
+        if self.accurate_landmark:
+            points = self.detect_landmark_stage(imgs, img_index, total_boxes, points)
+
+        for k in np.unique(img_index):
+            sel = np.where(img_index == k)[0]
+            results[k] = (total_boxes[sel], points[sel])
+        return results
+
+    def detect_face_scaled(self, img, max_side=None, rois=None, refine=False):
+        """
+            detect face on a downscaled frame and / or inside regions of
+            interest, so the cost is bounded for high resolution inputs
+        Parameters:
+        ----------
+            img: numpy array, bgr order of shape (n, m, 3)
+                input image
+            max_side: int number
+                longest side each region is downscaled to, None keeps the size
+            rois: list of (x1, y1, x2, y2)
+                regions to search, None searches the whole image
+            refine: bool
+                rerun ONet on the full resolution image around each face
+        Retures:
+        -------
+            None if no face is found, else
+            bboxes: numpy array, n x 5 (x1,y2,x2,y2,score)
+                bboxes in the input image
+            points: numpy array, n x 10 (x1, x2 ... x5, y1, y2 ..y5)
+                landmarks in the input image
+        """
+        height, width = img.shape[:2]
+        if not rois:
+            rois = [(0, 0, width, height)]
+
+        crops, origins = [], []
+        for roi in rois:
+            x1, y1 = max(0, int(roi[0])), max(0, int(roi[1]))
+            x2, y2 = min(width, int(roi[2])), min(height, int(roi[3]))
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crop = img[y1:y2, x1:x2]
+            scale = 1.0
+            if max_side and max(crop.shape[:2]) > max_side:
+                scale = float(max_side)/max(crop.shape[:2])
+                crop = cv2.resize(crop, (int(round((x2-x1)*scale)), int(round((y2-y1)*scale))))
+            crops.append(crop)
+            origins.append((x1, y1, scale))
+
+        boxes_list, points_list = [], []
+        for ret, (x1, y1, scale) in zip(self.detect_faces(crops), origins):
+            if ret is None:
+                continue
+            bboxes, points = ret[0].copy(), ret[1].astype(np.float64)
+            bboxes[:, 0:4] /= scale
+            bboxes[:, [0, 2]] += x1
+            bboxes[:, [1, 3]] += y1
+            points /= scale
+            points[:, 0:5] += x1
+            points[:, 5:10] += y1
+            boxes_list.append(bboxes)
+            points_list.append(points)
+
+        if len(boxes_list) == 0:
+            return None
+
+        total_boxes = np.vstack(boxes_list)
+        points = np.vstack(points_list)
+        if len(boxes_list) > 1:
+            # faces seen by overlapping regions
+            pick = nms(total_boxes, 0.7, 'Min')
+            total_boxes, points = total_boxes[pick], points[pick]
+
+        if refine:
+            return self.refine_face(img, total_boxes, expand=0)
+        return total_boxes, points
+
+    def refine_face(self, img, bboxes, expand=0.2):
+        """
+            refine known bboxes with ONet only, skipping PNet and RNet,
+            used to follow faces between full detections on video
+        Parameters:
+        ----------
+            img: numpy array, bgr order of shape (n, m, 3)
+                input image
+            bboxes: numpy array, n x 4 (or more)
+                bboxes from the previous frame
+            expand: float number
+                ratio each bbox is enlarged by before refinement
+        Retures:
+        -------
+            None if no face is kept, else
+            bboxes: numpy array, n x 5 (x1,y2,x2,y2,score)
+                bboxes
+            points: numpy array, n x 10 (x1, x2 ... x5, y1, y2 ..y5)
+                landmarks
+        """
+        if len(bboxes) == 0:
+            return None
+        total_boxes = np.zeros((len(bboxes), 5))
+        total_boxes[:, 0:4] = bboxes[:, 0:4]
+        bbw = total_boxes[:, 2] - total_boxes[:, 0] + 1
+        bbh = total_boxes[:, 3] - total_boxes[:, 1] + 1
+        total_boxes[:, 0] -= bbw*expand*0.5
+        total_boxes[:, 1] -= bbh*expand*0.5
+        total_boxes[:, 2] += bbw*expand*0.5
+        total_boxes[:, 3] += bbh*expand*0.5
+        total_boxes = self.convert_to_square(total_boxes)
+        total_boxes[:, 0:4] = np.round(total_boxes[:, 0:4])
+
+        img_index = np.zeros(len(total_boxes), dtype=np.int32)
+        total_boxes, points, img_index = self.detect_output_stage([img], img_index, total_boxes)
+        if total_boxes.size == 0:
+            return None
+        if self.accurate_landmark:
+            points = self.detect_landmark_stage([img], img_index, total_boxes, points)
+        return total_boxes, points
+
+    def detect_first_stage(self, img):
+        """
+            run PNet over the image pyramid
+        Parameters:
+        ----------
+            img: numpy array, bgr order of shape (n, m, 3)
+                input image
+        Retures:
+        -------
+            bboxes: numpy array, n x 5 (x1,y2,x2,y2,score), None if nothing found
+                square candidates for RNet
+        """
+        height, width, _ = img.shape
+
+        # get all the valid scales
+        plan = self.get_scale_plan(height, width)
+        scales = plan.scales
+
+        # for scale in scales:
+        #    return_boxes = self.detect_first_stage(img, scale, 0)
+        #    if return_boxes is not None:
+        #        total_boxes.append(return_boxes)
+
+        sliced_index = self.slice_index(len(scales))
+        total_boxes = []
+        for batch in sliced_index:
+            local_boxes = map(detect_first_stage_warpper,
+                              zip(repeat(img), self.PNets[:len(batch)], [scales[i] for i in batch],
+                                  repeat(self.threshold[0]), [plan.buffers(i) for i in batch]))
+            total_boxes.extend(local_boxes)
+
+        # remove the Nones
+        total_boxes = [i for i in total_boxes if i is not None]
+
+        if len(total_boxes) == 0:
+            return None
+
+        total_boxes = np.vstack(total_boxes)
+
+        if total_boxes.size == 0:
+            return None
+
+        # merge the detection from first stage
+        pick = nms(total_boxes[:, 0:5], 0.7, 'Union')
+        total_boxes = total_boxes[pick]
+
+        bbw = total_boxes[:, 2] - total_boxes[:, 0] + 1
+        bbh = total_boxes[:, 3] - total_boxes[:, 1] + 1
+
+        # refine the bboxes
+        total_boxes = np.vstack([total_boxes[:, 0]+total_boxes[:, 5] * bbw,
+                                 total_boxes[:, 1]+total_boxes[:, 6] * bbh,
+                                 total_boxes[:, 2]+total_boxes[:, 7] * bbw,
+                                 total_boxes[:, 3]+total_boxes[:, 8] * bbh,
+                                 total_boxes[:, 4]
+                                 ])
+
+        total_boxes = total_boxes.T
+        total_boxes = self.convert_to_square(total_boxes)
+        total_boxes[:, 0:4] = np.round(total_boxes[:, 0:4])
+        return total_boxes
+
+    def detect_output_stage(self, imgs, img_index, total_boxes):
+        """
+            run ONet on square candidates
+        Parameters:
+        ----------
+            imgs: list of numpy array
+                input images
+            img_index: numpy array, n
+                image of each candidate
+            total_boxes: numpy array, n x 5
+                square candidates
+        Retures:
+        -------
+            bboxes, points, img_index of the faces that passed
+        """
+        # (3, 48, 48) is the input shape for ONet
+        input_buf = self.crop_boxes(imgs, img_index, total_boxes, 48, dtype=np.float32)
 
         output = self.ONet.predict(input_buf)
 
         # filter the total_boxes with threshold
         passed = np.where(output[2][:, 1] > self.threshold[2])
         total_boxes = total_boxes[passed]
+        img_index = img_index[passed]
 
         if total_boxes.size == 0:
-            return None
+            return total_boxes, np.zeros((0, 10)), img_index
 
         total_boxes[:, 4] = output[2][passed, 1].reshape((-1,))
         reg = output[1][passed]
@@ -447,16 +625,27 @@ class MTCNN(object):
 
         # nms
         total_boxes = self.calibrate_box(total_boxes, reg)
-        pick = nms(total_boxes, 0.7, 'Min')
-        total_boxes = total_boxes[pick]
-        points = points[pick]
+        pick = self.nms_per_image(total_boxes, img_index, 0.7, 'Min')
+        return total_boxes[pick], points[pick], img_index[pick]
 
-        if not self.accurate_landmark:
-            return total_boxes, points
-
-        #############################################
-        # extended stage
-        #############################################
+    def detect_landmark_stage(self, imgs, img_index, total_boxes, points):
+        """
+            refine landmarks with LNet
+        Parameters:
+        ----------
+            imgs: list of numpy array
+                input images
+            img_index: numpy array, n
+                image of each face
+            total_boxes: numpy array, n x 5
+                face bboxes
+            points: numpy array, n x 10
+                landmarks from ONet
+        Retures:
+        -------
+            points: numpy array, n x 10, int32
+                refined landmarks
+        """
         num_box = total_boxes.shape[0]
         patchw = np.maximum(
             total_boxes[:, 2]-total_boxes[:, 0]+1, total_boxes[:, 3]-total_boxes[:, 1]+1)
@@ -469,15 +658,8 @@ class MTCNN(object):
         for i in range(5):
             x, y = points[:, i], points[:, i+5]
             x, y = np.round(x-0.5*patchw), np.round(y-0.5*patchw)
-            [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(np.vstack([x, y, x+patchw-1, y+patchw-1]).T,
-                                                                    width,
-                                                                    height)
-            for j in range(num_box):
-                tmpim = np.zeros((tmpw[j], tmpw[j], 3), dtype=np.float32)
-                tmpim[dy[j]:edy[j]+1, dx[j]:edx[j]+1,
-                      :] = img[y[j]:ey[j]+1, x[j]:ex[j]+1, :]
-                input_buf[j, i*3:i*3+3, :,
-                          :] = adjust_input(cv2.resize(tmpim, (24, 24)))
+            self.crop_boxes(imgs, img_index, np.vstack([x, y, x+patchw-1, y+patchw-1]).T, 24,
+                            dtype=np.float32, out=input_buf[:, i*3:i*3+3, :, :])
 
         output = self.LNet.predict(input_buf)
 
@@ -496,5 +678,60 @@ class MTCNN(object):
 
         points = np.hstack([pointx, pointy])
         points = points.astype(np.int32)
+        return points
 
-        return total_boxes, points
\ No newline at end of file
+    def crop_boxes(self, imgs, img_index, bboxes, size, dtype=np.float32, out=None):
+        """
+            crop, pad and resize bboxes into a network input batch
+        Parameters:
+        ----------
+            imgs: list of numpy array
+                input images
+            img_index: numpy array, n
+                image each bbox is cropped from
+            bboxes: numpy array, n x 4 (or more)
+                bboxes, restricted to the image in place like self.pad
+            size: int number
+                network input size
+            dtype: numpy dtype
+                dtype the patch is padded and resized in
+            out: numpy array, n x 3 x size x size
+                optional buffer to write into
+        Retures:
+        -------
+            input_buf: numpy array, n x 3 x size x size
+        """
+        if out is None:
+            out = np.zeros((bboxes.shape[0], 3, size, size), dtype=np.float32)
+        for k in np.unique(img_index):
+            sel = np.where(img_index == k)[0]
+            img = imgs[k]
+            height, width = img.shape[:2]
+            boxes = bboxes[sel]
+            [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(boxes, width, height)
+            bboxes[sel] = boxes
+            for j, i in enumerate(sel):
+                tmp = np.zeros((tmph[j], tmpw[j], 3), dtype=dtype)
+                tmp[dy[j]:edy[j]+1, dx[j]:edx[j]+1,
+                    :] = img[y[j]:ey[j]+1, x[j]:ex[j]+1, :]
+                adjust_input(cv2.resize(tmp, (size, size)), out=out[i:i+1])
+        return out
+
+    def nms_per_image(self, bboxes, img_index, overlap_threshold, mode='Union'):
+        """
+            non max suppression inside each image
+        Parameters:
+        ----------
+            bboxes: numpy array, n x 5
+                input bboxes
+            img_index: numpy array, n
+                image of each bbox
+        Retures:
+        -------
+            index array of the selected bbox
+        """
+        pick = []
+        for k in np.unique(img_index):
+            sel = np.where(img_index == k)[0]
+            pick.extend(sel[nms(bboxes[sel], overlap_threshold, mode)])
+        return np.array(pick, dtype=np.int64)
@@ -0,0 +1,99 @@
+# coding: utf-8
+import numpy as np
+from .utils import iou
+
+
+class FaceTracker(object):
+    """
+        Follow faces over video frames with stable track ids.
+        The full MTCNN cascade runs every `interval` frames, in between the
+        previous boxes are only refined by ONet (see MTCNN.refine_face).
+    """
+
+    def __init__(self, detector, interval=10, min_score=0.9, iou_threshold=0.3, expand=0.2, detect_fn=None):
+        """
+            Parameters:
+            ----------
+                detector : MTCNN
+                    detector used for full detection and refinement
+                interval : int number
+                    run the full cascade every `interval` frames
+                min_score : float number
+                    a refined face under this ONet score triggers full detection
+                iou_threshold : float number
+                    minimal overlap to keep the id of a previous track
+                expand : float number
+                    ratio previous boxes are enlarged by before refinement
+                detect_fn : callable
+                    full detection, img -> (bboxes, points) or None,
+                    default detector.detect_face
+        """
+        self.detector = detector
+        self.detect_fn = detect_fn if detect_fn is not None else detector.detect_face
+        self.interval = max(1, int(interval))
+        self.min_score = min_score
+        self.iou_threshold = iou_threshold
+        self.expand = expand
+        self.reset()
+
+    def reset(self):
+        self.frame_count = 0
+        self.next_id = 0
+        self.bboxes = np.zeros((0, 5))
+        self.ids = np.zeros((0, ), dtype=np.int64)
+
+    def update(self, img):
+        """
+            track faces in the next frame
+
+        Parameters:
+        ----------
+            img: numpy array, bgr order of shape (n, m, 3)
+                video frame
+        Returns:
+        -------
+            None if there is no face, else
+            bboxes: numpy array, n x 5 (x1,y2,x2,y2,score)
+                bboxes
+            points: numpy array, n x 10 (x1, x2 ... x5, y1, y2 ..y5)
+                landmarks
+            ids: numpy array, n
+                track id of each face
+        """
+        ret = None
+        full = len(self.bboxes) == 0 or self.frame_count % self.interval == 0
+        if not full:
+            ret = self.detector.refine_face(img, self.bboxes, self.expand)
+            # lost a face or lost confidence, fall back to the full cascade
+            if ret is None or len(ret[0]) < len(self.bboxes) or ret[0][:, 4].min() < self.min_score:
+                full = True
+        if full:
+            ret = self.detect_fn(img)
+        self.frame_count += 1
+
+        if ret is None:
+            self.bboxes = np.zeros((0, 5))
+            self.ids = np.zeros((0, ), dtype=np.int64)
+            return None
+
+        bboxes, points = ret
+        self.ids = self.assign_ids(bboxes)
+        self.bboxes = bboxes
+        return bboxes, points, self.ids
+
+    def assign_ids(self, bboxes):
+        """
+            greedy IoU matching of new bboxes to the previous tracks
+        """
+        ids = np.full(len(bboxes), -1, dtype=np.int64)
+        if len(self.bboxes) > 0:
+            overlap = iou(bboxes, self.bboxes)
+            while overlap.size > 0 and overlap.max() > self.iou_threshold:
+                i, j = np.unravel_index(np.argmax(overlap), overlap.shape)
+                ids[i] = self.ids[j]
+                overlap[i, :] = 0
+                overlap[:, j] = 0
+        for i in np.where(ids < 0)[0]:
+            ids[i] = self.next_id
+            self.next_id += 1
+        return ids
@@ -66,7 +66,28 @@ def nms(boxes, overlap_threshold, mode='Union'):
 
     return pick
 
-def adjust_input(in_data):
+def iou(boxes_a, boxes_b):
+    """
+        pairwise intersection over union
+
+    Parameters:
+    ----------
+        boxes_a: numpy array n x 4 (or more)
+        boxes_b: numpy array m x 4 (or more)
+    Returns:
+    -------
+        numpy array n x m
+    """
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.maximum(0, x2 - x1 + 1) * np.maximum(0, y2 - y1 + 1)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0] + 1) * (boxes_a[:, 3] - boxes_a[:, 1] + 1)
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0] + 1) * (boxes_b[:, 3] - boxes_b[:, 1] + 1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+def adjust_input(in_data, out=None):
     """
         adjust the input from (h, w, c) to ( 1, c, h, w) for network input
 
@@ -74,11 +95,18 @@ def adjust_input(in_data):
     ----------
         in_data: numpy array of shape (h, w, c)
             input data
+        out: numpy array of shape (1, c, h, w), float32
+            optional preallocated buffer the result is written into
     Returns:
     -------
         out_data: numpy array of shape (1, c, h, w)
             reshaped array
     """
+    if out is not None:
+        np.subtract(in_data.transpose((2,0,1)), 127.5, out=out[0], casting='unsafe')
+        out *= 0.0078125
+        return out
+
     if in_data.dtype is not np.dtype('float32'):
         out_data = in_data.astype(np.float32)
     else:
@@ -89,6 +117,41 @@ def adjust_input(in_data):
     out_data = (out_data - 127.5)*0.0078125
     return out_data
 
+
+class ScalePlan(object):
+    """
+        image pyramid of a fixed input resolution, computed once and reused
+
+    Parameters:
+    ----------
+        height, width: int number
+            size of the input image
+        minsize: float number
+            minimal face to detect
+        factor: float number
+            scale factor for image pyramid
+    """
+    MIN_DET_SIZE = 12
+
+    def __init__(self, height, width, minsize, factor):
+        self.scales = []
+        m = self.MIN_DET_SIZE/minsize
+        minl = min(height, width)*m
+        factor_count = 0
+        while minl > self.MIN_DET_SIZE:
+            self.scales.append(m*factor**factor_count)
+            minl *= factor
+            factor_count += 1
+
+        # target size and resize / normalize buffers of every level
+        self.sizes = [(int(math.ceil(height*s)), int(math.ceil(width*s))) for s in self.scales]
+        self.resize_bufs = [np.empty((hs, ws, 3), dtype=np.uint8) for hs, ws in self.sizes]
+        self.input_bufs = [np.empty((1, 3, hs, ws), dtype=np.float32) for hs, ws in self.sizes]
+
+    def buffers(self, index):
+        return self.resize_bufs[index], self.input_bufs[index]
+
+
 def generate_bbox(map, reg, scale, threshold):
      """
          generate bbox from feature map
@@ -129,7 +192,7 @@ def generate_bbox(map, reg, scale, threshold):
      return boundingbox.T
 
 
-def detect_first_stage(img, net, scale, threshold):
+def detect_first_stage(img, net, scale, threshold, buffers=None):
     """
         run PNet for first stage
     
@@ -141,6 +204,8 @@ def detect_first_stage(img, net, scale, threshold):
             how much should the input image scale
         net: PNet
             worker
+        buffers: tuple of numpy array
+            optional (resize, input) buffers from a ScalePlan
     Returns:
     -------
         total_boxes : bboxes
@@ -149,10 +214,13 @@ def detect_first_stage(img, net, scale, threshold):
     hs = int(math.ceil(height * scale))
     ws = int(math.ceil(width * scale))
     
-    im_data = cv2.resize(img, (ws,hs))
-    
-    # adjust for the network input
-    input_buf = adjust_input(im_data)
+    if buffers is not None and buffers[0].dtype == img.dtype:
+        im_data = cv2.resize(img, (ws,hs), dst=buffers[0])
+        input_buf = adjust_input(im_data, out=buffers[1])
+    else:
+        im_data = cv2.resize(img, (ws,hs))
+        # adjust for the network input
+        input_buf = adjust_input(im_data)
     output = net.predict(input_buf)
     boxes = generate_bbox(output[1][0,1,:,:], output[0], scale, threshold)
 
@@ -0,0 +1,227 @@
+'''
+MXNet params -> caffe blobs, and a caffemodel reader/writer that does not
+need caffe.
+
+The param -> (layer, blob index) table is built from the mxnet json graph
+(the input position of every param of every op), not from param name
+suffixes, and batchnorm merged into its convolution by
+net_convert(fold_bn=True) is folded into the weights before the lookup.
+
+Only the caffe.proto fields the converter writes are encoded:
+    NetParameter   name = 1, layer = 100
+    LayerParameter name = 1, type = 2, blobs = 7
+    BlobProto      data = 5 (packed float), shape = 7
+    BlobShape      dim = 1 (packed int64)
+'''
+import json
+from collections import OrderedDict
+import numpy as np
+from json2prototxt import get_bn_folds, fold_bn_params
+
+
+# ----------------------------------------------------------------
+# name mapping
+def param_table(mxnet_json):
+    """
+        caffe blob of every mxnet param, in graph order
+
+    Returns:
+    -------
+        table: OrderedDict param name -> (layer, blob index)
+        bn_layers: batchnorm layers, their third blob is the scale factor 1
+    """
+    with open(mxnet_json) as json_file:
+        nodes = json.load(json_file)['nodes']
+    table, bn_layers = OrderedDict(), []
+    for node in nodes:
+        if node['op'] == 'null':
+            continue
+        name = node['name'].replace('_fwd', '')
+        inputs = [(pos, str(nodes[i[0]]['name'])) for pos, i in enumerate(node['inputs'])
+                  if nodes[i[0]]['op'] == 'null' and nodes[i[0]]['name'] != 'data']
+        for pos, param in inputs:
+            if node['op'] in ('Convolution', 'ChannelwiseConvolution', 'FullyConnected'):
+                table[param] = (name, pos - 1)  # data, weight, bias
+            elif node['op'] == 'BatchNorm':  # data, gamma, beta, mean, var
+                table[param] = (name + '_scale', pos - 1) if pos < 3 else (name, pos - 3)
+            elif node['op'] == 'LeakyReLU':  # prelu
+                table[param] = (name, 0)
+        if node['op'] == 'BatchNorm':
+            bn_layers.append(name)
+    return table, bn_layers
+
+
+def load_params(mxnet_prefix, mxnet_epoch):
+    """params file of a checkpoint as dict name -> numpy array, no symbol needed"""
+    import mxnet as mx
+    params = {}
+    for key, value in mx.nd.load('%s-%04d.params' % (mxnet_prefix, mxnet_epoch)).items():
+        params[key.split(':', 1)[-1]] = value.asnumpy()
+    return params
+
+
+def convert_checkpoint(mxnet_prefix, mxnet_epoch, layers):
+    """
+        caffe blobs of a mxnet checkpoint for the layers of a prototxt
+
+    Parameters:
+    ----------
+        layers: names of the prototxt layers
+    Returns:
+    -------
+        blobs: OrderedDict layer -> list of float32 arrays
+        unmatched: params without a layer in the prototxt
+        missing: (layer, blob index) the prototxt expects but the checkpoint lacks
+    """
+    layers = set(layers)
+    mxnet_json = '%s-symbol.json' % mxnet_prefix
+    table, bn_layers = param_table(mxnet_json)
+    params = load_params(mxnet_prefix, mxnet_epoch)
+
+    # batchnorm merged into its convolution by net_convert(fold_bn=True)
+    folds = dict((k, v) for k, v in get_bn_folds(mxnet_json).items() if v[0] not in layers)
+    if folds:
+        params = fold_bn_params(params, folds)
+        for conv, (bn, _) in folds.items():
+            table[conv + '_bias'] = (conv, 1)
+            bn_layers.remove(bn)
+
+    blobs, unmatched, missing = OrderedDict(), [], []
+    for param, (layer, index) in table.items():
+        if layer not in layers:
+            if param in params:
+                unmatched.append(param)
+            continue
+        if param not in params:
+            missing.append((layer, index))
+            continue
+        layer_blobs = blobs.setdefault(layer, [])
+        layer_blobs.extend([None] * (index + 1 - len(layer_blobs)))
+        layer_blobs[index] = np.ascontiguousarray(params[param], dtype=np.float32)
+    for layer in bn_layers:
+        if layer in blobs:
+            blobs[layer].extend([None] * (3 - len(blobs[layer])))
+            blobs[layer][2] = np.ones((1, ), dtype=np.float32)
+    unmatched.extend(sorted(set(params) - set(table)))
+    return blobs, unmatched, missing
+
+
+# ----------------------------------------------------------------
+# protobuf wire format
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """length-delimited field"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _blob(array):
+    shape = b''.join(_varint(d) for d in array.shape)
+    return _field(7, _field(1, shape)) + _field(5, array.astype('<f4').tobytes())
+
+
+def _layer(name, kind, arrays):
+    return _field(1, name.encode()) + _field(2, kind.encode()) + b''.join(_field(7, _blob(a)) for a in arrays)
+
+
+def write_caffemodel(path, blobs, layer_types=None, name='mxnet-mdoel'):
+    """
+        write a caffemodel a layer at a time
+
+    Parameters:
+    ----------
+        blobs: dict layer -> list of arrays, written in this order
+        layer_types: dict layer -> caffe type
+    """
+    layer_types = layer_types or {}
+    with open(path, 'wb') as f:
+        f.write(_field(1, name.encode()))
+        for layer, arrays in blobs.items():
+            f.write(_field(100, _layer(layer, layer_types.get(layer, ''), arrays)))
+
+
+def _read_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(buf):
+    """(field number, wire type, value) of a message, value is bytes for length-delimited fields"""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire == 1:
+            value, pos = buf[pos:pos+8], pos + 8
+        elif wire == 2:
+            size, pos = _read_varint(buf, pos)
+            value, pos = buf[pos:pos+size], pos + size
+        elif wire == 5:
+            value, pos = buf[pos:pos+4], pos + 4
+        else:
+            raise ValueError('unsupported wire type %d' % wire)
+        yield key >> 3, wire, value
+
+
+def _read_blob(buf):
+    data, shape, legacy = [], None, {}
+    for number, wire, value in _fields(buf):
+        if number == 5:
+            data.append(np.frombuffer(value, dtype='<f4'))
+        elif number == 7:
+            shape = []
+            for _, dim_wire, dims in _fields(value):
+                if dim_wire == 0:
+                    shape.append(dims)
+                else:
+                    pos = 0
+                    while pos < len(dims):
+                        dim, pos = _read_varint(dims, pos)
+                        shape.append(dim)
+        elif number in (1, 2, 3, 4) and wire == 0:  # num, channels, height, width
+            legacy[number] = value
+    data = np.concatenate(data) if data else np.zeros((0, ), dtype=np.float32)
+    if shape is None and legacy:
+        shape = [legacy.get(i, 1) for i in (1, 2, 3, 4)]
+    return data.reshape(shape) if shape is not None else data
+
+
+def read_caffemodel(path):
+    """
+    Returns:
+    -------
+        OrderedDict layer -> list of float32 arrays, layers with blobs only
+    """
+    with open(path, 'rb') as f:
+        buf = memoryview(f.read())
+    blobs = OrderedDict()
+    for number, _, value in _fields(buf):
+        if number != 100:
+            continue
+        name, arrays = None, []
+        for layer_number, _, layer_value in _fields(value):
+            if layer_number == 1:
+                name = bytes(layer_value).decode()
+            elif layer_number == 7:
+                arrays.append(_read_blob(layer_value))
+        if arrays:
+            blobs[name] = arrays
+    return blobs
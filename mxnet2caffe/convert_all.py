@@ -0,0 +1,172 @@
+'''
+Convert every trained variant and report size and speed per format.
+
+Finds the best_pose-symbol.json exports under --root, writes pose.prototxt,
+pose.caffemodel and pose.npz next to each (one process per variant), then
+measures the forward latency of mxnet, caffe (if installed) and the numpy
+runtime one variant at a time, so the timings do not compete for cores.
+
+python convert_all.py --root ../weight --table ../weight/report.md
+'''
+import argparse
+import glob
+import multiprocessing
+import os.path as osp
+import re
+import time
+import numpy as np
+from json2prototxt import net_convert
+from caffemodel import convert_checkpoint, write_caffemodel
+from numpy_runtime import parse_prototxt, _get
+
+
+def find_exports(root, pattern):
+    """variant name -> mxnet prefix, the newest epoch of every export"""
+    exports = []
+    for sym_file in sorted(glob.glob(osp.join(root, pattern))):
+        prefix = sym_file[:-len('-symbol.json')]
+        epochs = [int(p[len(prefix)+1:-len('.params')]) for p in glob.glob(prefix + '-*.params')]
+        name = osp.relpath(osp.dirname(sym_file), root)
+        exports.append((name, prefix, max(epochs) if epochs else None))
+    return exports
+
+
+def best_mae(folder):
+    """best val MAE from the train.py log of a variant"""
+    for log in glob.glob(osp.join(folder, '*.log')):
+        with open(log) as f:
+            found = re.findall(r'Min mean MAE: ([\d.]+)', f.read())
+        if found:
+            return float(found[-1])
+    return None
+
+
+def convert(job):
+    """net and weight conversion of one variant, runs in a worker process"""
+    name, prefix, epoch, fuse, input_shape, batch_size = job
+    folder = osp.dirname(prefix)
+    prototxt = osp.join(folder, 'pose.prototxt')
+    ret = {'name': name, 'prefix': prefix, 'epoch': epoch, 'mae': best_mae(folder), 'prototxt': prototxt}
+    tic = time.time()
+    ret['stats'] = net_convert('%s-symbol.json' % prefix, prototxt, fuse, fuse, input_shape, batch_size)
+    if epoch is None:
+        ret['error'] = 'no params'
+        return ret
+    layer_types = dict((_get(l, 'name'), _get(l, 'type')) for l in parse_prototxt(prototxt).get('layer', []))
+    blobs, unmatched, missing = convert_checkpoint(prefix, epoch, layer_types)
+    ret['caffemodel'] = osp.join(folder, 'pose.caffemodel')
+    ret['npz'] = osp.join(folder, 'pose.npz')
+    write_caffemodel(ret['caffemodel'], blobs, layer_types)
+    np.savez(ret['npz'], **dict(('%s/%d' % (layer, i), a) for layer, arrays in blobs.items()
+                                for i, a in enumerate(arrays)))
+    ret['unmatched'], ret['missing'] = unmatched, missing
+    ret['params'] = sum(a.size for arrays in blobs.values() for a in arrays)
+    ret['cost'] = time.time() - tic
+    return ret
+
+
+def _time(fn, repeat):
+    fn()
+    tic = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - tic) / repeat * 1000
+
+
+def latency(ret, data, repeat, caffe=None):
+    """ms per batch of mxnet, the numpy runtime and caffe if given"""
+    import mxnet as mx
+    times = {}
+    prefix, epoch = ret['prefix'], ret['epoch']
+    net = mx.gluon.SymbolBlock(mx.sym.load('%s-symbol.json' % prefix), mx.sym.var('data'))
+    net.load_parameters('%s-%04d.params' % (prefix, epoch), ctx=mx.cpu())
+    net.hybridize(static_alloc=True, static_shape=True)
+    x = mx.nd.array(data)
+
+    def run():
+        net(x)
+        mx.nd.waitall()
+    times['mxnet'] = _time(run, repeat)
+
+    if caffe is not None:
+        cnet = caffe.Net(ret['prototxt'], ret['caffemodel'], caffe.TEST)
+        cnet.blobs['data'].reshape(*data.shape)
+        cnet.reshape()
+        cnet.blobs['data'].data[...] = data
+        times['caffe'] = _time(cnet.forward, repeat)
+
+    from numpy_runtime import Net
+    nnet = Net(ret['prototxt'], ret['npz'])
+    times['numpy'] = _time(lambda: nnet.forward(data), repeat)
+    return times
+
+
+def size_mb(path):
+    return osp.getsize(path) / 2.**20 if path and osp.exists(path) else None
+
+
+def make_table(results, runtimes, batch_size):
+    fmt = lambda v, f: '-' if v is None else f % v
+    head = ['variant', 'MAE', 'params (M)', 'mxnet MB', 'caffe MB', 'npz MB', 'layers', 'blob MB'] + \
+           ['%s ms (bs %d)' % (r, batch_size) for r in runtimes]
+    lines = ['| %s |' % ' | '.join(head), '|%s|' % '|'.join([' :---: '] * len(head))]
+    for ret in results:
+        params_file = '%s-%04d.params' % (ret['prefix'], ret['epoch']) if ret['epoch'] is not None else None
+        params = ret['params'] / 1e6 if 'params' in ret else None
+        times = ret.get('times', {})
+        row = [ret['name'], fmt(ret['mae'], '%.3f'), fmt(params, '%.2f'),
+               fmt(size_mb(params_file), '%.1f'), fmt(size_mb(ret.get('caffemodel')), '%.1f'),
+               fmt(size_mb(ret.get('npz')), '%.1f'), '%d' % ret['stats']['layers'][1],
+               '%.1f' % (ret['stats']['memory'][1] / 2.**20)] + [fmt(times.get(r), '%.2f') for r in runtimes]
+        lines.append('| %s |' % ' | '.join(row))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert all trained variants')
+    parser.add_argument('--root', type=str, default='../weight', help='folder of the trained variants')
+    parser.add_argument('--pattern', type=str, default='*/best_pose-symbol.json')
+    parser.add_argument('--workers', type=int, default=4, help='conversion processes')
+    parser.add_argument('--fuse', type=int, default=1, help='fuse activations and fold BatchNorm')
+    parser.add_argument('--bs', type=int, default=1, help='latency batch size')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--shape', type=str, default='3,112,112', help='net input, see train.py --input_size')
+    parser.add_argument('--table', type=str, default='', help='also write the markdown table here')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    exports = find_exports(args.root, args.pattern)
+    assert len(exports) > 0, 'no %s under %s' % (args.pattern, args.root)
+    shape = tuple(int(i) for i in args.shape.split(','))
+    jobs = [(name, prefix, epoch, args.fuse, shape, args.bs) for name, prefix, epoch in exports]
+    pool = multiprocessing.Pool(min(args.workers, len(jobs)))
+    results = pool.map(convert, jobs)
+    pool.close()
+    pool.join()
+
+    data = np.random.uniform(-1, 1, (args.bs, ) + shape).astype(np.float32)
+    try:
+        from find_caffe import caffe
+        caffe.set_mode_cpu()
+    except ImportError:
+        caffe = None
+    runtimes = []
+    for ret in results:
+        if 'error' in ret:
+            print('%s: %s, only the net is converted' % (ret['name'], ret['error']))
+            continue
+        for key in ret['unmatched']:
+            print('%s: Warning!  key error mxnet: %s' % (ret['name'], key))
+        ret['times'] = latency(ret, data, args.repeat, caffe)
+        runtimes.extend(r for r in ret['times'] if r not in runtimes)
+        print('%s: converted in %.1f s, %s' % (ret['name'], ret['cost'],
+              ', '.join('%s %.2f ms' % kv for kv in ret['times'].items())))
+
+    table = make_table(results, runtimes or ['mxnet', 'numpy'], args.bs)
+    print('\n' + table)
+    if args.table:
+        with open(args.table, 'w') as f:
+            f.write(table)
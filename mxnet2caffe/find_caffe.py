@@ -7,7 +7,7 @@ except ImportError:
     try:
         import caffe
     except ImportError:
-        print('No module named caffe, ' + \
-              'please reset "caffe_python_root" in ' + __file__)
-        exit(-1)
-    sys.path.pop()
+        raise ImportError('No module named caffe, ' + \
+                          'please reset "caffe_python_root" in ' + __file__)
+    finally:
+        sys.path.pop()
@@ -5,10 +5,8 @@
 @LastEditTime: 2019-09-05 21:09:40
 @LastEditors: Please set LastEditors
 '''
+import argparse
 import sys
-caffe_python_root = '/home/lfx/Tool/caffe_cpu/python'
-sys.path.append(caffe_python_root)
-import caffe
 import cv2
 import numpy as np
 from math import cos, sin
@@ -44,7 +42,7 @@ def draw_axis(img, pyr, tdx=None, tdy=None, size = 100):
 
     return img
 
-def crop(img, bbox):
+def crop(img, bbox, size=112):
     # crop face
     h, w = img.shape[:2]
     k = 0.3
@@ -62,45 +60,55 @@ def crop(img, bbox):
     img = cv2.copyMakeBorder(img, ex_h, ex_h, ex_w, ex_w, cv2.BORDER_CONSTANT, value=(0, 0, 0))
 
     # prercocess
-    img = cv2.resize(img, (112, 112))
+    img = cv2.resize(img, (size, size))
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     img = np.transpose(img, (2,0,1)).astype('float32')
     img = (img-127.5)/128
     return img
 
 def get_caffe_out(net, data):
-    net.blobs['data'].data[...] = data.copy()
+    """
+        faces run as one batch padded to the net batch, the net only grows
+        (to the next power of two) when more faces come than it holds
+    """
+    n = len(data)
+    if n > net.blobs['data'].data.shape[0]:
+        net.blobs['data'].reshape(1 << (n-1).bit_length(), *data.shape[1:])
+        net.reshape()
+    net.blobs['data'].data[:n] = data
     out = net.forward()
-    pyr = out['fc_pyr']
+    pyr = out['fc_pyr'][:n]
     return pyr.copy()
 
+def get_args():
+    parser = argparse.ArgumentParser(description='Test the converted caffe model.')
+    parser.add_argument('--prototxt', type=str, default='./mxnet2caffe/model/caffe.prototxt')
+    parser.add_argument('--caffemodel', type=str, default='./mxnet2caffe/model/caffe.caffemodel')
+    parser.add_argument('--image', type=str, default='./test_res/test.jpg')
+    parser.add_argument('--detector', type=str, default='mtcnn', help='mtcnn, dlib')
+    args = parser.parse_args()
+    return args
+
 if __name__ == "__main__": 
-    caffe.set_mode_cpu()
-    net = caffe.Net('./mxnet2caffe/model/caffe.prototxt', './mxnet2caffe/model/caffe.caffemodel', caffe.TEST)
+    args = get_args()
+    img = cv2.imread(args.image)
+    assert img is not None, 'can not read %s' % args.image
 
-    detect_type = 'mtcnn'
+    # caffe and the detector are only imported here, not when the helpers above are imported
+    from find_caffe import caffe
+    caffe.set_mode_cpu()
+    net = caffe.Net(args.prototxt, args.caffemodel, caffe.TEST)
 
-    img = cv2.imread('./test_res/test.jpg')
-    if detect_type=='dlib':
-        import dlib
-        detector = dlib.get_frontal_face_detector()
-        dets = detector(img, 0)
-        bboxs = [(i.left(), i.top(), i.right(), i.bottom()) for i in dets]
-    elif detect_type =='mtcnn':
-        import sys
-        sys.path.append('./')
-        from mtcnn.mtcnn import MTCNN
-        import mxnet as mx
-        detector = MTCNN('./mtcnn/model/', ctx=mx.cpu(), num_worker=4, accurate_landmark=False)
-        ret = detector.detect_face(img) 
-        if ret is not None:
-            bboxs, _ = ret
-            bboxs = bboxs[:, :4]
+    sys.path.append('./')
+    from detector import get_detector
+    if args.detector == 'mtcnn':
+        detector = get_detector('mtcnn', num_worker=4, accurate_landmark=False)
     else:
-        raise NotImplementedError
+        detector = get_detector(args.detector)
+    bboxs, _ = detector.detect_one(img)
     
     if len(bboxs)>0:
-        faces = np.array([crop(img, i) for i in bboxs])  
+        faces = np.array([crop(img, i, net.blobs['data'].data.shape[-1]) for i in bboxs])  
         pyrs = get_caffe_out(net, faces)
         print(pyrs)
         for pyr, (x1,y1,x2,y2) in zip(pyrs, bboxs):
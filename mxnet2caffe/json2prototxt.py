@@ -7,36 +7,319 @@
 '''
 import argparse
 import json
+import numpy as np
 from prototxt_basic import write_node
 
-def net_convert(mxnet_json, caffe_prototxt):
+INPLACE_OPS = ('Activation', 'clip', 'HardSwish', 'HardSigmoid')
+
+
+def load_infos(jdata):
+    """one info dict per mxnet op node, in graph order"""
+    nodes = jdata['nodes']
+    infos = []
+    for node in nodes:
+        if str(node['op']) == 'null' and str(node['name']) != 'data':
+            continue
+
+        info = {}
+        if str(node['op']) == 'null' and str(node['name']) == 'data':
+            info['op'] = 'Input'
+        else:
+            info['op'] = node['op']
+        if 'attrs' in node:
+            info['attrs'] = node['attrs']
+        info['name'] = str(node['name']).replace('_fwd', '')  #### SymbolBlock的问题
+        info['top'] = info['name']
+        info['bottom'] = []
+        info['params'] = []
+        for input_ids in node['inputs']:
+            input_node = nodes[input_ids[0]]
+            if str(input_node['op']) != 'null' or (str(
+                    input_node['name']) == 'data'):
+                info['bottom'].append(str(input_node['name']).replace('_fwd', ''))
+        infos.append(info)
+    return infos
+
+
+def _resolve(alias, name):
+    while name in alias:
+        name = alias[name]
+    return name
+
+
+def _consumers(infos, heads):
+    count = dict((h, 1) for h in heads)
+    for info in infos:
+        for bottom in info['bottom']:
+            count[bottom] = count.get(bottom, 0) + 1
+    return count
+
+
+def _scalar(info, key):
+    return float(info.get('attrs', {}).get(key, 'nan'))
+
+
+def fuse_hard_activations(infos, heads):
+    """
+        _plus_scalar(3) -> clip(0, 6) -> _div_scalar(6) [-> elemwise_mul(x, .)]
+        as one HardSigmoid [HardSwish] layer reading x
+    """
+    count = _consumers(infos, heads)
+    users = {}
+    for info in infos:
+        for bottom in info['bottom']:
+            users.setdefault(bottom, []).append(info)
+
+    def only_user(info):
+        if count.get(info['top'], 0) != 1 or info['top'] in heads:
+            return None
+        return users[info['top']][0]
+
+    removed, fused = set(), {}
+    for plus in infos:
+        if plus['op'] != '_plus_scalar' or _scalar(plus, 'scalar') != 3:
+            continue
+        clip = only_user(plus)
+        if clip is None or clip['op'] != 'clip' or _scalar(clip, 'a_min') != 0 or _scalar(clip, 'a_max') != 6:
+            continue
+        div = only_user(clip)
+        if div is None or div['op'] != '_div_scalar' or _scalar(div, 'scalar') != 6:
+            continue
+        x = plus['bottom'][0]
+        chain = [plus, clip, div]
+        mul = only_user(div)
+        if mul is not None and mul['op'] == 'elemwise_mul' and sorted(mul['bottom']) == sorted([x, div['top']]):
+            chain.append(mul)
+            op = 'HardSwish'
+        else:
+            op = 'HardSigmoid'
+        last = chain[-1]
+        for info in chain:
+            removed.add(id(info))
+        fused[id(last)] = {'op': op, 'name': last['name'], 'top': last['top'], 'bottom': [x], 'params': []}
+
+    out = []
+    for info in infos:
+        if id(info) in fused:
+            out.append(fused[id(info)])
+        elif id(info) not in removed:
+            out.append(info)
+    return out
+
+
+def fold_batchnorm(infos, heads):
+    """Convolution -> BatchNorm as one Convolution with bias writing the BatchNorm top"""
+    count = _consumers(infos, heads)
+    convs = dict((info['top'], info) for info in infos if info['op'] in ('Convolution', 'ChannelwiseConvolution'))
+    out = []
+    for info in infos:
+        conv = convs.get(info['bottom'][0]) if info['op'] == 'BatchNorm' else None
+        if conv is None or count[conv['top']] != 1 or conv['top'] in heads:
+            out.append(info)
+            continue
+        conv['attrs'] = dict(conv['attrs'], no_bias='False')
+        conv['top'] = info['top']
+    return out
+
+
+def get_bn_folds(mxnet_json):
+    """
+        BatchNorm nodes fold_batchnorm merges into their convolution
+
+    Returns:
+    -------
+        dict conv name -> (batchnorm name, batchnorm attrs)
+    """
     with open(mxnet_json) as json_file:
         jdata = json.load(json_file)
+    infos = load_infos(jdata)
+    heads = _heads(jdata)
+    convs = dict((info['top'], info) for info in infos if info['op'] in ('Convolution', 'ChannelwiseConvolution'))
+    count = _consumers(infos, heads)
+    folds = {}
+    for info in infos:
+        if info['op'] == 'BatchNorm' and info['bottom'][0] in convs:
+            conv = info['bottom'][0]
+            if count[conv] == 1 and conv not in heads:
+                folds[conv] = (info['name'], info.get('attrs', {}))
+    return folds
 
-    with open(caffe_prototxt, "w") as prototxt_file:
-        nodes = jdata['nodes']
-        for i, node in enumerate(nodes):
-            if str(node['op']) == 'null' and str(node['name']) != 'data':
-                continue
-
-            info = {}
-            if str(node['op']) == 'null' and str(node['name']) == 'data':
-                info['op'] = 'Input'
-            else:
-                info['op'] = node['op']
-            if 'attrs' in node:
-                info['attrs'] = node['attrs']
-            node['name'] = node['name'].replace('_fwd', '')  #### SymbolBlock的问题
-            info['top'] = node['name']
-            info['bottom'] = []
-            info['params'] = []
-            for input_ids in node['inputs']:
-                input_node = nodes[input_ids[0]]
-                if str(input_node['op']) != 'null' or (str(
-                        input_node['name']) == 'data'):
-                    info['bottom'].append(str(input_node['name']))
 
+def fold_bn_params(params, folds):
+    """
+        merge batchnorm statistics into the convolution weight and bias
+
+    Parameters:
+    ----------
+        params: dict mxnet param name -> numpy array, args and auxs
+        folds: dict from get_bn_folds, only the pairs to merge
+    Returns:
+    -------
+        params without the merged batchnorm entries
+    """
+    params = dict(params)
+    for conv, (bn, attrs) in folds.items():
+        weight = params[conv + '_weight']
+        bias = params.pop(conv + '_bias', np.zeros(weight.shape[0], dtype=weight.dtype))
+        mean = params.pop(bn + '_running_mean', None)
+        if mean is None:
+            mean = params.pop(bn + '_moving_mean')
+            var = params.pop(bn + '_moving_var')
+        else:
+            var = params.pop(bn + '_running_var')
+        gamma = params.pop(bn + '_gamma')
+        beta = params.pop(bn + '_beta')
+        if attrs.get('fix_gamma', 'True') == 'True':
+            gamma = np.ones_like(gamma)
+        scale = gamma / np.sqrt(var + float(attrs.get('eps', 1e-3)))
+        params[conv + '_weight'] = weight * scale.reshape((-1, ) + (1, ) * (weight.ndim - 1))
+        params[conv + '_bias'] = (bias - mean) * scale + beta
+    return params
+
+
+def _heads(jdata):
+    nodes = jdata['nodes']
+    return set(str(nodes[h[0]]['name']).replace('_fwd', '') for h in jdata.get('heads', []))
+
+
+def _tuple(value):
+    return [int(i) for i in value.strip('()[] ').split(',') if i.strip()]
+
+
+def _window(size, kernel, stride, pad, ceil=False):
+    if ceil:
+        return int(np.ceil(float(size + 2*pad - kernel) / stride)) + 1
+    return (size + 2*pad - kernel) // stride + 1
+
+
+def infer_shapes(infos, data_shape):
+    """
+        output shape of every node of the written net
+
+    Parameters:
+    ----------
+        infos: load_infos list, tops equal to node names
+        data_shape: tuple (batch, channel, height, width)
+    Returns:
+    -------
+        dict node name -> shape tuple
+    """
+    shapes = {}
+    for info in infos:
+        attrs = info.get('attrs', {})
+        ins = [shapes[b] for b in info['bottom']]
+        op = info['op']
+        if op == 'Input':
+            shape = tuple(data_shape)
+        elif op in ('Convolution', 'ChannelwiseConvolution'):
+            n, _, h, w = ins[0]
+            kernel = _tuple(attrs['kernel'])
+            stride = _tuple(attrs.get('stride', '(1, 1)'))
+            pad = _tuple(attrs.get('pad', '(0, 0)'))
+            dilate = _tuple(attrs.get('dilate', '(1, 1)'))
+            kernel = [d*(k-1) + 1 for k, d in zip(kernel, dilate)]
+            shape = (n, int(attrs['num_filter']), _window(h, kernel[0], stride[0], pad[0]),
+                     _window(w, kernel[1], stride[1], pad[1]))
+        elif op == 'Pooling':
+            n, c, h, w = ins[0]
+            if attrs['pool_type'] == 'avg':  # written as global pooling
+                shape = (n, c, 1, 1)
+            else:  # caffe rounds up
+                kernel = _tuple(attrs['kernel'])
+                stride = _tuple(attrs.get('stride', '(1, 1)'))
+                pad = _tuple(attrs.get('pad', '(0, 0)'))
+                shape = (n, c, _window(h, kernel[0], stride[0], pad[0], True),
+                         _window(w, kernel[1], stride[1], pad[1], True))
+        elif op == 'Flatten':
+            shape = (ins[0][0], int(np.prod(ins[0][1:])))
+        elif op == 'FullyConnected':
+            shape = (ins[0][0], int(attrs['num_hidden']))
+        elif op == 'Concat':
+            axis = int(attrs.get('dim', 1))
+            shape = list(ins[0])
+            shape[axis] = sum(i[axis] for i in ins)
+            shape = tuple(shape)
+        elif op == 'broadcast_mul':
+            shape = tuple(np.broadcast(np.empty(ins[0], np.int8), np.empty(ins[1], np.int8)).shape)
+        else:  # elementwise
+            shape = ins[0]
+        shapes[info['name']] = shape
+    return shapes
+
+
+def _count(infos, shapes):
+    layers = sum(2 if info['op'] == 'BatchNorm' else 1 for info in infos)
+    tops = dict((info['top'], shapes[info['name']]) for info in infos)
+    memory = sum(int(np.prod(shape)) * 4 for shape in tops.values())
+    return layers, len(tops), memory
+
+
+def print_stats(stats):
+    for key in ('layers', 'blobs'):
+        print('%s: %d -> %d' % (key, stats[key][0], stats[key][1]))
+    print('blob memory: %.2f MB -> %.2f MB' % (stats['memory'][0] / 2.**20, stats['memory'][1] / 2.**20))
+
+
+def net_convert(mxnet_json, caffe_prototxt, fuse=True, fold_bn=True, input_shape=(3, 112, 112), batch_size=1):
+    """
+        write the caffe net define of a mxnet symbol
+
+    Parameters:
+    ----------
+        input_shape: tuple (channel, height, width) of the Input layer
+        batch_size: int
+            batch the Input layer is declared with, caffe allocates
+            every blob for it once at load time
+        fuse: bool
+            HardSwish/HardSigmoid subgraphs as single layers, activations in place
+        fold_bn: bool
+            merge BatchNorm into the convolution before it,
+            the weight converters fold the params to match
+    Returns:
+    -------
+        stats: dict 'layers', 'blobs' and 'memory' (blob bytes) -> (before, after)
+    """
+    with open(mxnet_json) as json_file:
+        jdata = json.load(json_file)
+    heads = _heads(jdata)
+    infos = load_infos(jdata)
+
+    alias = {}  # identity ops (Dropout) -> their input
+    kept = []
+    for info in infos:
+        if info['op'] == 'Dropout':
+            alias[info['top']] = info['bottom'][0]
+        else:
+            kept.append(info)
+    for info in kept:
+        info['bottom'] = [_resolve(alias, b) for b in info['bottom']]
+    data_shape = (batch_size, ) + tuple(input_shape)
+    shapes = infer_shapes(kept, data_shape)
+    for info in kept:
+        if info['op'] == 'Input':
+            info['shape'] = data_shape
+    before = _count(kept, shapes)
+
+    if fold_bn:
+        kept = fold_batchnorm(kept, heads)
+    if fuse:
+        kept = fuse_hard_activations(kept, heads)
+        # activations overwrite an input nobody else reads
+        count = _consumers(kept, heads)
+        alias = {}
+        for info in kept:
+            source = info['bottom'][0] if info['bottom'] else None
+            info['bottom'] = [_resolve(alias, b) for b in info['bottom']]
+            if info['op'] in INPLACE_OPS and count.get(source) == 1 \
+                    and info['bottom'][0] != 'data' and info['top'] not in heads:
+                alias[info['top']] = info['bottom'][0]
+                info['top'] = info['bottom'][0]
+
+    with open(caffe_prototxt, "w") as prototxt_file:
+        for info in kept:
             write_node(prototxt_file, info)
+    after = _count(kept, shapes)
+    return {'layers': (before[0], after[0]), 'blobs': (before[1], after[1]), 'memory': (before[2], after[2])}
 
 
 def parse_args():
@@ -46,10 +329,16 @@ def parse_args():
         '--mxnet-json', type=str, default='../../models/vanilla/r18/model-symbol.json')
     parser.add_argument(
         '--caffe-prototxt', type=str, default='test.prototxt')
+    parser.add_argument('--fuse', type=int, default=1, help='fuse HardSwish/HardSigmoid, in-place activations')
+    parser.add_argument('--fold_bn', type=int, default=1, help='merge BatchNorm into convolution')
+    parser.add_argument('--input_shape', type=str, default='3,112,112', help='channel,height,width')
+    parser.add_argument('--batch_size', type=int, default=1, help='batch of the Input layer')
     args = parser.parse_args()
     return args
 
 
 if __name__ == '__main__':
     args = parse_args()
-    net_convert(args.mxnet_json, args.caffe_prototxt)
+    stats = net_convert(args.mxnet_json, args.caffe_prototxt, args.fuse, args.fold_bn,
+                        _tuple(args.input_shape), args.batch_size)
+    print_stats(stats)
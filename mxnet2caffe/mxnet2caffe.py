@@ -9,73 +9,49 @@
 
 import os, sys
 import argparse
-import mxnet as mx
-from find_caffe import caffe
-import caffe
+from collections import OrderedDict
 import os.path as osp
-from json2prototxt import net_convert
+from json2prototxt import net_convert, print_stats
+from caffemodel import convert_checkpoint, write_caffemodel
+from numpy_runtime import parse_prototxt, _get
 
 
-def weight_convert(mxnet_prefix, mxnet_epoch, caffe_prototxt, caffe_model):
-    # load mxnet model
-    _, arg_params, aux_params = mx.model.load_checkpoint(
-        mxnet_prefix, mxnet_epoch)
-    # load caffe net define
-    net = caffe.Net(caffe_prototxt, caffe.TEST)
+def weight_convert(mxnet_prefix, mxnet_epoch, caffe_prototxt, caffe_model, dry_run=False, use_caffe=False):
+    """
+        write the caffemodel of a mxnet checkpoint
 
-    # convert weight
-    all_keys = list(arg_params.keys()) + list(aux_params.keys())
-    all_keys.sort()
-   
-    for i, key in enumerate(all_keys):
-        try:
-            if 'data' is key:
-                pass
-            elif '_weight' in key:
-                ckey = key.replace('_weight', '')
-                net.params[ckey][0].data.flat = arg_params[key].asnumpy().flat
-            elif '_bias' in key:
-                ckey = key.replace('_bias', '')
-                net.params[ckey][1].data.flat = arg_params[key].asnumpy().flat
-            elif '_gamma' in key and 'relu' not in key:
-                ckey = key.replace('_gamma', '_scale')
-                net.params[ckey][0].data.flat = arg_params[key].asnumpy().flat
-            elif '_gamma' in key and 'relu' in key:  # for prelu
-                ckey = key.replace('_gamma', '')
-                assert (len(net.params[ckey]) == 1)
-                net.params[ckey][0].data.flat = arg_params[key].asnumpy().flat
-            elif '_alpha' in key: # prelu
-                ckey = key.replace('_alpha', '')
-                net.params[ckey][0].data.flat = arg_params[key].asnumpy().flat
-            elif '_beta' in key:
-                ckey = key.replace('_beta', '_scale')
-                net.params[ckey][1].data.flat = arg_params[key].asnumpy().flat
-            # elif '_moving_mean' in key:
-            #     ckey = key.replace('_moving_mean', '')
-            #     net.params[ckey][0].data.flat = aux_params[key].asnumpy().flat
-            #     net.params[ckey][2].data[...] = 1
-            # elif '_moving_var' in key:
-            #     ckey = key.replace('_moving_var', '')
-            #     net.params[ckey][1].data.flat = aux_params[key].asnumpy().flat
-            #     net.params[ckey][2].data[...] = 1
-            elif '_running_mean' in key:
-                ckey = key.replace('_running_mean', '')
-                net.params[ckey][0].data.flat = aux_params[key].asnumpy().flat
-                net.params[ckey][2].data[...] = 1
-            elif '_running_var' in key:
-                ckey = key.replace('_running_var', '')
-                net.params[ckey][1].data.flat = aux_params[key].asnumpy().flat
-                net.params[ckey][2].data[...] = 1
-            else:
-                sys.exit("Warning!  Unknown mxnet: {}".format(key))
+    Parameters:
+    ----------
+        dry_run: bool
+            only print the param -> blob mapping and the unmatched params
+        use_caffe: bool
+            fill a caffe.Net and save it, instead of writing the protobuf directly
+    Returns:
+    -------
+        unmatched: mxnet params without a layer in the prototxt
+        missing: (layer, blob index) without a mxnet param
+    """
+    layer_types = OrderedDict((_get(l, 'name'), _get(l, 'type')) for l in parse_prototxt(caffe_prototxt).get('layer', []))
+    blobs, unmatched, missing = convert_checkpoint(mxnet_prefix, mxnet_epoch, layer_types)
+    for key in unmatched:
+        print("Warning!  key error mxnet: {}".format(key))
+    for layer, index in missing:
+        print("Warning!  no mxnet param for {} blob {}".format(layer, index))
+    if dry_run:
+        for layer, arrays in blobs.items():
+            print('%-45s %s' % (layer, ' '.join('x'.join(str(d) for d in a.shape) for a in arrays)))
+        return unmatched, missing
 
-            # print("% 3d | %s -> %s" % (i, key.ljust(40), ckey.ljust(30)))
-
-        except KeyError:
-            if key != 'fc7_weight':
-                print("\nWarning!  key error mxnet: {}".format(key))
-
-    net.save(caffe_model)
+    if use_caffe:
+        from find_caffe import caffe
+        net = caffe.Net(caffe_prototxt, caffe.TEST)
+        for layer, arrays in blobs.items():
+            for blob, array in zip(net.params[layer], arrays):
+                blob.data[...] = array.reshape(blob.data.shape)
+        net.save(caffe_model)
+    else:
+        write_caffemodel(caffe_model, blobs, layer_types)
+    return unmatched, missing
 
 
 def parse_args():
@@ -87,6 +63,12 @@ def parse_args():
     parser.add_argument('--prototxt', type=str, default='caffe.prototxt')
     parser.add_argument('--caffemodel', type=str, default='caffe.caffemodel')
     parser.add_argument('--trans', type=str, default='net', help='net or weight')
+    parser.add_argument('--fuse', type=int, default=1, help='fuse HardSwish/HardSigmoid, in-place activations')
+    parser.add_argument('--fold_bn', type=int, default=1, help='merge BatchNorm into convolution')
+    parser.add_argument('--input_shape', type=str, default='3,112,112', help='channel,height,width')
+    parser.add_argument('--batch_size', type=int, default=1, help='batch of the Input layer')
+    parser.add_argument('--dry_run', type=int, default=0, help='weight: only list the param mapping')
+    parser.add_argument('--use_caffe', type=int, default=0, help='weight: save through caffe.Net')
     args = parser.parse_args()
     return args
 
@@ -100,11 +82,14 @@ if __name__ == '__main__':
     caffemodel = osp.join(args.save, args.caffemodel)
     if args.trans == 'net':
         json = osp.join(args.save, args.prefix + '-symbol.json')
-        net_convert(json, prototxt)
+        input_shape = tuple(int(i) for i in args.input_shape.split(','))
+        stats = net_convert(json, prototxt, args.fuse, args.fold_bn, input_shape, args.batch_size)
+        print_stats(stats)
         print('Convert net define from %s to %s' % (json, prototxt))
     elif args.trans == 'weight':
         params = osp.join(args.save, args.prefix)
-        weight_convert(params, args.epoch, prototxt, caffemodel)
-        print('Convert weight define from %s to %s' % (params, caffemodel))
+        weight_convert(params, args.epoch, prototxt, caffemodel, args.dry_run, args.use_caffe)
+        if not args.dry_run:
+            print('Convert weight define from %s to %s' % (params, caffemodel))
 
     
@@ -0,0 +1,213 @@
+'''
+Export the best_pose-symbol.json/params written by train.py to ONNX.
+
+The exported graph is cleaned up for onnxruntime: weights are removed from
+the graph inputs so they are constant-folded, the plus/clip/div[/mul] chains
+of MobileNetV3 become single HardSigmoid/HardSwish nodes, the outputs are
+named fc_bin/fc_pyr and the batch dimension is symbolic.
+
+python mxnet2onnx.py --save model/ --prefix best_pose --onnx pose.onnx
+python mxnet2onnx.py --save model/ --prefix best_pose --onnx pose.onnx --check 1
+'''
+import argparse
+import os.path as osp
+import sys
+import time
+import numpy as np
+import mxnet as mx
+import onnx
+from onnx import helper, numpy_helper
+
+
+def _export(sym_file, params_file, shape, onnx_file):
+    if hasattr(mx, 'onnx'):  # mxnet >= 1.9
+        return mx.onnx.export_model(sym_file, params_file, [shape], [np.float32], onnx_file,
+                                    dynamic=True, dynamic_input_shapes=[(None, ) + tuple(shape[1:])])
+    return mx.contrib.onnx.export_model(sym_file, params_file, [shape], np.float32, onnx_file)
+
+
+def _scalar(inits, name, value):
+    return name in inits and inits[name].size == 1 and float(inits[name].flat[0]) == value
+
+
+def fuse_hard_activations(graph, hard_swish=True):
+    """
+        Add(x, 3) -> Clip(0, 6) -> Div(6) [-> Mul(x, .)] as HardSigmoid [HardSwish]
+
+    Parameters:
+    ----------
+        graph: onnx GraphProto, edited in place
+        hard_swish: bool
+            HardSwish needs opset 14, else the Mul is kept after a HardSigmoid
+    Returns:
+    -------
+        number of fused chains
+    """
+    inits = dict((i.name, numpy_helper.to_array(i)) for i in graph.initializer)
+    users = {}
+    for node in graph.node:
+        for name in node.input:
+            users.setdefault(name, []).append(node)
+    outputs = set(o.name for o in graph.output)
+
+    def only_user(node, op_type):
+        nodes = users.get(node.output[0], [])
+        if len(nodes) != 1 or nodes[0].op_type != op_type or node.output[0] in outputs:
+            return None
+        return nodes[0]
+
+    removed, fused = set(), {}
+    for add in graph.node:
+        if add.op_type != 'Add' or not _scalar(inits, add.input[1], 3):
+            continue
+        clip = only_user(add, 'Clip')
+        if clip is None or len(clip.input) != 3 or not _scalar(inits, clip.input[1], 0) \
+                or not _scalar(inits, clip.input[2], 6):
+            continue
+        div = only_user(clip, 'Div')
+        if div is None or not _scalar(inits, div.input[1], 6):
+            continue
+        x = add.input[0]
+        chain = [add, clip, div]
+        mul = only_user(div, 'Mul')
+        if hard_swish and mul is not None and sorted(mul.input) == sorted([x, div.output[0]]):
+            chain.append(mul)
+            node = helper.make_node('HardSwish', [x], [mul.output[0]], name=mul.name)
+        else:
+            node = helper.make_node('HardSigmoid', [x], [div.output[0]], name=div.name, alpha=1/6., beta=0.5)
+        for n in chain:
+            removed.add(id(n))
+        fused[id(chain[-1])] = node
+
+    nodes = [fused.get(id(n), n) for n in graph.node if id(n) not in removed or id(n) in fused]
+    del graph.node[:]
+    graph.node.extend(nodes)
+    # drop the scalar initializers nobody reads anymore
+    used = set(name for n in graph.node for name in n.input)
+    inits = [i for i in graph.initializer if i.name in used]
+    del graph.initializer[:]
+    graph.initializer.extend(inits)
+    return len(fused)
+
+
+def rename(graph, old, new):
+    for node in graph.node:
+        for i, name in enumerate(node.input):
+            if name == old:
+                node.input[i] = new
+        for i, name in enumerate(node.output):
+            if name == old:
+                node.output[i] = new
+    for value in graph.output:
+        if value.name == old:
+            value.name = new
+
+
+def clean_model(model, fuse=True):
+    graph = model.graph
+    # weights as graph inputs are not constant-folded by onnxruntime
+    inits = set(i.name for i in graph.initializer)
+    inputs = [i for i in graph.input if i.name not in inits]
+    del graph.input[:]
+    graph.input.extend(inputs)
+    for value in graph.input:
+        value.type.tensor_type.shape.dim[0].dim_param = 'batch'
+    for value in list(graph.output):
+        if value.name.endswith('_fwd'):  # SymbolBlock names
+            rename(graph, value.name, value.name[:-len('_fwd')])
+    for value in graph.output:
+        value.type.tensor_type.shape.dim[0].dim_param = 'batch'
+    fused = 0
+    if fuse:
+        opset = max(o.version for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+        fused = fuse_hard_activations(graph, hard_swish=opset >= 14)
+    onnx.checker.check_model(model)
+    return fused
+
+
+def export_onnx(mxnet_prefix, mxnet_epoch, onnx_file, input_shape=(3, 112, 112), batch_size=1, fuse=True):
+    """
+        mxnet checkpoint -> onnx model with a symbolic batch dimension
+
+    Returns:
+    -------
+        number of nodes, number of fused hard activations
+    """
+    _export('%s-symbol.json' % mxnet_prefix, '%s-%04d.params' % (mxnet_prefix, mxnet_epoch),
+            (batch_size, ) + tuple(input_shape), onnx_file)
+    model = onnx.load(onnx_file)
+    fused = clean_model(model, fuse)
+    onnx.save(model, onnx_file)
+    return len(model.graph.node), fused
+
+
+def check(mxnet_prefix, mxnet_epoch, onnx_file, data, repeat=10, num_threads=0):
+    """
+        run the same batch through mxnet and onnxruntime (cpu)
+
+    Returns:
+    -------
+        dict output -> max abs diff, mxnet ms, onnxruntime ms
+    """
+    import onnxruntime as ort
+    sym = mx.sym.load('%s-symbol.json' % mxnet_prefix)
+    net = mx.gluon.SymbolBlock(sym, mx.sym.var('data'))
+    net.load_parameters('%s-%04d.params' % (mxnet_prefix, mxnet_epoch), ctx=mx.cpu())
+    net.hybridize(static_alloc=True, static_shape=True)
+    x = mx.nd.array(data)
+    ref = net(x)
+    ref = ref if isinstance(ref, (list, tuple)) else [ref]
+    mx.nd.waitall()
+    tic = time.time()
+    for _ in range(repeat):
+        out = net(x)
+        mx.nd.waitall()
+    mx_cost = (time.time() - tic) / repeat
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = num_threads
+    sess = ort.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+    names = [o.name for o in sess.get_outputs()]
+    feed = {sess.get_inputs()[0].name: data}
+    outs = sess.run(names, feed)
+    tic = time.time()
+    for _ in range(repeat):
+        sess.run(names, feed)
+    ort_cost = (time.time() - tic) / repeat
+
+    diffs = dict((name, float(np.abs(r.asnumpy() - o).max())) for name, r, o in zip(names, ref, outs))
+    return diffs, mx_cost*1000, ort_cost*1000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert MXNet model to ONNX')
+    parser.add_argument('--save', type=str, default='./model', help='save path')
+    parser.add_argument('--prefix', type=str, default='best_pose', help='mxnet prefix')
+    parser.add_argument('--epoch', type=int, default=0, help='mxnet epoch')
+    parser.add_argument('--onnx', type=str, default='pose.onnx')
+    parser.add_argument('--input_shape', type=str, default='3,112,112', help='channel,height,width')
+    parser.add_argument('--fuse', type=int, default=1, help='fuse HardSwish/HardSigmoid')
+    parser.add_argument('--check', type=int, default=0, help='compare onnxruntime with mxnet after export')
+    parser.add_argument('--bs', type=int, default=8, help='check batch size')
+    parser.add_argument('--atol', type=float, default=1e-4, help='check max abs diff')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    prefix = osp.join(args.save, args.prefix)
+    onnx_file = osp.join(args.save, args.onnx)
+    input_shape = tuple(int(i) for i in args.input_shape.split(','))
+    nodes, fused = export_onnx(prefix, args.epoch, onnx_file, input_shape, fuse=args.fuse)
+    print('Convert %s to %s: %d nodes, %d hard activations fused' % (prefix, onnx_file, nodes, fused))
+    if args.check:
+        data = np.random.uniform(-1, 1, (args.bs, ) + input_shape).astype(np.float32)
+        diffs, mx_cost, ort_cost = check(prefix, args.epoch, onnx_file, data)
+        for name, diff in diffs.items():
+            print('%s max abs diff: %.3e' % (name, diff))
+        print('forward %d: mxnet %.2f ms, onnxruntime %.2f ms' % (args.bs, mx_cost, ort_cost))
+        if max(diffs.values()) > args.atol:
+            print('Conversion mismatch!')
+            sys.exit(1)
@@ -0,0 +1,377 @@
+'''
+Pure NumPy runtime for the prototxt written by json2prototxt.net_convert,
+so converted models can run (and be checked) on hosts without Caffe.
+
+Weights are read from a .npz holding one array per caffe blob, keyed
+"<layer name>/<blob index>" (see export_weights), or from a .caffemodel.
+'''
+import argparse
+import re
+import time
+import numpy as np
+
+
+# ----------------------------------------------------------------
+# prototxt
+_TOKEN = re.compile(r'"[^"]*"|[{}:]|[^\s{}:"]+')
+
+
+def _value(token):
+    if token.startswith('"'):
+        return token[1:-1]
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def _parse_message(tokens, pos):
+    msg = {}
+    while pos < len(tokens):
+        key = tokens[pos]
+        if key == '}':
+            return msg, pos + 1
+        pos += 1
+        if tokens[pos] == ':':
+            pos += 1
+        if tokens[pos] == '{':
+            value, pos = _parse_message(tokens, pos + 1)
+        else:
+            value, pos = _value(tokens[pos]), pos + 1
+        msg.setdefault(key, []).append(value)
+    return msg, pos
+
+
+def parse_prototxt(path):
+    """
+    Returns:
+        dict field -> list of values, messages are dicts of the same form
+    """
+    with open(path) as f:
+        text = '\n'.join(line.split('#')[0] for line in f)
+    msg, _ = _parse_message(_TOKEN.findall(text), 0)
+    return msg
+
+
+def _get(msg, key, default=None):
+    return msg[key][0] if key in msg else default
+
+
+# ----------------------------------------------------------------
+# layers, every forward takes (layer, blobs of the layer, bottoms) -> top
+def _pad(x, pad, value=0):
+    if pad == 0:
+        return x
+    return np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant', constant_values=value)
+
+
+def _windows(x, kernel, stride, out_h, out_w):
+    """strided view N x C x kernel x kernel x out_h x out_w, no copy"""
+    n, c, h, w = x.shape
+    s = x.strides
+    return np.lib.stride_tricks.as_strided(
+        x, shape=(n, c, kernel, kernel, out_h, out_w),
+        strides=(s[0], s[1], s[2], s[3], s[2]*stride, s[3]*stride), writeable=False)
+
+
+def convolution(layer, blobs, bottoms):
+    x = bottoms[0]
+    param = _get(layer, 'convolution_param', {})
+    kernel = _get(param, 'kernel_size')
+    stride = _get(param, 'stride', 1)
+    pad = _get(param, 'pad', 0)
+    group = _get(param, 'group', 1)
+    weight = blobs[0]
+    num_out = weight.shape[0]
+
+    x = _pad(x, pad)
+    n, c, h, w = x.shape
+    out_h = (h - kernel)//stride + 1
+    out_w = (w - kernel)//stride + 1
+
+    if kernel == 1 and group == 1:
+        x = x[:, :, ::stride, ::stride]
+        out = np.matmul(weight.reshape(num_out, c), x.reshape(n, c, -1))
+    elif group == c and num_out == c:
+        # depthwise: accumulate the kernel taps over shifted views
+        out = np.zeros((n, c, out_h, out_w), dtype=np.float32)
+        for i in range(kernel):
+            for j in range(kernel):
+                tap = x[:, :, i:i+stride*(out_h-1)+1:stride, j:j+stride*(out_w-1)+1:stride]
+                out += tap * weight[:, 0, i, j].reshape(1, c, 1, 1)
+    elif group == 1:
+        cols = _windows(x, kernel, stride, out_h, out_w)
+        out = np.tensordot(weight, cols, axes=([1, 2, 3], [1, 2, 3])).transpose(1, 0, 2, 3)
+    else:
+        cols = _windows(x, kernel, stride, out_h, out_w).reshape(n, group, c//group, kernel, kernel, out_h, out_w)
+        out = np.einsum('ngcklhw,gockl->ngohw', cols,
+                        weight.reshape(group, num_out//group, c//group, kernel, kernel), optimize=True)
+    out = out.reshape(n, num_out, out_h, out_w)
+    if _get(param, 'bias_term', 'true') != 'false' and len(blobs) > 1:
+        out = out + blobs[1].reshape(1, -1, 1, 1)
+    return out.astype(np.float32, copy=False)
+
+
+def batch_norm(layer, blobs, bottoms):
+    param = _get(layer, 'batch_norm_param', {})
+    eps = _get(param, 'eps', 1e-5)
+    # caffe: a moving average factor of 0 zeroes mean and var
+    scale = 1.
+    if len(blobs) > 2:
+        scale = 0. if blobs[2].flat[0] == 0 else 1. / blobs[2].flat[0]
+    mean = (blobs[0]*scale).reshape(1, -1, 1, 1)
+    std = np.sqrt(blobs[1]*scale + eps).reshape(1, -1, 1, 1)
+    return (bottoms[0] - mean) / std
+
+
+def scale(layer, blobs, bottoms):
+    shape = (1, -1) + (1, ) * (bottoms[0].ndim - 2)
+    out = bottoms[0] * blobs[0].reshape(shape)
+    if len(blobs) > 1:
+        out = out + blobs[1].reshape(shape)
+    return out
+
+
+def relu(layer, blobs, bottoms):
+    return np.maximum(bottoms[0], 0)
+
+
+def relu6(layer, blobs, bottoms):
+    return np.clip(bottoms[0], 0, 6)
+
+
+def hardsigmoid(layer, blobs, bottoms):
+    return np.clip(bottoms[0] + 3, 0, 6) / 6
+
+
+def hardswish(layer, blobs, bottoms):
+    return bottoms[0] * np.clip(bottoms[0] + 3, 0, 6) / 6
+
+
+def prelu(layer, blobs, bottoms):
+    x = bottoms[0]
+    slope = blobs[0].reshape((1, -1) + (1, ) * (x.ndim - 2))
+    return np.where(x > 0, x, x * slope)
+
+
+def elu(layer, blobs, bottoms):
+    alpha = _get(_get(layer, 'elu_param', {}), 'alpha', 1.)
+    x = bottoms[0]
+    return np.where(x > 0, x, alpha * (np.exp(np.minimum(x, 0)) - 1))
+
+
+def pooling(layer, blobs, bottoms):
+    x = bottoms[0]
+    param = _get(layer, 'pooling_param', {})
+    pool = _get(param, 'pool', 'MAX')
+    if pool not in ('MAX', 'AVE'):
+        raise NotImplementedError('%s pooling' % pool)
+    for key in ('kernel_h', 'kernel_w', 'stride_h', 'stride_w', 'pad_h', 'pad_w'):
+        if key in param:
+            raise NotImplementedError('pooling with %s, only square kernel_size/stride/pad' % key)
+    if _get(param, 'global_pooling', 'false') == 'true':
+        if pool == 'AVE':
+            return x.mean(axis=(2, 3), keepdims=True)
+        return x.max(axis=(2, 3), keepdims=True)
+    kernel = _get(param, 'kernel_size')
+    stride = _get(param, 'stride', 1)
+    pad = _get(param, 'pad', 0)
+    n, c, h, w = x.shape
+    # caffe rounds the output size up, but the last window must start inside the image or its left pad
+    out_h = int(np.ceil(float(h + 2*pad - kernel)/stride)) + 1
+    out_w = int(np.ceil(float(w + 2*pad - kernel)/stride)) + 1
+    if pad > 0 and (out_h - 1)*stride >= h + pad:
+        out_h -= 1
+    if pad > 0 and (out_w - 1)*stride >= w + pad:
+        out_w -= 1
+    extra_h = max((out_h - 1)*stride + kernel - h - pad, 0)
+    extra_w = max((out_w - 1)*stride + kernel - w - pad, 0)
+    value = -np.inf if pool == 'MAX' else 0
+    x = np.pad(x, ((0, 0), (0, 0), (pad, extra_h), (pad, extra_w)), mode='constant', constant_values=value)
+    cols = _windows(x, kernel, stride, out_h, out_w)
+    if pool == 'MAX':
+        return cols.max(axis=(2, 3))
+    # caffe divides by the window clipped to the padded image: pad cells count, the overhang does not
+    count_h = np.minimum(kernel, h + 2*pad - np.arange(out_h)*stride)
+    count_w = np.minimum(kernel, w + 2*pad - np.arange(out_w)*stride)
+    return cols.sum(axis=(2, 3)) / (count_h[:, None] * count_w[None, :]).astype(np.float32)
+
+
+def eltwise(layer, blobs, bottoms):
+    param = _get(layer, 'eltwise_param', {})
+    op = _get(param, 'operation', 'SUM')
+    coeff = [float(c) for c in param.get('coeff', [])]
+    if coeff and (op != 'SUM' or len(coeff) != len(bottoms)):
+        raise ValueError('eltwise %s: coeff needs SUM and one value per bottom' % _get(layer, 'name'))
+    if coeff:
+        return sum(c * b for c, b in zip(coeff, bottoms))
+    out = bottoms[0]
+    for b in bottoms[1:]:
+        if op == 'PROD':
+            out = out * b
+        elif op == 'MAX':
+            out = np.maximum(out, b)
+        else:
+            out = out + b
+    return out
+
+
+def broadcast_mul(layer, blobs, bottoms):
+    return bottoms[0] * bottoms[1]
+
+
+def inner_product(layer, blobs, bottoms):
+    x = bottoms[0].reshape(bottoms[0].shape[0], -1)
+    out = np.matmul(x, blobs[0].reshape(blobs[0].shape[0], -1).T)
+    if len(blobs) > 1:
+        out = out + blobs[1]
+    return out
+
+
+def power(layer, blobs, bottoms):
+    param = _get(layer, 'power_param', {})
+    out = bottoms[0] * _get(param, 'scale', 1.) + _get(param, 'shift', 0.)
+    p = _get(param, 'power', 1.)
+    return out if p == 1 else out ** p
+
+
+def flatten(layer, blobs, bottoms):
+    return bottoms[0].reshape(bottoms[0].shape[0], -1)
+
+
+def concat(layer, blobs, bottoms):
+    return np.concatenate(bottoms, axis=_get(_get(layer, 'concat_param', {}), 'axis', 1))
+
+
+LAYERS = {
+    'Convolution': convolution,
+    'BatchNorm': batch_norm,
+    'Scale': scale,
+    'ReLU': relu,
+    'ReLU6': relu6,
+    'HardSigmoid': hardsigmoid,
+    'HardSwish': hardswish,
+    'PReLU': prelu,
+    'ELU': elu,
+    'Pooling': pooling,
+    'Eltwise': eltwise,
+    'Broadcastmul': broadcast_mul,
+    'InnerProduct': inner_product,
+    'Power': power,
+    'Flatten': flatten,
+    'Concat': concat,
+}
+
+
+class Net(object):
+    """Caffe-like net running on NumPy.
+
+    Args:
+        prototxt: net define from json2prototxt
+        weights: .npz from export_weights or a .caffemodel
+        outputs: blobs forward returns, default the tops no layer consumes
+            and fc_bin (consumed by the fc_pyr head of use_fc models)
+    """
+    def __init__(self, prototxt, weights=None, outputs=None):
+        proto = parse_prototxt(prototxt)
+        self.layers = proto.get('layer', [])
+        for layer in self.layers:
+            kind = _get(layer, 'type')
+            if kind != 'Input' and kind not in LAYERS:
+                raise NotImplementedError('unsupported caffe layer: %s' % kind)
+        self.params = {}
+        if weights is not None:
+            self.load_weights(weights)
+        self.inputs = [_get(l, 'top') for l in self.layers if _get(l, 'type') == 'Input']
+        bottoms = set(b for l in self.layers for b in l.get('bottom', []))
+        tops = []
+        for layer in self.layers:
+            for top in layer.get('top', []):
+                if top not in bottoms and top not in tops:
+                    tops.append(top)
+        if outputs is None:
+            outputs = tops + [t for t in ['fc_bin'] if t in bottoms and t not in tops]
+        self.outputs = outputs
+        self.blobs = {}
+        self.layer_times = {}
+
+    def load_weights(self, weights):
+        if weights.endswith('.caffemodel'):
+            from caffemodel import read_caffemodel
+            self.params = dict((k, [a.astype(np.float32) for a in v]) for k, v in read_caffemodel(weights).items())
+            return
+        data = np.load(weights)
+        for key in data.files:
+            name, index = key.rsplit('/', 1)
+            self.params.setdefault(name, {})[int(index)] = data[key].astype(np.float32)
+        self.params = {k: [v[i] for i in sorted(v)] for k, v in self.params.items()}
+
+    def forward(self, data, timing=False):
+        """
+        Args:
+            data: N x C x H x W float32 batch, or dict input name -> batch
+            timing: record the cost of every layer in self.layer_times
+        Returns:
+            dict output name -> array
+        """
+        if not isinstance(data, dict):
+            data = {self.inputs[0]: data}
+        self.blobs = {k: np.asarray(v, dtype=np.float32) for k, v in data.items()}
+        self.layer_times = {}
+        for layer in self.layers:
+            kind = _get(layer, 'type')
+            if kind == 'Input':
+                continue
+            name = _get(layer, 'name')
+            tic = time.time() if timing else 0
+            bottoms = [self.blobs[b] for b in layer.get('bottom', [])]
+            out = LAYERS[kind](layer, self.params.get(name, []), bottoms)
+            self.blobs[_get(layer, 'top')] = out
+            if timing:
+                self.layer_times[name] = time.time() - tic
+        return {k: self.blobs[k] for k in self.outputs}
+
+
+# ----------------------------------------------------------------
+def export_weights(mxnet_prefix, mxnet_epoch, caffe_prototxt, weights):
+    """write the mxnet checkpoint as a .npz of caffe blobs for Net"""
+    from caffemodel import convert_checkpoint
+    names = [_get(l, 'name') for l in parse_prototxt(caffe_prototxt).get('layer', [])]
+    blobs, unmatched, _ = convert_checkpoint(mxnet_prefix, mxnet_epoch, names)
+    for key in unmatched:
+        print('Warning!  key error mxnet: {}'.format(key))
+    np.savez(weights, **dict(('%s/%d' % (layer, i), a) for layer, arrays in blobs.items()
+                             for i, a in enumerate(arrays)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a converted prototxt with NumPy')
+    parser.add_argument('--prototxt', type=str, default='./model/pose.prototxt')
+    parser.add_argument('--weights', type=str, default='./model/pose.npz')
+    parser.add_argument('--export', type=str, default='', help='mxnet prefix to export the weights from first')
+    parser.add_argument('--epoch', type=int, default=0, help='mxnet epoch')
+    parser.add_argument('--bs', type=int, default=8)
+    parser.add_argument('--shape', type=str, default='3,112,112')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.export:
+        export_weights(args.export, args.epoch, args.prototxt, args.weights)
+        print('Export weight from %s to %s' % (args.export, args.weights))
+    net = Net(args.prototxt, args.weights)
+    data = np.random.uniform(-1, 1, [args.bs] + [int(i) for i in args.shape.split(',')]).astype(np.float32)
+    net.forward(data)
+    tic = time.time()
+    out = net.forward(data, timing=True)
+    print('forward %d: %.2f ms' % (args.bs, (time.time() - tic)*1000))
+    for name, value in out.items():
+        print(name, value.shape)
+    for name, cost in sorted(net.layer_times.items(), key=lambda x: -x[1])[:10]:
+        print('%-40s %.3f ms' % (name, cost*1000))
@@ -15,7 +15,8 @@ def Input(txt_file, info):
     txt_file.write('  type: "Input"\n')
     txt_file.write('  top: "data"\n')
     txt_file.write('  input_param {\n')
-    txt_file.write('    shape: { dim: 1 dim: 3 dim: 112 dim: 112 }\n')  # TODO
+    shape = info.get('shape', (1, 3, 112, 112))
+    txt_file.write('    shape: { %s }\n' % ' '.join('dim: %d' % i for i in shape))
     txt_file.write('  }\n')
     txt_file.write('}\n')
     txt_file.write('\n')
@@ -28,12 +29,12 @@ def Convolution(txt_file, info):
         bias_term = 'true'
 
     txt_file.write('layer {\n')
-    if info['top'] == 'conv0':
+    if info['name'] == 'conv0':
         txt_file.write('	bottom: "data"\n')
     else:
         txt_file.write('	bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('	top: "%s"\n' % info['top'])
-    txt_file.write('	name: "%s"\n' % info['top'])
+    txt_file.write('	name: "%s"\n' % info['name'])
     txt_file.write('	type: "Convolution"\n')
     txt_file.write('	convolution_param {\n')
     txt_file.write('		num_output: %s\n' % info['attrs']['num_filter'])
@@ -62,7 +63,7 @@ def BatchNorm(txt_file, info):
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "BatchNorm"\n')
     txt_file.write('  batch_norm_param {\n')
     txt_file.write('    use_global_stats: true\n')  # TODO
@@ -80,7 +81,7 @@ def BatchNorm(txt_file, info):
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['top'])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s_scale"\n' % info['top'])
+    txt_file.write('  name: "%s_scale"\n' % info['name'])
     txt_file.write('  type: "Scale"\n')
     txt_file.write('  scale_param { bias_term: true }\n')
     txt_file.write('}\n')
@@ -88,12 +89,12 @@ def BatchNorm(txt_file, info):
 
 ## Relu
 def Activation(txt_file, info):  
-    if info['top'].startswith('activation'):
+    if info['name'].startswith('activation'):
         return
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "ReLU"\n')  # TODO
     txt_file.write('}\n')
     txt_file.write('\n')
@@ -103,7 +104,7 @@ def LeakyReLU(txt_file, info):
         txt_file.write('layer {\n')
         txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
         txt_file.write('  top: "%s"\n' % info['top'])
-        txt_file.write('  name: "%s"\n' % info['top'])
+        txt_file.write('  name: "%s"\n' % info['name'])
         txt_file.write('  type: "ELU"\n')
         txt_file.write('  elu_param { alpha: 0.25 }\n')
         txt_file.write('}\n')
@@ -112,7 +113,7 @@ def LeakyReLU(txt_file, info):
         txt_file.write('layer {\n')
         txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
         txt_file.write('  top: "%s"\n' % info['top'])
-        txt_file.write('  name: "%s"\n' % info['top'])
+        txt_file.write('  name: "%s"\n' % info['name'])
         txt_file.write('  type: "PReLU"\n')
         txt_file.write('}\n')
         txt_file.write('\n')
@@ -123,14 +124,14 @@ def Relu6(txt_file, info):
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "ReLU6"\n')  # TODO
     txt_file.write('}\n')
     txt_file.write('\n')
 
 def Concat(txt_file, info):
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Concat"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -144,7 +145,7 @@ def Pooling(txt_file, info):
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Pooling"\n')
     txt_file.write('  pooling_param {\n')
     txt_file.write('    pool: %s\n' % pool_type)  # TODO
@@ -163,7 +164,7 @@ def Pooling(txt_file, info):
 
 def Flatten(txt_file, info):
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Flatten"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -180,7 +181,7 @@ def Normalize(txt_file, info):
     txt_file.write('layer {\n')
     txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Normalize"\n')
     txt_file.write('  norm_param {\n')
     txt_file.write('    scale_filler {\n')
@@ -195,7 +196,7 @@ def Eltwise(txt_file, info, op):
     txt_file.write('layer {\n')
     txt_file.write('  type: "Eltwise"\n')
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     for btom in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % btom)
     txt_file.write('  eltwise_param { operation: %s }\n' % op)
@@ -207,7 +208,7 @@ def ElementWiseSum(txt_file, info):
         return
 
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Eltwise"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -220,7 +221,7 @@ def ElementWiseProd(txt_file, info):
     if info['bottom'][1].startswith('broadcast'):
         return
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Eltwise"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -241,7 +242,7 @@ def Power(txt_file, info):
         scale = float(info['attrs']['scalar'])
         out = '    scale:%f\n'%scale
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Power"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -257,12 +258,9 @@ def FullyConnected(txt_file, info):
         return
 
     txt_file.write('layer {\n')
-    if info['bottom'][0] == 'dropout0':
-        txt_file.write('  bottom: "hardswish18__mul0"\n')
-    else:
-        txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
+    txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
     txt_file.write('  top: "%s"\n' % info['top'])
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "InnerProduct"\n')
     txt_file.write('  inner_product_param {\n')
     txt_file.write('    num_output: %s\n' % info['attrs']['num_hidden'])
@@ -270,9 +268,18 @@ def FullyConnected(txt_file, info):
     txt_file.write('}\n')
     txt_file.write('\n')
 
+def HardSwish(txt_file, info):
+    txt_file.write('layer {\n')
+    txt_file.write('  bottom: "%s"\n' % info['bottom'][0])
+    txt_file.write('  top: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
+    txt_file.write('  type: "%s"\n' % info['op'])  # HardSwish or HardSigmoid
+    txt_file.write('}\n')
+    txt_file.write('\n')
+
 def Broadcastmul(txt_file, info):
     txt_file.write('layer {\n')
-    txt_file.write('  name: "%s"\n' % info['top'])
+    txt_file.write('  name: "%s"\n' % info['name'])
     txt_file.write('  type: "Broadcastmul"\n')
     for bottom_i in info['bottom']:
         txt_file.write('  bottom: "%s"\n' % bottom_i)
@@ -310,6 +317,8 @@ def write_node(txt_file, info):
         Eltwise(txt_file, info, 'SUM')
     elif info['op'] == 'elemwise_mul':
         Eltwise(txt_file, info, 'PROD')
+    elif info['op'] in ('HardSwish', 'HardSigmoid'):
+        HardSwish(txt_file, info)
     elif info['op'] == 'broadcast_mul':
         Broadcastmul(txt_file, info)
     elif '_scalar' in info['op']: # _plus_scalar, _div_scalar,_mul_scalar  
@@ -0,0 +1,180 @@
+'''
+Check a converted model against the mxnet export it came from.
+
+Feeds the same batch of AFLW2000 crops through the mxnet symbol and the
+converted prototxt (Caffe or the NumPy runtime), reports the max abs diff of
+every blob whose name matches between both graphs, the final pitch/yaw/roll
+diff and the per-layer cost of both runtimes.
+
+python verify.py --prefix model/best_pose --prototxt model/pose.prototxt --runtime numpy --weights model/pose.npz
+python verify.py --prefix model/best_pose --prototxt model/pose.prototxt --runtime caffe --caffemodel model/pose.caffemodel
+'''
+import argparse
+import os.path as osp
+import sys
+import time
+import numpy as np
+import mxnet as mx
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+
+
+def load_batch(data_dir, anno, num, shape):
+    """deterministic crops of the first `num` AFLW2000 faces, random data without the dataset"""
+    if not osp.exists(data_dir) or not osp.exists(anno):
+        print('No dataset in %s, use random input' % data_dir)
+        return np.random.uniform(-1, 1, (num, ) + shape).astype(np.float32), None
+    import cv2
+    from test import crop
+    faces, pyrs = [], []
+    with open(anno) as f:
+        lines = f.readlines()[1:num+1]
+    for line in lines:
+        line = line.split()
+        img = cv2.imread(osp.join(data_dir, line[0]))
+        faces.append(crop(img, [int(i) for i in line[4:8]], shape[-1]))
+        pyrs.append([float(i)*180/np.pi for i in line[1:4]])
+    return np.array(faces, dtype=np.float32), np.array(pyrs, dtype=np.float32)
+
+
+def mxnet_blobs(prefix, epoch, data, names):
+    """forward every internal output whose name is a caffe blob"""
+    internals = mx.sym.load('%s-symbol.json' % prefix).get_internals()
+    outputs, blob_names = [], []
+    for out in internals.list_outputs():
+        name = out[:-len('_output')].replace('_fwd', '') if out.endswith('_output') else None
+        if name in names:
+            outputs.append(internals[out])
+            blob_names.append(name)
+    net = mx.gluon.SymbolBlock(outputs, mx.sym.var('data'))
+    net.load_parameters('%s-%04d.params' % (prefix, epoch), ctx=mx.cpu(), ignore_extra=True)
+    data = mx.nd.array(data)
+    net(data)
+    mx.nd.waitall()
+
+    # per-operator cost from the profiler
+    mx.profiler.set_config(profile_imperative=True, aggregate_stats=True, filename='/tmp/verify_profile.json')
+    mx.profiler.set_state('run')
+    tic = time.time()
+    out = net(data)
+    mx.nd.waitall()
+    cost = time.time() - tic
+    mx.profiler.set_state('stop')
+    return dict(zip(blob_names, [o.asnumpy() for o in out])), cost, mx.profiler.dumps(reset=True)
+
+
+def converted_blobs(args, data):
+    """
+    Returns:
+        blobs: dict name -> array
+        cost: forward seconds
+        layer_times: dict layer -> seconds
+    """
+    if args.runtime == 'numpy':
+        from numpy_runtime import Net
+        net = Net(args.prototxt, args.weights)
+        tic = time.time()
+        net.forward(data, timing=True)
+        return net.blobs, time.time() - tic, net.layer_times
+
+    from find_caffe import caffe
+    caffe.set_mode_cpu()
+    net = caffe.Net(args.prototxt, args.caffemodel, caffe.TEST)
+    net.blobs['data'].reshape(*data.shape)
+    net.reshape()
+    net.blobs['data'].data[...] = data
+    tic = time.time()
+    net.forward()
+    cost = time.time() - tic
+    layer_times = {}
+    for name in net._layer_names:
+        tic = time.time()
+        net.forward(start=name, end=name)
+        layer_times[name] = time.time() - tic
+    # the per-layer pass recomputed in-place blobs from their final state, redo the full pass
+    net.forward()
+    return dict((k, v.data.copy()) for k, v in net.blobs.items()), cost, layer_times
+
+
+def blob_sources(prototxt):
+    """
+    In-place layers overwrite their input and folded convolutions write the
+    batchnorm blob, find the mxnet node each value corresponds to.
+
+    Returns:
+        sources: dict converted blob -> mxnet node of its final value
+        outputs: dict layer -> mxnet node it computes
+    """
+    from numpy_runtime import parse_prototxt, _get
+    sources, outputs = {}, {}
+    for layer in parse_prototxt(prototxt).get('layer', []):
+        top = _get(layer, 'top')
+        inplace = top in layer.get('bottom', []) and _get(layer, 'type') != 'Scale'
+        sources[top] = _get(layer, 'name') if inplace else top
+        outputs[_get(layer, 'name')] = sources[top]
+    return sources, outputs
+
+
+def decode_pyr(blobs):
+    if 'fc_pyr' in blobs:
+        return blobs['fc_pyr']
+    fc_bin = blobs['fc_bin'].reshape(-1, 3, 66)
+    prob = np.exp(fc_bin - fc_bin.max(axis=2, keepdims=True))
+    prob /= prob.sum(axis=2, keepdims=True)
+    return (prob * np.arange(66)).sum(axis=2)*3 - 99
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Verify a converted model against mxnet')
+    parser.add_argument('--prefix', type=str, default='./model/best_pose', help='mxnet prefix')
+    parser.add_argument('--epoch', type=int, default=0, help='mxnet epoch')
+    parser.add_argument('--prototxt', type=str, default='./model/pose.prototxt')
+    parser.add_argument('--runtime', type=str, default='numpy', help='numpy or caffe')
+    parser.add_argument('--weights', type=str, default='./model/pose.npz', help='numpy runtime weights')
+    parser.add_argument('--caffemodel', type=str, default='./model/pose.caffemodel')
+    parser.add_argument('--data_dir', type=str, default='/home/lfx/Data/AFLW2000')
+    parser.add_argument('--anno', type=str, default='../data/AFLW2000_pose.txt')
+    parser.add_argument('--num', type=int, default=32, help='faces in the batch')
+    parser.add_argument('--shape', type=str, default='3,112,112')
+    parser.add_argument('--atol', type=float, default=1e-3, help='max pitch/yaw/roll diff in degree')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    assert args.runtime in ('numpy', 'caffe')
+    shape = tuple(int(i) for i in args.shape.split(','))
+    data, label = load_batch(args.data_dir, args.anno, args.num, shape)
+
+    conv, conv_cost, layer_times = converted_blobs(args, data)
+    sources, outputs = blob_sources(args.prototxt)
+    conv = dict((sources.get(k, k), v) for k, v in conv.items())
+    node_times = {}
+    for name, cost in layer_times.items():
+        node = outputs.get(name, name)
+        node_times[node] = node_times.get(node, 0) + cost
+    ref, ref_cost, profile = mxnet_blobs(args.prefix, args.epoch, data, set(conv.keys()))
+
+    print('%-45s %12s %12s %10s' % ('blob', 'max abs diff', 'max abs', 'ms'))
+    for name in conv:
+        if name not in ref:
+            continue
+        diff = np.abs(ref[name].reshape(conv[name].shape) - conv[name]).max()
+        print('%-45s %12.3e %12.3e %10.3f' % (name, diff, np.abs(ref[name]).max(),
+                                              node_times.get(name, 0)*1000))
+    missing = [k for k in conv if k not in ref and k != 'data']
+    if missing:
+        print('\nBlobs without mxnet counterpart: %s' % ', '.join(missing))
+
+    pyr_ref, pyr_conv = decode_pyr(ref), decode_pyr(conv)
+    pyr_diff = np.abs(pyr_ref - pyr_conv).max(axis=0)
+    print('\npitch/yaw/roll max diff (degree): %.5f %.5f %.5f' % tuple(pyr_diff))
+    if label is not None:
+        print('MAE mxnet: %.3f, %s: %.3f' % (np.abs(pyr_ref - label).mean(), args.runtime,
+                                            np.abs(pyr_conv - label).mean()))
+    print('forward %d faces: mxnet %.2f ms, %s %.2f ms' % (len(data), ref_cost*1000, args.runtime, conv_cost*1000))
+    print('\nmxnet operator cost:\n%s' % profile)
+    if pyr_diff.max() > args.atol:
+        print('Conversion mismatch!')
+        sys.exit(1)
@@ -0,0 +1,180 @@
+'''
+Batch loader whose workers write samples straight into shared memory.
+
+The gluon DataLoader pickles three NDArrays per sample through its queues
+and stacks them again in the main process. Here every worker process fills
+whole batches of a ring of multiprocessing.RawArray buffers (uint8 images,
+float32 labels) with Dataset.get_sample, only the slot and batch numbers go
+through the queues, and the main process copies the filled buffer once to
+the training context and normalizes it there.
+
+loader = SharedMemoryLoader(Dataset(...), 128, shuffle=True, num_workers=6, ctx=mx.gpu(0))
+for data, bin_label, cont_label in loader:
+    ...
+'''
+import multiprocessing
+import traceback
+import numpy as np
+import mxnet as mx
+
+
+class _Slot(object):
+    """numpy views of one batch buffer, a new RawArray without buffer"""
+    def __init__(self, batch_size, input_size, buffer=None):
+        shapes = [((batch_size, 3, input_size, input_size), np.uint8),
+                  ((batch_size, 3), np.float32), ((batch_size, 3), np.float32)]
+        sizes = [int(np.prod(shape)) * np.dtype(dtype).itemsize for shape, dtype in shapes]
+        self.buffer = multiprocessing.RawArray('b', sum(sizes)) if buffer is None else buffer
+        self.arrays, offset = [], 0
+        for (shape, dtype), size in zip(shapes, sizes):
+            self.arrays.append(np.frombuffer(self.buffer, dtype=dtype, count=int(np.prod(shape)),
+                                             offset=offset).reshape(shape))
+            offset += size
+
+
+def _worker(dataset, buffers, batch_size, tasks, results, seed):
+    # only the RawArrays are shared with spawn/forkserver, the views are built here
+    slots = [_Slot(batch_size, dataset.input_size, buffer) for buffer in buffers]
+    np.random.seed(seed)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        slot, batch, indices, batch_seed = task
+        try:
+            if batch_seed is not None:
+                np.random.seed(batch_seed)
+            data, bin_label, cont_label = slots[slot].arrays
+            for i, index in enumerate(indices):
+                data[i], bin_label[i], cont_label[i] = dataset.get_sample(index)
+            results.put((slot, batch, None))
+        except Exception:
+            results.put((slot, batch, traceback.format_exc()))
+
+
+class SharedMemoryLoader(object):
+    """
+        drop-in for the train/val gluon DataLoader of a pose Dataset
+
+    Parameters:
+    ----------
+        dataset: Dataset, needs get_sample and input_size
+        batch_size: int
+        shuffle: bool
+        num_workers: int, 0 fills the batches in the main process
+        last_batch: 'keep', 'discard' or 'rollover' as the gluon DataLoader
+        ctx: context of the yielded NDArrays
+        num_slots: int, batch buffers in the ring, default 2 per worker
+        batch_sampler: iterable of index lists used instead of batch_size, shuffle
+            and last_batch, e.g. checkpoint.ResumableSampler. When it has seeded(),
+            every batch is augmented from its own seed, so a resumed epoch gets the
+            same random crops and flips whatever the number of workers
+    """
+    def __init__(self, dataset, batch_size=None, shuffle=False, num_workers=0, last_batch='keep',
+                 ctx=mx.cpu(), num_slots=0, batch_sampler=None):
+        assert last_batch in ('keep', 'discard', 'rollover')
+        assert (batch_size is None) != (batch_sampler is None), 'batch_size or batch_sampler'
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        if batch_sampler is not None:
+            batch_size = batch_sampler.batch_size
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_workers = num_workers
+        self.last_batch = last_batch
+        self.ctx = ctx
+        self.num_slots = num_slots or max(2 * num_workers, 2)
+        self._slots = [_Slot(batch_size, dataset.input_size) for _ in range(self.num_slots)]
+        self._rollover = np.zeros((0, ), dtype=np.int64)
+        self._workers = []
+        self._inflight = 0
+
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        num = len(self.dataset) + len(self._rollover)
+        if self.last_batch == 'keep':
+            return (num + self.batch_size - 1) // self.batch_size
+        return num // self.batch_size
+
+    def _batches(self):
+        """[(indices, augmentation seed or None)]"""
+        if self.batch_sampler is not None:
+            if hasattr(self.batch_sampler, 'seeded'):
+                return list(self.batch_sampler.seeded())
+            return [(indices, None) for indices in self.batch_sampler]
+        indices = np.random.permutation(len(self.dataset)) if self.shuffle else np.arange(len(self.dataset))
+        if self.last_batch == 'rollover':
+            indices = np.concatenate([self._rollover, indices])
+        num = len(indices) // self.batch_size * self.batch_size
+        batches = [indices[i:i+self.batch_size] for i in range(0, num, self.batch_size)]
+        if self.last_batch == 'keep' and num < len(indices):
+            batches.append(indices[num:])
+        elif self.last_batch == 'rollover':
+            self._rollover = indices[num:]
+        return [(indices, None) for indices in batches]
+
+    def _start(self):
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        seed = np.random.randint(2**31 - self.num_workers)
+        for i in range(self.num_workers):
+            worker = multiprocessing.Process(target=_worker, args=(self.dataset, [s.buffer for s in self._slots],
+                                                                   self.batch_size, self._tasks, self._results,
+                                                                   seed + i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _to_ctx(self, slot, num):
+        data, bin_label, cont_label = [a[:num] for a in self._slots[slot].arrays]
+        data = mx.nd.array(data, ctx=self.ctx, dtype=np.uint8)
+        return self.dataset.normalize(data.astype('float32')), \
+               mx.nd.array(bin_label, ctx=self.ctx), mx.nd.array(cont_label, ctx=self.ctx)
+
+    def __iter__(self):
+        batches = self._batches()
+        if self.num_workers == 0:
+            data, bin_label, cont_label = self._slots[0].arrays
+            for indices, batch_seed in batches:
+                if batch_seed is not None:
+                    np.random.seed(batch_seed)
+                for i, index in enumerate(indices):
+                    data[i], bin_label[i], cont_label[i] = self.dataset.get_sample(index)
+                yield self._to_ctx(0, len(indices))
+            return
+
+        if not self._workers:
+            self._start()
+        # batches of an epoch that was not iterated to the end
+        for _ in range(self._inflight):
+            self._results.get()
+        self._inflight = 0
+        free, done, sent = list(range(self.num_slots)), {}, 0
+        for batch in range(len(batches)):
+            while free and sent < len(batches):
+                self._tasks.put((free.pop(), sent) + tuple(batches[sent]))
+                sent += 1
+                self._inflight += 1
+            while batch not in done:
+                slot, num, error = self._results.get()
+                self._inflight -= 1
+                if error is not None:
+                    raise RuntimeError('shared memory loader worker failed:\n%s' % error)
+                done[num] = slot
+            slot = done.pop(batch)
+            # mx.nd.array copies synchronously, the slot is free once the batch is yielded
+            out = self._to_ctx(slot, len(batches[batch][0]))
+            free.append(slot)
+            yield out
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __del__(self):
+        if self._workers:
+            self.close()
@@ -0,0 +1,204 @@
+'''
+Run a grid of train.py configurations in parallel with successive-halving
+early stopping.
+
+Every configuration is a train.py process with its own --prefix under
+--save/<name>, --per_gpu of them at a time on each of the --gpus. The val mean MAE
+of every epoch is read from the metrics.jsonl of the runs; when a run reaches a rung epoch
+it is stopped unless its MAE is in the best 1/eta of the MAEs recorded at
+that rung so far (asynchronous successive halving). --patience is passed on
+so plateaued runs also end before --epochs.
+
+The preprocessed val set is built once per distinct val_dataset, val_anno
+and input_size of the grid (--val_cache) and shared by the runs using it,
+the train annotations are best given as the .npy of gen_pose.py,
+which every run memory maps.
+
+python sweep.py --grid "net=v3,v2;alpha=1,2" --gpus 0,1 --rungs 5,10,20 --eta 3 \
+    --train_args "--bs 128 --lr 0.001 --lr_type cos --use_fc 1 --epochs 30"
+'''
+import argparse
+import itertools
+import os
+import os.path as osp
+import shlex
+import subprocess
+import sys
+import time
+import numpy as np
+from metrics import read_records
+
+
+def parse_grid(grid):
+    """'net=v3,v2;alpha=1,2' -> list of OrderedDict-like lists of (key, value)"""
+    keys, values = [], []
+    for item in grid.split(';'):
+        if not item.strip():
+            continue
+        key, vals = item.split('=', 1)
+        keys.append(key.strip())
+        values.append([v.strip() for v in vals.split(',')])
+    return [list(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def config_name(config):
+    return '_'.join('%s-%s' % (key, value) for key, value in config) or 'default'
+
+
+class Run(object):
+    """one train.py process and the val MAE of its epochs"""
+    def __init__(self, name, config, args):
+        self.name = name
+        self.config = config
+        self.folder = osp.join(args.save, name)
+        self.log = osp.join(self.folder, 'train.log')
+        self.metrics = osp.join(self.folder, 'metrics.jsonl')
+        self.val_cache = ''
+        self.maes = {}
+        self.status = 'pending'
+        self.proc = None
+        self.gpu = None
+        self._offset = 0
+
+    def start(self, gpu, args):
+        if not osp.exists(self.folder):
+            os.makedirs(self.folder)
+        cmd = [sys.executable, '-u', 'train.py'] + shlex.split(args.train_args)
+        for key, value in self.config:
+            cmd += ['--%s' % key, value]
+        cmd += ['--save', args.save, '--prefix', self.name, '--gpu', str(gpu), '--patience', str(args.patience)]
+        if self.val_cache:
+            cmd += ['--val_cache', self.val_cache]
+        self.gpu = gpu
+        self.status = 'running'
+        with open(self.log, 'ab') as log:
+            self.proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+    def poll(self):
+        """new epoch records of the metrics, list of (epoch, val mean mae)"""
+        if not osp.exists(self.metrics):
+            return []
+        records, self._offset = read_records(self.metrics, self._offset)
+        new = [(r['epoch'], r['val_mae'][3]) for r in records if r['kind'] == 'epoch']
+        self.maes.update(new)
+        return new
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+    @property
+    def best(self):
+        if not self.maes:
+            return None, None
+        epoch = min(self.maes, key=self.maes.get)
+        return self.maes[epoch], epoch
+
+
+def keep_running(mae, recorded, eta):
+    """asynchronous successive halving: mae (lower is better) is in the best 1/eta of recorded"""
+    return mae <= np.percentile(recorded, 100. / eta)
+
+
+def val_setup(train_args, config):
+    """(val_dataset, val_anno, input_size) train.py uses with train_args and the grid config"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--val_dataset', type=str, default='/home/lfx/Data/AFLW2000')
+    parser.add_argument('--val_anno', type=str, default='./data/AFLW2000_pose.txt')
+    parser.add_argument('--input_size', type=int, default=112)
+    argv = shlex.split(train_args) + [a for key, value in config for a in ('--%s' % key, value)]
+    val_args, _ = parser.parse_known_args(argv)
+    return val_args.val_dataset, val_args.val_anno, val_args.input_size
+
+
+def build_val_caches(args, runs):
+    """
+        one preprocessed val set per distinct val setup of the runs, built before they start
+
+    Sets run.val_cache: args.val_cache when all runs share one setup, else <val_cache>_<n>.npz
+    """
+    from dataset import Dataset
+    setups = [val_setup(args.train_args, run.config) for run in runs]
+    distinct = sorted(set(setups), key=setups.index)
+    paths = [args.val_cache] if len(distinct) == 1 else \
+            ['%s_%d.npz' % (osp.splitext(args.val_cache)[0], i) for i in range(len(distinct))]
+    for (val_dataset, val_anno, input_size), path in zip(distinct, paths):
+        Dataset(val_dataset, val_anno, input_size=input_size, k=0.3).cache(path, args.workers)
+    for run, setup in zip(runs, setups):
+        run.val_cache = paths[distinct.index(setup)]
+
+
+def make_table(runs, rungs):
+    head = ['config', 'status', 'epochs', 'best MAE', 'best epoch'] + ['MAE@%d' % r for r in rungs]
+    lines = ['| %s |' % ' | '.join(head), '|%s|' % '|'.join([' :---: '] * len(head))]
+    for run in sorted(runs, key=lambda r: (r.best[0] is None, r.best[0])):
+        mae, epoch = run.best
+        row = [run.name, run.status, '%d' % len(run.maes), '-' if mae is None else '%.3f' % mae,
+               '-' if epoch is None else '%d' % epoch] + \
+              ['%.3f' % run.maes[r - 1] if r - 1 in run.maes else '-' for r in rungs]
+        lines.append('| %s |' % ' | '.join(row))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Parallel train.py sweep with early stopping')
+    parser.add_argument('--grid', type=str, default='net=v3,v2,facenet;alpha=1,2', help='key=v1,v2;key=... train.py args')
+    parser.add_argument('--train_args', type=str, default='--bs 128 --lr 0.001 --lr_type cos --use_fc 1',
+                        help='train.py args shared by all configs')
+    parser.add_argument('--save', type=str, default='./weight/sweep', help='one folder per config here')
+    parser.add_argument('--gpus', type=str, default='0')
+    parser.add_argument('--per_gpu', type=int, default=1, help='runs sharing a gpu')
+    parser.add_argument('--rungs', type=str, default='5,10,20', help='epochs at which runs are compared')
+    parser.add_argument('--eta', type=float, default=3, help='keep the best 1/eta at every rung')
+    parser.add_argument('--patience', type=int, default=5, help='train.py --patience')
+    parser.add_argument('--val_cache', type=str, default='', help='shared val cache, default <save>/val_cache.npz, <name>_<n>.npz per val setup of the grid')
+    parser.add_argument('--workers', type=int, default=4, help='processes building the val cache')
+    parser.add_argument('--poll', type=float, default=10, help='seconds between reads of the metrics')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not osp.exists(args.save):
+        os.makedirs(args.save)
+    args.val_cache = args.val_cache or osp.join(args.save, 'val_cache.npz')
+    rungs = sorted(int(r) for r in args.rungs.split(','))
+    runs = [Run(config_name(c), c, args) for c in parse_grid(args.grid)]
+    free_gpus = [int(g) for g in args.gpus.split(',') for _ in range(args.per_gpu)]
+    recorded = dict((r, []) for r in rungs)
+
+    build_val_caches(args, runs)
+    print('%d configs, %d at a time, rungs %s, eta %g' % (len(runs), len(free_gpus), rungs, args.eta))
+    pending = list(runs)
+    while pending or any(r.status == 'running' for r in runs):
+        while pending and free_gpus:
+            run = pending.pop(0)
+            run.start(free_gpus.pop(0), args)
+            print('start %s on gpu %d' % (run.name, run.gpu))
+        time.sleep(args.poll)
+        for run in runs:
+            if run.status != 'running':
+                continue
+            for epoch, mae in run.poll():
+                rung = epoch + 1
+                if rung not in recorded:
+                    continue
+                recorded[rung].append(mae)
+                if not keep_running(mae, recorded[rung], args.eta):
+                    run.stop()
+                    run.status = 'stopped@%d' % rung
+                    run.maes = dict((e, m) for e, m in run.maes.items() if e <= epoch)
+                    print('stop %s at epoch %d: MAE %.3f' % (run.name, rung, mae))
+                    break
+            if run.status == 'running' and run.proc.poll() is not None:
+                run.poll()
+                run.status = 'done' if run.proc.returncode == 0 else 'failed(%d)' % run.proc.returncode
+                print('%s %s' % (run.name, run.status))
+            if run.status != 'running':
+                free_gpus.append(run.gpu)
+
+    table = make_table(runs, rungs)
+    print('\n' + table)
+    with open(osp.join(args.save, 'sweep.md'), 'w') as f:
+        f.write(table)
@@ -7,15 +7,15 @@
 '''
 
 
-import mxnet as mx
+# mxnet, the detector backends and the tracker are imported where they are used,
+# only what --test_type and --detector need is loaded (import test stays cheap for crop)
 import cv2
 import numpy as np
-from mxnet.gluon import nn as gnn
 from math import cos, sin
 import argparse
 import os
 import os.path as osp
-from mtcnn.mtcnn import MTCNN
+from detector import get_detector, frame_key
 
 def draw_axis(img, pyr, tdx=None, tdy=None, size = 100):
     pitch = pyr[0] * np.pi / 180
@@ -50,13 +50,24 @@ def draw_axis(img, pyr, tdx=None, tdy=None, size = 100):
 
 
 def get_net(_ctx, json, params):
+    import mxnet as mx
+    from mxnet.gluon import nn as gnn
+    from model_zoo.decoder import decode_symbol
     inputs = mx.sym.var('data', dtype='float32')
-    net = gnn.SymbolBlock(mx.sym.load(json)['fc_pyr_fwd_output'], inputs)
+    internals = mx.sym.load(json).get_internals()
+    outputs = internals.list_outputs()
+    if 'decode_pyr_output' in outputs:  # train.py --export_decoded
+        sym = internals['decode_pyr_output']
+    elif 'fc_pyr_fwd_output' in outputs:
+        sym = internals['fc_pyr_fwd_output']
+    else:  # use_fc=0, decode the bins in the graph
+        sym = decode_symbol(internals['fc_bin_fwd_output'])
+    net = gnn.SymbolBlock(sym, inputs)
     net.load_parameters(params, ctx=_ctx)
     net.hybridize()
     return net
 
-def crop(img, bbox):
+def crop(img, bbox, size=112):
     # crop face
     h, w = img.shape[:2]
     k = 0.3
@@ -74,36 +85,51 @@ def crop(img, bbox):
     img = cv2.copyMakeBorder(img, ex_h, ex_h, ex_w, ex_w, cv2.BORDER_CONSTANT, value=(0, 0, 0))
 
     # prercocess
-    img = cv2.resize(img, (112, 112))
+    img = cv2.resize(img, (size, size))
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     img = (img.transpose((2,0,1)).astype('float32')-127.5) *  0.0078125
     return img
 
 
-def predict_image(img, detector, json, params, _ctx):
-    if args.detector == 'dlib':
-        dets = detector(img, 0)
-        bboxs = [(i.left(), i.top(), i.right(), i.bottom()) for i in dets]
-        if len(bboxs)==0:
-            return img
-    else:
-        ret = detector.detect_face(img) 
+def predict_image(img, detector, net, _ctx, tracker=None, key=None, size=112):
+    ids = None
+    if tracker is not None:
+        ret = tracker.update(img)
         if ret is None:
             return img
-        bboxs, _ = ret
+        bboxs, _, ids = ret
         bboxs = bboxs[:, :4]
-    faces = [crop(img, i) for i in bboxs]
+    else:
+        bboxs, _ = detector.detect_one(img, key)
+    if len(bboxs)==0:
+        return img
+    import mxnet as mx
+    faces = [crop(img, i, size) for i in bboxs]
     faces = mx.nd.array(faces, _ctx)
-    net = get_net(_ctx, json, params)
     pyrs=net(faces).asnumpy()
-    for pyr, (x1,y1,x2,y2) in zip(pyrs, bboxs):
+    for k, (pyr, (x1,y1,x2,y2)) in enumerate(zip(pyrs, bboxs)):
         x1,y1,x2,y2 = int(x1), int(y1), int(x2), int(y2)
         img = draw_axis(img, pyr, tdx=(x1+x2)/2, tdy=(y1+y2)/2, size=100)
         img = cv2.rectangle(img, (x1,y1), (x2,y2), (0, 0, 255), 2)
-        cv2.putText(img, 'pyr: (%.1f,%.1f,%.1f)'%(pyr[0], pyr[1], pyr[2]), (x1, y1-10), cv2.FONT_HERSHEY_PLAIN, 1, (0, 0, 255), 2)
+        text = 'pyr: (%.1f,%.1f,%.1f)'%(pyr[0], pyr[1], pyr[2])
+        if ids is not None:
+            text = 'id:%d %s'%(ids[k], text)
+        cv2.putText(img, text, (x1, y1-10), cv2.FONT_HERSHEY_PLAIN, 1, (0, 0, 255), 2)
     return img
 
 
+def build_detector(args, _ctx):
+    if args.detector == 'mtcnn':
+        rois = [[int(v) for v in r.split(',')] for r in args.roi.split(';')] if args.roi else None
+        return get_detector('mtcnn', ctx=_ctx, num_worker=4, accurate_landmark=False,
+                            max_side=args.max_side or None, rois=rois, refine=bool(args.refine))
+    elif args.detector == 'dlib':
+        return get_detector('dlib')
+    elif args.detector == 'file':
+        return get_detector('file', path=args.boxes)
+    raise NotImplementedError
+
+
 def get_args():
     parser = argparse.ArgumentParser(description='Test config.')
     parser.add_argument('--test_type', type=str, default='image', help='image, video, camera')
@@ -112,45 +138,62 @@ def get_args():
     parser.add_argument('--save', type=str, default='./test_res', help='result save path')
 
     parser.add_argument('--use_gpu', type=int, default=0)
-    parser.add_argument('--detector', type=str, default='mtcnn', help='mtcnn, dlib')
+    parser.add_argument('--detector', type=str, default='mtcnn', help='mtcnn, dlib, file')
+    parser.add_argument('--boxes', type=str, default='', help='file detector: precomputed detections, "key x1 y1 x2 y2 score" per line')
+    parser.add_argument('--max_side', type=int, default=0, help='mtcnn: detect on frames downscaled to this longest side, 0 keeps full resolution')
+    parser.add_argument('--roi', type=str, default='', help='mtcnn: only search these regions, "x1,y1,x2,y2;x1,y1,x2,y2"')
+    parser.add_argument('--refine', type=int, default=1, help='mtcnn with max_side/roi: refine faces at full resolution')
+    parser.add_argument('--track_interval', type=int, default=0, help='video/camera with mtcnn: full detection every n frames, 0 disables tracking')
     # mxnet 
     parser.add_argument('--json', type=str, default='./weight/v3_large_alpha2/best_pose-symbol.json')
     parser.add_argument('--params', type=str, default='./weight/v3_large_alpha2/best_pose-0000.params')
+    parser.add_argument('--input_size', type=int, default=112, help='net input size the model was trained with')
     args = parser.parse_args()
     return args
 
 if __name__ == "__main__":
     args = get_args()
+    if args.test_type not in ('image', 'video', 'camera'):
+        raise NotImplementedError
+    # a missing input fails before the models are loaded
+    if args.test_type == 'image':
+        image = cv2.imread(args.image)
+        assert image is not None, 'can not read %s' % args.image
+    else:
+        cap = cv2.VideoCapture(args.video if args.test_type == 'video' else 0)
+        assert cap.isOpened(), 'can not open %s' % (args.video if args.test_type == 'video' else 'camera')
+
+    import mxnet as mx
     _ctx=mx.gpu(0) if args.use_gpu else mx.cpu()
-    json, params = args.json, args.params
-    
-    assert args.detector in ('mtcnn', 'dlib')
-    if args.detector=='mtcnn':
-        detector = MTCNN('./mtcnn/model/', ctx=_ctx, num_worker=4, accurate_landmark=False)
-    elif args.detector=='dlib':
-        import dlib
-        detector = dlib.get_frontal_face_detector()
+    net = get_net(_ctx, args.json, args.params)
+
+    detector = build_detector(args, _ctx)
+    tracker = None
+    if args.track_interval > 0 and args.detector == 'mtcnn' and args.test_type != 'image':
+        from mtcnn.tracker import FaceTracker
+        tracker = FaceTracker(detector.mtcnn, interval=args.track_interval, detect_fn=detector.detect_face)
 
     if args.test_type == 'image':
-        image = cv2.imread(args.image)
-        image = predict_image(image, detector, json, params, _ctx)
+        image = predict_image(image, detector, net, _ctx, key=frame_key(args.image), size=args.input_size)
         cv2.imwrite(osp.join(args.save, osp.basename(args.image).replace('.', '_pre.')), image)
         cv2.imshow('demo', image)
         if cv2.waitKey(0) & 0xFF == ord('q'):
             cv2.destroyAllWindows()
     
     elif args.test_type == 'video':
-        cap = cv2.VideoCapture(args.video)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps = int(round(cap.get(cv2.CAP_PROP_FPS)))
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
         #out = cv2.VideoWriter(osp.join(args.save, osp.basename(args.video).split('.')[0]+'_pre.mp4'), fourcc, fps, (width, height))
+        index = 0
         while cap.isOpened():
             ret, frame = cap.read()
             if not ret:
                 break
-            frame = predict_image(frame, detector, json, params, _ctx)
+            frame = predict_image(frame, detector, net, _ctx, tracker, key=frame_key(args.video, index),
+                                  size=args.input_size)
+            index += 1
             #out.write(frame)
             cv2.imshow("demo", frame)
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -160,18 +203,15 @@ if __name__ == "__main__":
         cv2.destroyAllWindows()
     
     elif args.test_type == 'camera':
-        cap = cv2.VideoCapture(0)
         while cap.isOpened():
             ret, frame = cap.read()
             if not ret:
                 continue
-            frame = predict_image(frame, detector, json, params, _ctx)
+            frame = predict_image(frame, detector, net, _ctx, tracker, size=args.input_size)
             cv2.imshow("demo", frame)
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
         cap.release()
         cv2.destroyAllWindows()
-    else:
-        raise NotImplementedError
 
 
@@ -7,24 +7,39 @@
 '''
 import mxnet as mx
 import mxnet.gluon as nn
-from model_zoo.mobilenetv3 import get_mobilenet_v3
+from model_zoo.mobilenetv3 import get_mobilenet_v3, reparameterize
 from model_zoo.mobilenetv2 import get_mobilenet_v2
 from model_zoo.mobilefacenet import get_mobile_facenet
+from model_zoo.decoder import AngleDecoder, decoded_block
 from dataset import Dataset
+from shm_loader import SharedMemoryLoader
+from checkpoint import ResumableSampler, CheckpointWriter, load_checkpoint, latest_checkpoint, remove_checkpoints, \
+    rng_states, set_rng_states
+from metrics import MetricsRecorder
 import argparse
 import numpy as np
 import os
 import os.path as osp
+import random
 import time
-from gluoncv.utils import TrainingHistory
+
+ce_loss = mx.gluon.loss.SoftmaxCrossEntropyLoss()
+mse_loss = nn.loss.L2Loss()
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='Train head pose by mobilenetv3.')
     # dataset
     parser.add_argument('--dataset', type=str, default='/home/lfx/Data/300W_LP')
-    parser.add_argument('--anno_txt', type=str, default='./data/300W_LP_pose.txt')
+    parser.add_argument('--anno_txt', type=str, default='./data/300W_LP_pose.txt', help='.txt or .npy of data/gen_pose.py')
+    parser.add_argument('--val_dataset', type=str, default='/home/lfx/Data/AFLW2000')
+    parser.add_argument('--val_anno', type=str, default='./data/AFLW2000_pose.txt')
     parser.add_argument('--num_workers', type=int, default=6, help='io workers')
+    parser.add_argument('--shm_loader', type=int, default=1, help='workers write batches into shared memory instead of the gluon DataLoader')
+    parser.add_argument('--val_cache', type=str, default='', help='.npz keeping the preprocessed val set between runs, in memory only if empty')
+    parser.add_argument('--val_bs', type=int, default=256, help='val batch size')
+    parser.add_argument('--hybrid_loss', type=int, default=1, help='net and loss as one static hybridized graph')
+    parser.add_argument('--grad_accum', type=int, default=1, help='batches per update, the effective batch size is bs*grad_accum')
     # train
     parser.add_argument('--bs', type=int, default=128)
     parser.add_argument('--lr', type=float, default=0.1)
@@ -33,6 +48,7 @@ def get_args():
     parser.add_argument('--wd', type=float, default=4e-5, help='weight decay') 
     parser.add_argument('--momentum', type=float, default=0.9, help='momentum')
     parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--patience', type=int, default=0, help='stop after n epochs without a better val MAE, 0: never')
     parser.add_argument('--gpu', type=int, default=3)
     parser.add_argument('--alpha', type=float, default=0.01)
 
@@ -41,9 +57,18 @@ def get_args():
     parser.add_argument('--width_mult', type=float, default=1)
     parser.add_argument('--use_fc', type=int, default=0)
     parser.add_argument('--net', type=str, default='v3')
+    parser.add_argument('--input_size', type=int, default=112, help='side of the square face crop')
+    parser.add_argument('--stem_stride', type=int, default=1, help='v3: stride of the first conv')
+    parser.add_argument('--rep', type=int, default=0, help='v3: train the depthwise convs with reparameterizable 1x1/identity branches')
+    parser.add_argument('--export_decoded', type=int, default=1, help='also export best_pose_decoded with the angles decoded in the graph')
     
     parser.add_argument('--weights', type=str, default='')
     parser.add_argument('--log_interval', type=int,default=100)
+    parser.add_argument('--seed', type=int, default=0, help='sampler and RNG seed')
+    parser.add_argument('--ckpt_interval', type=int, default=0, help='also checkpoint every n batches, 0: at the end of every epoch only')
+    parser.add_argument('--resume', type=str, default='', help='checkpoint prefix to resume from, auto: the latest in the save folder; without it the checkpoints of the folder are removed')
+    parser.add_argument('--keep_last', type=int, default=3, help='newest checkpoints to keep')
+    parser.add_argument('--keep_best', type=int, default=1, help='epoch checkpoints with the lowest val MAE to keep')
     parser.add_argument('--save', type=str, default='./weight', help='save model path')
     parser.add_argument('--prefix', type=str, default='test', help='save model path prefix')
     args = parser.parse_args()
@@ -55,8 +80,11 @@ def get_net(ctx, args):
         json, params = [i.strip() for i in args.weights.strip().split()]
     assert args.width_mult<=1 and args.width_mult>0
     assert args.version in ('small', 'large')
+    assert not args.rep or args.net=='v3', 'only the v3 depthwise convs are reparameterizable'
+    assert args.net!='facenet' or args.input_size==112, 'the 7x7 GDC of MobileFaceNet needs --input_size 112'
     if args.net=='v3':
-        net = get_mobilenet_v3(args.version, multiplier=args.width_mult, use_fc=args.use_fc)
+        net = get_mobilenet_v3(args.version, multiplier=args.width_mult, use_fc=args.use_fc,
+                               stem_stride=args.stem_stride, rep=args.rep)
     elif args.net=='v2':
         net = get_mobilenet_v2(multiplier=args.width_mult, use_fc=args.use_fc)
     elif args.net == 'facenet':
@@ -65,25 +93,40 @@ def get_net(ctx, args):
     net.hybridize()
     return net
 
-def get_data(args):
+def deploy_net(net, ctx, args):
+    """net to export, a reparameterized copy when training with --rep"""
+    if not args.rep:
+        return net
+    deploy = get_net(ctx, args)
+    # finish the deferred init, copy by the structural names save_parameters uses
+    deploy(mx.nd.zeros((1, 3, args.input_size, args.input_size), ctx=ctx))
+    params = deploy._collect_params_with_prefix()
+    for name, param in net._collect_params_with_prefix().items():
+        params[name].set_data(param.data(ctx))
+    return reparameterize(deploy)
+
+def get_data(args, ctx=mx.cpu()):
     """
     Returns:
         train_loader: train datset loader
-        val_loader: val list datset loader
+        val_data: preprocessed val images, bin labels and cont labels, see Dataset.cache
+        sampler: ResumableSampler of train_loader
     """
-    train_ = Dataset('/home/lfx/Data/300W_LP', './data/300W_LP_pose.txt', transform=True)
-    train_loader =  mx.gluon.data.DataLoader(train_, batch_size=args.bs, shuffle=True, num_workers=args.num_workers, last_batch='rollover')
+    if args.shm_loader:
+        loader = lambda *a, **kw: SharedMemoryLoader(*a, ctx=ctx, **kw)
+    else:
+        loader = mx.gluon.data.DataLoader
+    train_ = Dataset(args.dataset, args.anno_txt, transform=True, input_size=args.input_size)
+    sampler = ResumableSampler(len(train_), args.bs, seed=args.seed)
+    train_loader =  loader(train_, batch_sampler=sampler, num_workers=args.num_workers)
  
-    val_ = Dataset('/home/lfx/Data/AFLW2000', './data/AFLW2000_pose.txt', transform=False)
-    val_loader =  mx.gluon.data.DataLoader(val_, batch_size=args.bs, num_workers=args.num_workers, last_batch='keep')
-    return train_loader, val_loader
+    # the middle of the random train expansion, so the val set is preprocessed once
+    val_ = Dataset(args.val_dataset, args.val_anno, transform=False, input_size=args.input_size, k=0.3)
+    val_data = val_.cache(args.val_cache, args.num_workers)
+    return train_loader, val_data, sampler
 
 
 def cal_loss(outputs, bin_label, cont_label, _ctx, args):
-    # loss
-    ce_loss = mx.gluon.loss.SoftmaxCrossEntropyLoss()
-    mse_loss = nn.loss.L2Loss()
-    
     if args.use_fc:
         outputs_bin, pyr = outputs
         pitch, yaw, roll = outputs_bin[:, :66], outputs_bin[:, 66:66*2], outputs_bin[:, 66*2:]
@@ -106,9 +149,9 @@ def cal_loss(outputs, bin_label, cont_label, _ctx, args):
         ce_yaw =ce_loss(yaw, bin_label[:, 1])
         ce_roll = ce_loss(roll, bin_label[:, 2])
         
-        pitch_pre = mx.nd.sum(mx.nd.softmax(pitch, 1)*idx_tensor, 1)*3-99
-        yaw_pre = mx.nd.sum(mx.nd.softmax(yaw, 1)*idx_tensor, 1)*3-99
-        roll_pre = mx.nd.sum(mx.nd.softmax(roll, 1)*idx_tensor, 1)*3-99
+        pitch_pre = mx.nd.sum(mx.nd.softmax(pitch, axis=1)*idx_tensor, 1)*3-99
+        yaw_pre = mx.nd.sum(mx.nd.softmax(yaw, axis=1)*idx_tensor, 1)*3-99
+        roll_pre = mx.nd.sum(mx.nd.softmax(roll, axis=1)*idx_tensor, 1)*3-99
 
         mse_pitch = mse_loss(pitch_pre, cont_label[:, 0])
         mse_yaw = mse_loss(yaw_pre, cont_label[:, 1])
@@ -126,12 +169,49 @@ def cal_loss(outputs, bin_label, cont_label, _ctx, args):
     return (loss_pitch, loss_yaw, loss_roll), (pitch_mae, yaw_mae, roll_mae)
 
 
+class PoseLoss(mx.gluon.HybridBlock):
+    """net and the loss of cal_loss as one graph, returns the pitch, yaw, roll losses and the N x 3 angles"""
+    def __init__(self, net, alpha, use_fc, **kwargs):
+        super(PoseLoss, self).__init__(prefix='', **kwargs)
+        self.alpha = alpha
+        self.use_fc = use_fc
+        with self.name_scope():
+            self.net = net
+            self.decode = AngleDecoder(prefix='decode_')
+            self.ce_loss = mx.gluon.loss.SoftmaxCrossEntropyLoss()
+            self.mse_loss = nn.loss.L2Loss()
+
+    def hybrid_forward(self, F, data, bin_label, cont_label):
+        if self.use_fc:
+            outputs_bin, pyr = self.net(data)
+        else:
+            outputs_bin = self.net(data)
+            pyr = self.decode(outputs_bin)
+        losses = []
+        for i in range(3):
+            ce = self.ce_loss(F.slice_axis(outputs_bin, axis=1, begin=66*i, end=66*(i+1)),
+                              F.reshape(F.slice_axis(bin_label, axis=1, begin=i, end=i+1), (-1, )))
+            mse = self.mse_loss(F.slice_axis(pyr, axis=1, begin=i, end=i+1),
+                                F.slice_axis(cont_label, axis=1, begin=i, end=i+1))
+            losses.append(ce + self.alpha*mse)
+        return losses[0], losses[1], losses[2], pyr
+
+
 def train(args):
     _ctx = mx.gpu(args.gpu)
+    mx.random.seed(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
     # get data
-    train_loader, val_loader = get_data(args)
+    train_loader, val_data, sampler = get_data(args, _ctx)
     # get net
     net = get_net(_ctx, args)
+    if args.hybrid_loss:
+        # the loader keeps the batch shape constant
+        train_net = PoseLoss(net, args.alpha, args.use_fc)
+        train_net.hybridize(static_alloc=True, static_shape=True)
+    if args.grad_accum > 1:
+        net.collect_params().setattr('grad_req', 'add')
  
     # optimizer
     # lr_decay = 0.1
@@ -140,7 +220,7 @@ def train(args):
     # optimizer_params = {'learning_rate': args.lr, 'wd':args.wd, 'momentum': args.momentum}
     # trainer = mx.gluon.Trainer(net.collect_params(), optimizer=optimizer, optimizer_params=optimizer_params)
     if 'cos' in args.lr_type:
-        lr_sch  = mx.lr_scheduler.CosineScheduler((args.epochs-3)*len(train_loader), args.lr, 1e-6)
+        lr_sch  = mx.lr_scheduler.CosineScheduler((args.epochs-3)*len(train_loader)//args.grad_accum, args.lr, 1e-6)
         trainer = mx.gluon.Trainer(net.collect_params(), optimizer='adam', optimizer_params= {'learning_rate': args.lr, 'wd':args.wd, 'lr_scheduler': lr_sch}, )
     else:
         trainer = mx.gluon.Trainer(net.collect_params(), optimizer='adam', optimizer_params= {'learning_rate': args.lr, 'wd':args.wd}, )
@@ -149,53 +229,95 @@ def train(args):
     pitch_metric_loss = mx.metric.Loss()
     yaw_metric_loss = mx.metric.Loss()
     roll_metric_loss = mx.metric.Loss()
-    train_history = TrainingHistory(['train-pitch', 'train-yaw', 'train-roll', 'val-pitch', 'val-yaw', 'val-roll'])
-    mae_history = TrainingHistory(['train-pitch', 'train-yaw', 'train-roll', 'train-mae', 'val-pitch', 'val-yaw', 'val-roll', 'val-mae'])
+    recorder = MetricsRecorder(osp.join(save_root, 'metrics.jsonl'))
     best_mae, best_epoch = np.inf, 0
-    
-    for epoch in range(args.epochs):
+    loss_metrics = (pitch_metric_loss, yaw_metric_loss, roll_metric_loss)
+
+    # a fresh run must not keep the best of, or later resume from, an earlier run in this folder
+    if not args.resume and remove_checkpoints(save_root):
+        print('Removed the checkpoints of a previous run in %s'%save_root)
+    writer = CheckpointWriter(save_root, keep_last=args.keep_last, keep_best=args.keep_best)
+
+    def checkpoint(epoch, batch, running, score=None):
+        """the loop continues at batch of epoch with the running sums of that epoch"""
+        meta = {'epoch': epoch, 'batch': batch, 'best': (best_mae, best_epoch), 'running': running,
+                'metrics': [(m.sum_metric, m.num_inst) for m in loss_metrics], 'rng': rng_states()}
+        writer.save(trainer.optimizer.num_update, net, trainer, meta, score)
+
+    start_epoch, start_batch, resumed = 0, 0, None
+    if args.resume:
+        prefix = latest_checkpoint(save_root) if args.resume == 'auto' else args.resume
+        if prefix is not None:
+            resumed = load_checkpoint(prefix, net, trainer, _ctx)
+            start_epoch, start_batch = resumed['epoch'], resumed['batch']
+            best_mae, best_epoch = resumed['best']
+            set_rng_states(resumed['rng'], args.seed + trainer.optimizer.num_update)
+            print('Resume from %s: epoch %d, batch %d'%(prefix, start_epoch, start_batch))
+
+    for epoch in range(start_epoch, args.epochs):
         tic = time.time()
         btic = time.time()
         pitch_metric_loss.reset()
         yaw_metric_loss.reset()
         roll_metric_loss.reset()
         total, pitch_mae, yaw_mae, roll_mae = 0, 0, 0, 0
+        first_batch = start_batch if epoch == start_epoch else 0
+        if resumed is not None and first_batch > 0:
+            total, pitch_mae, yaw_mae, roll_mae = resumed['running']
+            for m, (sum_metric, num_inst) in zip(loss_metrics, resumed['metrics']):
+                m.sum_metric, m.num_inst = sum_metric, num_inst
+        sampler.set_epoch(epoch, first_batch)
+        accumulated = 0
         
         # if epoch in lr_decay_epoch:
         #     trainer.set_learning_rate(trainer.learning_rate*lr_decay)
             
  
-        for i, batch in enumerate(train_loader):
+        for i, batch in enumerate(train_loader, first_batch):
             data= batch[0].as_in_context(_ctx)
             bin_label=batch[1].as_in_context(_ctx)
             cont_label=batch[2].as_in_context(_ctx)
             total += len(cont_label)
             with mx.autograd.record():
-                outputs=net(data)
-                loss_pyr, mae = cal_loss(outputs, bin_label, cont_label, _ctx, args)
+                if args.hybrid_loss:
+                    *loss_pyr, pyr = train_net(data, bin_label, cont_label)
+                else:
+                    outputs=net(data)
+                    loss_pyr, mae = cal_loss(outputs, bin_label, cont_label, _ctx, args)
 
             mx.autograd.backward([*loss_pyr])
-            trainer.step(args.bs)
+            if args.hybrid_loss:
+                mae = mx.nd.abs(pyr-cont_label).sum(axis=0).asnumpy()
+            accumulated += 1
+            if accumulated == args.grad_accum:
+                step(trainer, net, args.bs*accumulated, args)
+                accumulated = 0
             pitch_metric_loss.update(0, loss_pyr[0])
             yaw_metric_loss.update(0, loss_pyr[1])
             roll_metric_loss.update(0, loss_pyr[2])
             pitch_mae += mae[0]
             yaw_mae += mae[1]
             roll_mae += mae[2]
+            if args.ckpt_interval and not (i+1)%args.ckpt_interval and i+1 < len(sampler) and not accumulated:
+                checkpoint(epoch, i+1, (total, pitch_mae, yaw_mae, roll_mae))
  
             if not (i+1)%args.log_interval:
                 sp = args.bs*args.log_interval/(time.time()-btic)
                 train_loss = (pitch_metric_loss.get()[1],  yaw_metric_loss.get()[1], roll_metric_loss.get()[1])
                 print('Epoch[%03d] Batch[%03d/%03d] Speed: %.2f samples/sec, Loss:(pitch, yaw, roll)/(%.3f, %.3f, %.3f)'%(epoch, 
                     i, len(train_loader), sp, *train_loss))
+                recorder.record('step', epoch=epoch, batch=i, num_update=trainer.optimizer.num_update, speed=sp,
+                                loss=train_loss, lr=trainer.learning_rate)
                 btic = time.time()
+        if accumulated:
+            step(trainer, net, args.bs*accumulated, args)
         
         train_loss = (pitch_metric_loss.get()[1], yaw_metric_loss.get()[1], roll_metric_loss.get()[1])
         mae_ = (pitch_mae/total, yaw_mae/total, roll_mae/total)
         train_mae = (*mae_, sum([*mae_])/3)
-        val_loss, val_mae = val(net, _ctx, val_loader, args)
-        train_history.update([*train_loss, *val_loss])
-        mae_history.update([*train_mae, *val_mae])
+        val_loss, val_mae = val(net, _ctx, val_data, args)
+        recorder.record('epoch', epoch=epoch, train_loss=train_loss, train_mae=train_mae, val_loss=val_loss,
+                        val_mae=val_mae, lr=trainer.learning_rate, cost=time.time()-tic)
         print('Epoch[%03d] train: MAE:(pitch, yaw, roll, mean)/(%.3f, %.3f, %.3f, %.3f), Cost=%d sec, lr=%f'%(epoch, *train_mae, time.time()-tic, trainer.learning_rate))
         print('Epoch[%03d] val  : MAE:(pitch, yaw, roll, mean)/(%.3f, %.3f, %.3f, %.3f), Loss:(pitch, yaw, roll)/(%.3f, %.3f, %.3f)'%(epoch, *val_mae, *val_loss))
         
@@ -206,28 +328,52 @@ def train(args):
             print('Min val mean MAE! save model!')
             best_mae = val_mae[3]
             best_epoch = epoch
-            net.export('%s/best_pose'%(save_root), epoch=0)
+            export_net = deploy_net(net, _ctx, args)
+            export_net(mx.nd.zeros((1, 3, args.input_size, args.input_size), ctx=_ctx))
+            writer.export('%s/best_pose'%(save_root), export_net)
+            if args.export_decoded:
+                writer.export('%s/best_pose_decoded'%(save_root), decoded_block(export_net, args.input_size, _ctx))
+        checkpoint(epoch+1, 0, (0, 0, 0, 0), val_mae[3])
+        if args.patience and epoch-best_epoch >= args.patience:
+            print('No better val mean MAE for %d epochs, stop!'%args.patience)
+            break
+    writer.close()
+    recorder.close()
 
     print('\n'*2+'Min mean MAE: %.3f, Epoch: %.3f'%(best_mae, best_epoch))
-    # max_ys = [max(i) for i in train_history.history.values()]
-    # train_history.plot(save_path='%s/loss_log.png'%(save_root), labels=train_history.labels, y_lim=(0, max(max_ys)))
-    # max_ys = [max(i) for i in mae_history.history.values()]
-    # mae_history.plot(save_path='%s/mae_log.png'%(save_root), labels=mae_history.labels, y_lim=(0, max(max_ys)))
  
-def val(net, _ctx, val_loader, args):
+def step(trainer, net, batch_size, args):
+    trainer.step(batch_size)
+    if args.grad_accum > 1:
+        net.collect_params().zero_grad()
+    # mxnet has no RNG state getter, the dropout masks after every update come from
+    # seed + num_update, which is also what a resume reseeds with
+    mx.random.seed(args.seed + trainer.optimizer.num_update)
+
+def val(net, _ctx, val_data, args):
     pitch_metric_loss = mx.metric.Loss()
     yaw_metric_loss = mx.metric.Loss()
     roll_metric_loss = mx.metric.Loss()
     
     total = 0
     pitch_mae, yaw_mae, roll_mae = 0, 0, 0
-    for i, batch in enumerate(val_loader):
-        data= batch[0].as_in_context(_ctx)
-        bin_label=batch[1].as_in_context(_ctx)
-        cont_label=batch[2].as_in_context(_ctx)
+    images, bin_labels, cont_labels = val_data
+    for i in range(0, len(images), args.val_bs):
+        batch = images[i:i+args.val_bs]
+        num = len(batch)
+        if num < args.val_bs and len(images) > args.val_bs:
+            # pad the last batch, the static graph keeps one shape
+            batch = np.concatenate([batch, np.zeros((args.val_bs-num, )+batch.shape[1:], dtype=batch.dtype)])
+        data = mx.nd.array(batch, ctx=_ctx, dtype='uint8')
+        data = Dataset.normalize(data.astype('float32'))
+        bin_label = mx.nd.array(bin_labels[i:i+args.val_bs], ctx=_ctx)
+        cont_label = mx.nd.array(cont_labels[i:i+args.val_bs], ctx=_ctx)
         total+=len(cont_label)
-        outputs = net(data)
-        loss_pyr, mae = cal_loss(outputs, bin_label, cont_label, _ctx, args)
+        with mx.autograd.predict_mode():
+            outputs = net(data)
+            if len(data) > num:
+                outputs = [o[:num] for o in outputs] if isinstance(outputs, (list, tuple)) else outputs[:num]
+            loss_pyr, mae = cal_loss(outputs, bin_label, cont_label, _ctx, args)
         pitch_metric_loss.update(0, loss_pyr[0])
         yaw_metric_loss.update(0, loss_pyr[1])
         roll_metric_loss.update(0, loss_pyr[2])